@@ -1,4 +1,14 @@
 
+import atexit
+import concurrent.futures
+import glob
+import json
+import multiprocessing.shared_memory
+import os
+import queue
+import threading
+
+import imageio.v3
 import numpy as np
 import skimage
 
@@ -20,91 +30,273 @@ def load_image(map_filename):
         return None
     return image
 
-def find_red_pixels(map_filename, upper_threshold=100, lower_threshold=50):
+def open_image(map_filename, shape=None, dtype=np.uint8):
+    """Opens an image without reading it all into memory when the file format allows it. '.npy' files and
+       uncompressed TIFF files are memory-mapped, and raw files ('.raw') are memory-mapped with the given shape.
+       Other formats are loaded with 'load_image'
+
+    Args:
+        map_filename (str): The filename of the input file
+        shape ((int, ...), optional): The shape of a raw image, e.g. (rows, columns, 4). Defaults to None.
+        dtype (np.dtype, optional): The type of the values in a raw image. Defaults to np.uint8.
+
+    Returns:
+        ndarray: The image data, which may be a read-only np.memmap. If no image could be loaded, this value is None
+    """
+    extension = os.path.splitext(map_filename)[1].lower()
+    try:
+        if extension == ".npy":
+            return np.load(map_filename, mmap_mode="r")
+        elif extension == ".raw":
+            if shape is None:
+                raise Exception("The shape of a raw image must be given!")
+            return np.memmap(map_filename, dtype=dtype, mode="r", shape=shape)
+        elif extension in (".tif", ".tiff"):
+            try:
+                import tifffile
+                return tifffile.memmap(map_filename, mode="r")
+            except (ImportError, ValueError):
+                # Without tifffile, or for compressed TIFF files, the image is loaded instead
+                pass
+    except Exception as err:
+        print(f"Failed to open image! Error: {err}")
+        return None
+    return load_image(map_filename)
+
+# Outputs are either not written, written before returning, or written by a background thread
+OUTPUT_MODES = ["off", "sync", "async"]
+OUTPUT_QUEUE_SIZE = 8
+
+def save_image(file_name, image_data, compress_level=None):
+    """Writes image data to a file in the format given by its extension. '.npy' files are written raw with numpy,
+       which is the fastest lossless format, and other formats are encoded with scikit-image (or imageio, which
+       scikit-image uses, when a '.png' compression level is given)
+
+    Args:
+        file_name (str): The filename of the output image
+        image_data (np.ndarray): The image data
+        compress_level (int, optional): The zlib compression level (0-9) of '.png' files, where lower levels are
+                                        faster but give larger files. Defaults to None, which uses the default level.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".npy":
+        np.save(file_name, image_data)
+    elif extension == ".png" and compress_level is not None:
+        imageio.v3.imwrite(file_name, image_data, compress_level=compress_level)
+    else:
+        skimage.io.imsave(file_name, image_data)
+
+class ImageWriter:
+    """Writes the output files of the intelligence functions. Output can be turned off, written synchronously, or handed
+    to a background thread through a bounded queue so analysis can continue while files are written.
+    Arrays which are written asynchronously must not be changed until they are flushed
+
+    Attributes:
+        mode (str): "off", "sync" or "async" (see OUTPUT_MODES)
+        compress_level (int): The compression level of '.png' files, or None for the default level
+        errors ([str]): The errors of the asynchronous writes since the last flush
+    """
+    def __init__(self, mode="sync", compress_level=None, queue_size=OUTPUT_QUEUE_SIZE):
+        if not mode in OUTPUT_MODES:
+            raise Exception("Output mode is not valid!")
+        self.mode = mode
+        self.compress_level = compress_level
+        self.errors = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def _run(self):
+        """Writes the queued files until the writer is closed"""
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                function, args = task
+                function(*args)
+            except Exception as err:
+                with self._lock:
+                    self.errors.append(f"Failed to write {args[0]}! Error: {err}")
+            finally:
+                self._queue.task_done()
+    
+    def submit(self, function, *args):
+        """Calls a function which writes a file, whose filename is the first argument, according to the output mode.
+           In "sync" mode errors are raised, in "async" mode they are kept in 'errors'. When the queue is full this
+           waits until there is space
+        """
+        if self.mode == "off":
+            return
+        elif self.mode == "sync":
+            function(*args)
+            return
+        
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put((function, args))
+    
+    def write_image(self, file_name, image_data):
+        """Writes image data to a file (see 'save_image')"""
+        self.submit(save_image, file_name, image_data, self.compress_level)
+    
+    def flush(self):
+        """Waits until every queued file is written
+
+        Returns:
+            [str]: The errors of the asynchronous writes since the last flush
+        """
+        if self._thread is not None:
+            self._queue.join()
+        with self._lock:
+            errors = self.errors
+            self.errors = []
+        return errors
+    
+    def close(self):
+        """Writes every queued file and stops the background thread
+
+        Returns:
+            [str]: The errors of the asynchronous writes since the last flush
+        """
+        errors = self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        return errors
+
+# The writer used by the intelligence functions when no writer is given
+DEFAULT_WRITER = ImageWriter("sync")
+
+def get_writer(writer=None):
+    """Returns the given writer, or DEFAULT_WRITER if it is None"""
+    return DEFAULT_WRITER if writer is None else writer
+
+# Each colour class is the level of the red, green and blue channels: 'high' is above the upper threshold
+# and 'low' is below the lower threshold
+COLOUR_CLASSES = {
+    "red": ("high", "low", "low"),
+    "green": ("low", "high", "low"),
+    "blue": ("low", "low", "high"),
+    "cyan": ("low", "high", "high"),
+    "magenta": ("high", "low", "high"),
+    "yellow": ("high", "high", "low"),
+}
+
+def get_image_data(image):
+    """Returns the image data for an image that is either already loaded or a filename
+
+    Args:
+        image (str / np.ndarray): The filename of the input image, or the image data itself
+
+    Returns:
+        ndarray: The image data, or None if the image could not be loaded
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    return load_image(image)
+
+def classify_pixels(image, colour_classes, upper_threshold=100, lower_threshold=50):
+    """Finds the pixels of several colour classes at once, using whole-array comparisons instead of a loop over the pixels
+
+    Args:
+        image (str / np.ndarray): The filename of the input image, or the RGB(A) image data
+        colour_classes ([str]): The colour classes to find, from COLOUR_CLASSES (e.g. ["red", "cyan"])
+        upper_threshold (int, optional): The minimum RGB value of a 'high' channel. Defaults to 100.
+        lower_threshold (int, optional): The maximum RGB value of a 'low' channel. Defaults to 50.
+
+    Exceptions:
+        Raises an exception if a colour class is not valid
+
+    Returns:
+        dict: The black and white mask for each colour class as a 2D array of unsigned bytes (255 where the pixel
+              is in the class and 0 otherwise). If the image could not be loaded, this value is None
+    """
+    for colour_class in colour_classes:
+        if not colour_class in COLOUR_CLASSES:
+            raise Exception("Colour class is not valid!")
+    
+    image_data = get_image_data(image)
+    if not isinstance(image_data, np.ndarray):
+        return None
+    
+    # Each channel is only compared against each threshold once, however many colour classes are found
+    levels = []
+    for channel in range(3):
+        channel_data = image_data[:, :, channel]
+        levels.append({"high": channel_data > upper_threshold, "low": channel_data < lower_threshold})
+    
+    masks = {}
+    for colour_class in colour_classes:
+        red_level, green_level, blue_level = COLOUR_CLASSES[colour_class]
+        mask = levels[0][red_level] & levels[1][green_level] & levels[2][blue_level]
+        # True is stored as 1, so multiplying gives 255 for the pixels in the class
+        masks[colour_class] = mask.view(np.uint8) * np.uint8(255)
+    return masks
+
+def find_red_pixels(map_filename, upper_threshold=100, lower_threshold=50, output_file="map-red-pixels.jpg",
+                    writer=None):
     """Takes an image and returns the number of red pixels in the image
 
     Args:
-        map_filename (str): The filename of the input image.
+        map_filename (str / np.ndarray): The filename of the input image, or the image data itself.
         upper_threshold (int, optional): The minimum red RGB value to be counted. Defaults to 100.
         lower_threshold (int, optional): The maximum non-red RGB value to be counted. Defaults to 50.
+        output_file (str, optional): The file the red pixels are written to. Defaults to "map-red-pixels.jpg".
+        writer (ImageWriter, optional): The writer of the output image. Defaults to None, which uses DEFAULT_WRITER.
 
     Returns:
         ndarray: The black and white output image as a 2D array of unsigned bytes
                  If there is an error loading or writing the image files, this function will return None
     """
-    image_data = load_image(map_filename)
-    x_size, y_size, _ = image_data.shape
-    
-    # Create new ndarray without alpha layer as jpg does not support the alpha channel
-    output_image_data = np.empty((x_size, y_size), np.uint8)
-    
-    if not type(image_data) is np.ndarray:
+    masks = classify_pixels(map_filename, ["red"], upper_threshold, lower_threshold)
+    if masks is None:
         print("Failed to find red pixel count! Image could not be loaded")
         return None
-    
-    for x in range(x_size):
-        for y in range(y_size):
-            current_color = image_data[x, y]
-            R = current_color[0]
-            G = current_color[1]
-            B = current_color[2]
-            # If pixel is red
-            if R > upper_threshold and G < lower_threshold and B < lower_threshold:
-                # Set colour to white
-                output_image_data[x, y] = 255
-            else:
-                # Set colour to black
-                output_image_data[x, y] = 0
+    output_image_data = masks["red"]
     
     # Write the new image to file
     try:
-        skimage.io.imsave("map-red-pixels.jpg", output_image_data)
+        get_writer(writer).write_image(output_file, output_image_data)
     except Exception as err:
         print(f"Failed to save red pixels to file! Error: {err}")
         return None
     
     return output_image_data
 
-def find_cyan_pixels(map_filename, upper_threshold=100, lower_threshold=50):
+def find_cyan_pixels(map_filename, upper_threshold=100, lower_threshold=50, output_file="map-cyan-pixels.jpg",
+                     writer=None):
     """Takes an image and writes a image to data/map-cyan-pixels.jpg containing the cyan pixels in black and white.
        This function also returns an array containing the cyan pixels
 
     Args:
-        map_filename (str): The filename of the input image.
+        map_filename (str / np.ndarray): The filename of the input image, or the image data itself.
         upper_threshold (int, optional): The minimum non-red RGB value to be counted. Defaults to 100.
         lower_threshold (int, optional): The maximum red RGB value to be counted. Defaults to 50.
+        output_file (str, optional): The file the cyan pixels are written to. Defaults to "map-cyan-pixels.jpg".
+        writer (ImageWriter, optional): The writer of the output image. Defaults to None, which uses DEFAULT_WRITER.
 
     Returns:
         ndarray: The black and white output image as a 2D array of unsigned bytes
                  If there is an error loading or writing the image files, this function will return None
     """
-    image_data = load_image(map_filename)
-    x_size, y_size, _ = image_data.shape
-    
-    # Create new ndarray without alpha layer as jpg does not support the alpha channel
-    output_image_data = np.empty((x_size, y_size), np.uint8)
-    
-    if not type(image_data) is np.ndarray:
+    masks = classify_pixels(map_filename, ["cyan"], upper_threshold, lower_threshold)
+    if masks is None:
         print("Failed to find cyan pixel count! Image could not be loaded")
         return None
-    
-    for x in range(x_size):
-        for y in range(y_size):
-            current_color = image_data[x, y]
-            R = current_color[0]
-            G = current_color[1]
-            B = current_color[2]
-            # If pixel is red
-            if R < lower_threshold and G > upper_threshold and B > upper_threshold:
-                # Set colour to white
-                output_image_data[x, y] = 255
-            else:
-                # Set colour to black
-                output_image_data[x, y] = 0
+    output_image_data = masks["cyan"]
     
     # Write the new image to file
     try:
-        skimage.io.imsave("map-cyan-pixels.jpg", output_image_data)
+        get_writer(writer).write_image(output_file, output_image_data)
     except Exception as err:
         print(f"Failed to save cyan pixels to file! Error: {err}")
         return None
@@ -146,6 +338,80 @@ def get_neighbors(input_array: np.ndarray, coords):
         neighbors.append((x+1, y+1))
     return neighbors
 
+# The fields of the structured array returned by 'component_statistics'
+COMPONENT_STATISTICS_TYPE = np.dtype([
+    ("id", np.int32),
+    ("size", np.int64),
+    ("row_min", np.int32),
+    ("row_max", np.int32),
+    ("column_min", np.int32),
+    ("column_max", np.int32),
+    ("centroid_row", np.float64),
+    ("centroid_column", np.float64),
+    ("perimeter", np.int64),
+])
+
+def component_statistics(mark: np.ndarray, sort_by="id"):
+    """Computes the size, bounding box, centroid and perimeter of every connected component with whole-array operations
+
+    Args:
+        mark (np.ndarray): the raw connected component data, where 0 is the background
+        sort_by (str, optional): 'id' for ascending ids, or 'size' for descending sizes (ties in ascending id order).
+                                 Defaults to 'id'.
+
+    Exceptions:
+        Raises an exception if sort_by is not valid
+
+    Returns:
+        np.ndarray: A structured array (COMPONENT_STATISTICS_TYPE) with a row for each component. The perimeter is the
+                    number of pixel edges between the component and anything else, including the edge of the image
+    """
+    if not sort_by in ("id", "size"):
+        raise Exception("Components can only be sorted by 'id' or 'size'!")
+    
+    x_size, y_size = mark.shape
+    positions = np.flatnonzero(mark)
+    ids = mark.ravel()[positions].astype(np.intp)
+    rows = positions // y_size
+    columns = positions % y_size
+    
+    id_count = int(ids.max()) + 1 if len(ids) > 0 else 1
+    sizes = np.bincount(ids, minlength=id_count)
+    present = np.flatnonzero(sizes[1:]) + 1
+    
+    row_min = np.full(id_count, x_size, np.int32)
+    row_max = np.full(id_count, -1, np.int32)
+    column_min = np.full(id_count, y_size, np.int32)
+    column_max = np.full(id_count, -1, np.int32)
+    np.minimum.at(row_min, ids, rows)
+    np.maximum.at(row_max, ids, rows)
+    np.minimum.at(column_min, ids, columns)
+    np.maximum.at(column_max, ids, columns)
+    
+    # Count the edges in each of the 4 directions where a component pixel borders a different value
+    padded = np.pad(mark, 1)
+    centre = padded[1:-1, 1:-1]
+    perimeters = np.zeros(id_count, np.int64)
+    for neighbor in (padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]):
+        is_edge = (centre != 0) & (neighbor != centre)
+        perimeters += np.bincount(centre[is_edge].astype(np.intp), minlength=id_count)
+    
+    statistics = np.empty(len(present), COMPONENT_STATISTICS_TYPE)
+    statistics["id"] = present
+    statistics["size"] = sizes[present]
+    statistics["row_min"] = row_min[present]
+    statistics["row_max"] = row_max[present]
+    statistics["column_min"] = column_min[present]
+    statistics["column_max"] = column_max[present]
+    statistics["centroid_row"] = np.bincount(ids, weights=rows, minlength=id_count)[present] / sizes[present]
+    statistics["centroid_column"] = np.bincount(ids, weights=columns, minlength=id_count)[present] / sizes[present]
+    statistics["perimeter"] = perimeters[present]
+    
+    if sort_by == "size":
+        # lexsort sorts by the last key first, so this is by descending size and then by ascending id
+        statistics = statistics[np.lexsort((statistics["id"], -statistics["size"]))]
+    return statistics
+
 def count_connected_components(mark: np.ndarray):
     """Groups connected components into a dictionary where the key is the connected component id and the
        value is the connected component size
@@ -154,97 +420,474 @@ def count_connected_components(mark: np.ndarray):
         mark (np.ndarray): the raw connected component data
 
     Returns:
-        dict: the connected components grouped by id
-    """
-    # Empty dictionary
-    connected_components = {}
-    
-    # Groups each connected component id into a dictionary key
-    for row in mark:
-        for value in row:
-            if value != 0:
-                if not value in connected_components.keys():
-                    connected_components[value] = 1
-                else:
-                    connected_components[value] += 1
-                           
-    return connected_components
-
-def write_connected_components_to_file(file_name, connected_components: dict):
-    """Writes a dictionary containing connected component data to a file where each newline corrosponds
-       to a connected component
+        dict: the connected components grouped by id, in ascending id order
+    """
+    sizes = np.bincount(mark.ravel().astype(np.intp))
+    ids = np.flatnonzero(sizes[1:]) + 1
+    return dict(zip(ids.tolist(), sizes[ids].tolist()))
+
+def write_connected_components_to_file(file_name, connected_components):
+    """Writes connected component data to a file where each newline corrosponds to a connected component
 
     Args:
         file_name (str): The filename of the output text file
-        connected_components (dict): the raw connected component data (Key = id, value = component size)
+        connected_components (dict / np.ndarray): the raw connected component data, either as a dictionary 
+            (Key = id, value = component size) or as the structured array from 'component_statistics'
+
+    Exceptions:
+        Raises an exception if the file cannot be written
     """
-    try:
-        file = open(file_name, "w")
-        for key in connected_components.keys():
-            file.write(f"Connected Component {key}, number of pixles = {connected_components[key]}\n")
-        file.write(f"Total number of connected components = {len(connected_components.values())}")
-        file.close()
-    except Exception as err:
-        print(f"Failed to write connected components to file! Error: {err}")
+    if isinstance(connected_components, np.ndarray):
+        components = zip(connected_components["id"].tolist(), connected_components["size"].tolist())
+    else:
+        components = connected_components.items()
+    
+    lines = [f"Connected Component {key}, number of pixles = {size}\n" for key, size in components]
+    lines.append(f"Total number of connected components = {len(connected_components)}")
+    # Errors are left to the writer that runs this, so asynchronous writes report them like image writes
+    with open(file_name, "w") as file:
+        file.writelines(lines)
+
+def find_runs(mask: np.ndarray):
+    """Finds every horizontal run of foreground (non-zero) pixels in a 2D mask, in raster order. Runs are given as keys
+    of row * (columns + 1) + column, so the runs of every row are sorted and separated from the next row by a gap
+
+    Args:
+        mask (np.ndarray): A 2D array where non-zero values are foreground
+
+    Returns:
+        (np.ndarray, np.ndarray): The key of the first column and of the last column + 1 of each run, as int32 unless
+                                  the mask is too large for it
+    """
+    x_size, y_size = mask.shape
+    # Pad each row with background, so every run has a rising and a falling edge within its row
+    padded = np.zeros((x_size, y_size + 2), bool)
+    padded[:, 1:-1] = mask != 0
+    # The edges have one column more than the mask, which is the gap between rows. Within a row they alternate
+    # between rising and falling
+    edges = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+    if x_size * (y_size + 1) < np.iinfo(np.int32).max // 2:
+        # Smaller keys make the searches and the union-find faster
+        edges = edges.astype(np.int32)
+    return edges[0::2], edges[1::2]
+
+def find_run_neighbors(starts, ends, row_length, connectivity=8):
+    """Finds every pair of runs in neighboring rows that touch each other
 
-def detect_connected_components(input_image: np.ndarray):
+    Args:
+        starts, ends (np.ndarray): The runs from 'find_runs'
+        row_length (int): The number of columns in the mask
+        connectivity (int, optional): 8 if diagonal pixels touch, or 4 if they do not. Defaults to 8.
+
+    Returns:
+        (np.ndarray, np.ndarray): The index of each run and the index of a touching run in the row above
+    """
+    # Diagonal neighbors reach one column further on each side
+    reach = 1 if connectivity == 8 else 0
+    stride = row_length + 1
+    # The runs in the row above that touch a run are a contiguous range, as runs in a row are sorted and disjoint
+    first = np.searchsorted(ends, starts - (stride + reach), side="right").astype(starts.dtype)
+    counts = np.searchsorted(starts, ends - (stride - reach), side="left").astype(starts.dtype) - first
+    
+    # Pair each run with the k-th run of its range, for every k, so the work is the number of pairs
+    runs = [np.flatnonzero(counts > 0).astype(starts.dtype)]
+    touching_runs = [first[runs[0]]]
+    while len(runs[-1]) > 0:
+        k = len(runs)
+        following = runs[-1][counts[runs[-1]] > k]
+        runs.append(following)
+        touching_runs.append(first[following] + k)
+    return np.concatenate(runs), np.concatenate(touching_runs)
+
+def resolve_equivalences(count, first, second):
+    """A union-find over flat integer arrays: returns the root of each of 'count' items, given pairs of equivalent items.
+    The root of a group is its smallest item. Trees are hooked and compressed for every pair at once, so the number of
+    iterations grows with the log of the group size rather than the number of pairs
+
+    Args:
+        count (int): The number of items
+        first, second (np.ndarray): The pairs of equivalent items
+
+    Returns:
+        np.ndarray: The smallest equivalent item for every item
+    """
+    parent = np.arange(count, dtype=np.result_type(first, second))
+    while len(first) > 0:
+        first_roots = parent[first]
+        second_roots = parent[second]
+        different = first_roots != second_roots
+        if not np.any(different):
+            break
+        first, second = first[different], second[different]
+        first_roots, second_roots = first_roots[different], second_roots[different]
+        # Hook the larger root onto the smallest root it is equivalent to
+        np.minimum.at(parent, np.maximum(first_roots, second_roots), np.minimum(first_roots, second_roots))
+        # Compress the trees, so every item points straight at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+def label_components(mask: np.ndarray, connectivity=8, return_first_pixels=False):
+    """Labels the connected components of a 2D mask with two raster passes: the first pass finds runs of foreground pixels
+    and joins touching runs with a union-find, the second pass writes the component id of each run.
+    Ids start at 1 and are in the order that the first pixel of each component is reached in raster order, which is the
+    same as a breadth first search that scans the image row by row
+
+    Args:
+        mask (np.ndarray): A 2D array where non-zero values are foreground
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        return_first_pixels (bool, optional): Also return the first pixel of each component. Defaults to False.
+
+    Exceptions:
+        Raises an exception if the connectivity is not 4 or 8
+
+    Returns:
+        np.ndarray: A 2D array of int32 where each item is the id of its connected component, or 0 for the background.
+        If return_first_pixels is True, the raster index (row * columns + column) of the first pixel of each component
+        is also returned
+    """
+    if not connectivity in (4, 8):
+        raise Exception("Connectivity must be 4 or 8!")
+    x_size, y_size = mask.shape
+    
+    starts, ends = find_runs(mask)
+    runs, touching_runs = find_run_neighbors(starts, ends, y_size, connectivity)
+    roots = resolve_equivalences(len(starts), runs, touching_runs)
+    
+    # Runs are in raster order and roots are the smallest run of each component, so numbering the roots in order
+    # gives the ids in the order each component is first reached
+    is_root = roots == np.arange(len(roots))
+    run_ids = np.cumsum(is_root, dtype=np.int32)[roots]
+    
+    # Write the ids with a difference array: each run adds its id at its first pixel and removes it after its last.
+    # The keys have one more column in each row than the mask, so the row is taken off to get the raster index
+    rows = starts // (y_size + 1)
+    run_starts = starts - rows
+    differences = np.zeros(x_size * y_size + 1, np.int32)
+    differences[run_starts] += run_ids
+    differences[ends - rows] -= run_ids
+    mark = np.cumsum(differences[:-1], dtype=np.int32).reshape(x_size, y_size)
+    
+    if return_first_pixels:
+        return mark, run_starts[is_root]
+    return mark
+
+def detect_connected_components(input_image: np.ndarray, connectivity=8, workers=1, output_file="cc-output-2a.txt",
+                                writer=None):
     """Takes an image and returns a 2D array where each value is a unique identifier for a connected component
 
     Args:
         input_image (np.ndarray): A 2D array which contains the strictly black and white colour data
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        workers (int, optional): The number of processes used to label the image, or None for one per CPU. Defaults to 1.
+        output_file (str, optional): The file the connected components are written to. Defaults to "cc-output-2a.txt".
+        writer (ImageWriter, optional): The writer of the output file. Defaults to None, which uses DEFAULT_WRITER.
 
     Returns:
         np.ndarray: A 2D array where each item corrosponds to a unique id for a connected component
     """
-    
-    # IMPROVMENTS AND MODIFICATIONS MADE TO ALGORITHM:
-    #   Algorithm now has a counter, 'component_count,' that increments by one each time it encounters a
-    #   new connected component. This counter value is used as a unique ID for each connected component.
-    #   MARK[x, y] is set to the counter value, instead of 1
-    
     PAVEMENT_COLOUR = 255
-    NOT_VISITED = 0
-    component_count = NOT_VISITED + 1
-    
-    x_size, y_size = input_image.shape
-    # Make MAKE initally empty
-    mark = np.zeros((x_size, y_size), type(int))
-    # Queue is initially empty
-    # Queue is sized to hold the entire MARK array, so it never runs out of memory
-    queue = np.empty((x_size * y_size), dtype=type((int, int)))
-    queue_ptr = 0
-    
-    for x in np.arange(x_size):
-        for y in np.arange(y_size):
-            if input_image[x, y] == PAVEMENT_COLOUR and mark[x, y] == NOT_VISITED:       
-                mark[x, y] = component_count
-                # Add p(x, y) to queue
-                queue[queue_ptr] = (x, y)
-                queue_ptr += 1
-                # While queue not empty
-                while queue_ptr > 0:
-                    # Pop first item off queue
-                    queue_ptr -= 1
-                    x0, y0 = queue[queue_ptr]
-                    neighbors = get_neighbors(input_image, (x0, y0))
-                    for neighbor in neighbors:
-                        if input_image[neighbor] == PAVEMENT_COLOUR and mark[neighbor] == NOT_VISITED:
-                            mark[neighbor] = component_count
-                            # Add n(s, t) to queue
-                            queue[queue_ptr] = neighbor
-                            queue_ptr += 1
-                component_count += 1
+    
+    # Component ids are in the same order as the original breadth first search, which started a new component
+    # each time it reached an unvisited pavement pixel while scanning the image row by row
+    if workers == 1:
+        mark = label_components(input_image == PAVEMENT_COLOUR, connectivity)
+    else:
+        mark = label_components_parallel(input_image == PAVEMENT_COLOUR, connectivity, workers)
                 
-    connected_components = count_connected_components(mark)
-    # Sort connected connected_components by key, as they lose their order when counted with the 
-    # 'count_connected_components' function
-    connected_components = bullshit_sort_keys(connected_components)
-    write_connected_components_to_file("cc-output-2a.txt", connected_components)
+    # Statistics are in ascending id order
+    connected_components = component_statistics(mark)
+    try:
+        get_writer(writer).submit(write_connected_components_to_file, output_file, connected_components)
+    except Exception as err:
+        print(f"Failed to write connected components to file! Error: {err}")
     
     return mark
     
+def iter_tiles(shape, tile_size):
+    """Yields the slices of every tile of a 2D array, in raster order of the tiles
+
+    Args:
+        shape ((int, int)): The shape of the array
+        tile_size (int / (int, int)): The number of rows and columns in each tile (tiles at the edge may be smaller)
+    """
+    tile_rows, tile_columns = (tile_size, tile_size) if isinstance(tile_size, int) else tile_size
+    x_size, y_size = shape[:2]
+    for row in range(0, x_size, tile_rows):
+        for column in range(0, y_size, tile_columns):
+            yield (slice(row, min(row + tile_rows, x_size)), slice(column, min(column + tile_columns, y_size)))
+
+def find_seam_pairs(before: np.ndarray, after: np.ndarray, connectivity=8):
+    """Finds the pairs of labels which touch across a seam between two neighboring lines of labels
+
+    Args:
+        before (np.ndarray): The labels of the line before the seam (the row above or the column to the left)
+        after (np.ndarray): The labels of the line after the seam, with the same length as 'before'
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+
+    Returns:
+        (np.ndarray, np.ndarray): The label before and the label after the seam of every touching pair
+    """
+    pairs = [(before, after)]
+    if connectivity == 8:
+        pairs += [(before[:-1], after[1:]), (before[1:], after[:-1])]
+    first = np.concatenate([line for line, _ in pairs])
+    second = np.concatenate([line for _, line in pairs])
+    touching = (first != 0) & (second != 0)
+    return first[touching], second[touching]
+
+def merge_block_labels(label_count, first, second, first_pixels):
+    """Merges labels which were given separately to blocks of an image (tiles or strips) into final component ids
+
+    Args:
+        label_count (int): The number of labels, where labels are 1 to label_count
+        first, second (np.ndarray): The pairs of labels which touch across block seams
+        first_pixels (np.ndarray): The raster index of the first pixel of each label (label 1 is at position 0)
+
+    Returns:
+        (np.ndarray, int): A lookup table from each label (and 0 for the background) to its final component id, where ids
+                           are in raster order of their first pixel like 'label_components', and the number of components
+    """
+    roots = resolve_equivalences(label_count, first - 1, second - 1)
+    # The first pixel of a component is the first of the first pixels of all its labels
+    component_first_pixels = np.full(label_count, np.iinfo(np.int64).max, np.int64)
+    np.minimum.at(component_first_pixels, roots, first_pixels)
+    
+    component_roots = np.flatnonzero(roots == np.arange(label_count))
+    component_roots = component_roots[np.argsort(component_first_pixels[component_roots], kind="stable")]
+    root_ids = np.zeros(label_count, np.int32)
+    root_ids[component_roots] = np.arange(1, len(component_roots) + 1, dtype=np.int32)
+    
+    lookup = np.zeros(label_count + 1, np.int32)
+    lookup[1:] = root_ids[roots]
+    return lookup, len(component_roots)
+
+def label_components_tiled(image, tile_size=1024, connectivity=8, colour_class=None, upper_threshold=100,
+                           lower_threshold=50, output_filename=None):
+    """Labels the connected components of a large image one tile at a time, so only a tile of pixels is processed at once.
+       Each tile is classified and labelled on its own, then labels which touch across tile seams are merged with a
+       union-find and the tiles are relabelled. The ids are the same as 'label_components' gives for the whole image
+
+    Args:
+        image (str / np.ndarray): The filename of the input image (opened with 'open_image'), or the image data. This is
+                                  a 2D mask where non-zero values are foreground, or an RGB(A) image if colour_class is given
+        tile_size (int / (int, int), optional): The number of rows and columns in each tile. Defaults to 1024.
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        colour_class (str, optional): The colour class from COLOUR_CLASSES which is foreground. Defaults to None.
+        upper_threshold (int, optional): The minimum RGB value of a 'high' channel. Defaults to 100.
+        lower_threshold (int, optional): The maximum RGB value of a 'low' channel. Defaults to 50.
+        output_filename (str, optional): A '.npy' file to write the labels to as a memory-mapped array, so the labels
+                                         do not have to fit in memory either. Defaults to None.
+
+    Returns:
+        np.ndarray: A 2D array of int32 where each item is the id of its connected component, or 0 for the background.
+                    If the image could not be loaded, this value is None
+    """
+    image_data = open_image(image) if isinstance(image, str) else image
+    if not isinstance(image_data, np.ndarray):
+        print("Failed to label components! Image could not be loaded")
+        return None
+    
+    x_size, y_size = image_data.shape[:2]
+    if output_filename is None:
+        mark = np.zeros((x_size, y_size), np.int32)
+    else:
+        mark = np.lib.format.open_memmap(output_filename, mode="w+", dtype=np.int32, shape=(x_size, y_size))
+    
+    label_count = 0
+    first_pixels = []
+    seam_firsts = []
+    seam_seconds = []
+    for rows, columns in iter_tiles((x_size, y_size), tile_size):
+        tile = np.asarray(image_data[rows, columns])
+        if colour_class is not None:
+            tile = classify_pixels(tile, [colour_class], upper_threshold, lower_threshold)[colour_class]
+        tile_mark, tile_first_pixels = label_components(tile, connectivity, return_first_pixels=True)
+        
+        # Give the labels of this tile numbers after the labels of the earlier tiles
+        tile_mark[tile_mark != 0] += label_count
+        mark[rows, columns] = tile_mark
+        label_count += len(tile_first_pixels)
+        tile_y_size = columns.stop - columns.start
+        first_pixels.append((rows.start + tile_first_pixels // tile_y_size) * y_size + columns.start + tile_first_pixels % tile_y_size)
+        
+        # Seams with the tiles above and to the left, which are already labelled. The seam above reaches one column
+        # past the tile on each side, which covers the diagonal neighbors in the corner tiles
+        if rows.start > 0:
+            seam_columns = slice(max(columns.start - 1, 0), min(columns.stop + 1, y_size))
+            first, second = find_seam_pairs(mark[rows.start - 1, seam_columns], mark[rows.start, seam_columns], connectivity)
+            seam_firsts.append(first)
+            seam_seconds.append(second)
+        if columns.start > 0:
+            first, second = find_seam_pairs(mark[rows, columns.start - 1], mark[rows, columns.start], connectivity)
+            seam_firsts.append(first)
+            seam_seconds.append(second)
+    
+    lookup, _ = merge_block_labels(label_count, np.concatenate(seam_firsts + [np.zeros(0, np.int32)]).astype(np.intp),
+                                   np.concatenate(seam_seconds + [np.zeros(0, np.int32)]).astype(np.intp),
+                                   np.concatenate(first_pixels + [np.zeros(0, np.int64)]))
+    for rows, columns in iter_tiles((x_size, y_size), tile_size):
+        mark[rows, columns] = lookup[mark[rows, columns]]
+    
+    if isinstance(mark, np.memmap):
+        mark.flush()
+    return mark
+
+def label_strip(mask_name, mark_name, shape, row_start, row_stop, connectivity):
+    """Labels one horizontal strip of a mask in shared memory, in a worker process of 'label_components_parallel'
+
+    Args:
+        mask_name (str): The name of the shared memory which holds the mask as uint8
+        mark_name (str): The name of the shared memory which the int32 labels are written to
+        shape ((int, int)): The shape of the whole mask
+        row_start, row_stop (int): The rows of the strip
+        connectivity (int): 8 if diagonal pixels are connected, or 4 if they are not
+
+    Returns:
+        np.ndarray: The raster index in the whole mask of the first pixel of each label in the strip
+    """
+    mask_memory = multiprocessing.shared_memory.SharedMemory(name=mask_name)
+    mark_memory = multiprocessing.shared_memory.SharedMemory(name=mark_name)
+    try:
+        mask = np.ndarray(shape, np.uint8, buffer=mask_memory.buf)
+        mark = np.ndarray(shape, np.int32, buffer=mark_memory.buf)
+        mark[row_start:row_stop], first_pixels = label_components(mask[row_start:row_stop], connectivity, True)
+        del mask, mark
+    finally:
+        mask_memory.close()
+        mark_memory.close()
+    return first_pixels + row_start * shape[1]
+
+def relabel_strip(mark_name, shape, row_start, row_stop, lookup):
+    """Replaces the labels of one horizontal strip in shared memory with the ids from a lookup table, in a worker process
+       of 'label_components_parallel'
+
+    Args:
+        mark_name (str): The name of the shared memory which holds the int32 labels
+        shape ((int, int)): The shape of the whole mask
+        row_start, row_stop (int): The rows of the strip
+        lookup (np.ndarray): The id of each label of the strip, where lookup[0] is 0
+    """
+    mark_memory = multiprocessing.shared_memory.SharedMemory(name=mark_name)
+    try:
+        mark = np.ndarray(shape, np.int32, buffer=mark_memory.buf)
+        mark[row_start:row_stop] = lookup[mark[row_start:row_stop]]
+        del mark
+    finally:
+        mark_memory.close()
+
+# The worker processes and the shared memory of 'label_components_parallel' are kept between calls, so a batch of
+# images only starts them once. One call uses them at a time
+label_executors = {}
+label_memory = {"mask": None, "mark": None}
+label_lock = threading.Lock()
+
+def get_label_executor(workers):
+    """Returns the long-lived pool of processes which labels strips, with the given number of processes. The caller
+       must hold label_lock"""
+    if not workers in label_executors:
+        label_executors[workers] = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return label_executors[workers]
+
+def get_label_memory(name, size):
+    """Returns the shared memory block 'mask' or 'mark' with at least size bytes, replacing it if it is too small.
+       The caller must hold label_lock"""
+    memory = label_memory[name]
+    if memory is None or memory.size < size:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+        memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(size, 1))
+        label_memory[name] = memory
+    return memory
+
+def close_label_executors():
+    """Stops the labelling processes and frees their shared memory. They are created again if more images are labelled"""
+    with label_lock:
+        for executor in label_executors.values():
+            executor.shutdown(wait=True)
+        label_executors.clear()
+        for name, memory in label_memory.items():
+            if memory is not None:
+                memory.close()
+                memory.unlink()
+            label_memory[name] = None
+
+atexit.register(close_label_executors)
+
+def label_components_parallel(mask: np.ndarray, connectivity=8, workers=None):
+    """Labels the connected components of a 2D mask using several processes. The mask is split into horizontal strips
+       which are labelled at the same time from shared memory, then labels which touch across strip boundaries are merged
+       and the strips are relabelled. The ids are the same as 'label_components' gives
+
+    Args:
+        mask (np.ndarray): A 2D array where non-zero values are foreground
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        workers (int, optional): The number of processes (and strips), or None for one per CPU. Defaults to None.
+
+    Exceptions:
+        Raises an exception if the connectivity is not 4 or 8
+
+    Returns:
+        np.ndarray: A 2D array of int32 where each item is the id of its connected component, or 0 for the background
+    """
+    if not connectivity in (4, 8):
+        raise Exception("Connectivity must be 4 or 8!")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    x_size, y_size = mask.shape
+    strip_count = max(min(workers, x_size), 1)
+    if strip_count == 1:
+        return label_components(mask, connectivity)
+    
+    boundaries = np.linspace(0, x_size, strip_count + 1).astype(int)
+    strips = list(zip(boundaries[:-1], boundaries[1:]))
+    
+    with label_lock:
+        mask_memory = get_label_memory("mask", mask.size)
+        mark_memory = get_label_memory("mark", mask.size * 4)
+        executor = get_label_executor(strip_count)
+        shared_mask = np.ndarray(mask.shape, np.uint8, buffer=mask_memory.buf)
+        mark = np.ndarray(mask.shape, np.int32, buffer=mark_memory.buf)
+        try:
+            np.not_equal(mask, 0, out=shared_mask, casting="unsafe")
+            first_pixels = list(executor.map(label_strip, *zip(*[
+                (mask_memory.name, mark_memory.name, mask.shape, start, stop, connectivity) for start, stop in strips])))
+            
+            # Number the labels of each strip after the labels of the strips above it
+            offsets = np.cumsum([0] + [len(pixels) for pixels in first_pixels])
+            seam_firsts = []
+            seam_seconds = []
+            for index in range(1, strip_count):
+                row = strips[index][0]
+                before = np.where(mark[row - 1] != 0, mark[row - 1] + offsets[index - 1], 0)
+                after = np.where(mark[row] != 0, mark[row] + offsets[index], 0)
+                first, second = find_seam_pairs(before, after, connectivity)
+                seam_firsts.append(first)
+                seam_seconds.append(second)
+            
+            lookup, _ = merge_block_labels(offsets[-1], np.concatenate(seam_firsts).astype(np.intp),
+                                           np.concatenate(seam_seconds).astype(np.intp), np.concatenate(first_pixels))
+            strip_lookups = [np.concatenate(([0], lookup[offsets[index] + 1:offsets[index + 1] + 1]))
+                             for index in range(strip_count)]
+            list(executor.map(relabel_strip, *zip(*[
+                (mark_memory.name, mask.shape, start, stop, strip_lookup)
+                for (start, stop), strip_lookup in zip(strips, strip_lookups)])))
+            result = mark.copy()
+        except concurrent.futures.process.BrokenProcessPool:
+            # A pool whose process died cannot be used again, so the next call starts a new one
+            label_executors.pop(strip_count, None)
+            raise
+        finally:
+            # The views must be released before the shared memory can be replaced or closed
+            del shared_mask, mark
+    return result
+
 def bullshit_sort_values(dictionary: dict):
-    """Sorts a dictionary in descending order using bubblesort
+    """Sorts a dictionary in descending order of its values. Keys with equal values keep their order
 
     Args:
         dictionary (dict): The dictionary that will be sorted
@@ -252,22 +895,11 @@ def bullshit_sort_values(dictionary: dict):
     Returns:
         dict: The sorted dictionary
     """
-    # Sorts with highest to lowest
-    keys = list(dictionary.keys())
-    values = list(dictionary.values())
-    for i in range(len(keys)):
-        for j in range(len(values) - i - 1):
-            if values[j] < values[j+1]:
-                # Swap both values
-                values[j], values[j+1] = values[j+1], values[j]
-                # Swap both keys
-                keys[j], keys[j+1] = keys[j+1], keys[j]
-    
-    dictionary = dict(zip(keys, values))
-    return dictionary
+    # sorted is stable, so equal values keep the order they had in the dictionary
+    return dict(sorted(dictionary.items(), key=lambda item: item[1], reverse=True))
 
 def bullshit_sort_keys(dictionary: dict):
-    """Sorts a dictionary in ascending order using bubblesort
+    """Sorts a dictionary in ascending order of its keys
 
     Args:
         dictionary (dict): The dictionary that will be sorted
@@ -275,48 +907,201 @@ def bullshit_sort_keys(dictionary: dict):
     Returns:
         dict: The sorted dictionary
     """
-    # Sorts with highest to lowest
-    keys = list(dictionary.keys())
-    values = list(dictionary.values())
-    for i in range(len(keys)):
-        for j in range(len(values) - i - 1):
-            if keys[j] > keys[j+1]:
-                # Swap both values
-                values[j], values[j+1] = values[j+1], values[j]
-                # Swap both keys
-                keys[j], keys[j+1] = keys[j+1], keys[j]
-    
-    dictionary = dict(zip(keys, values))
-    return dictionary
-
-def detect_connected_components_sorted(mark: np.ndarray):
+    return dict(sorted(dictionary.items(), key=lambda item: item[0]))
+
+def render_components(mark: np.ndarray, ids, colours=None, out=None):
+    """Draws the given connected components in one step, by looking up the colour of every pixel's id in a table
+       which has an entry for each id
+
+    Args:
+        mark (np.ndarray): A 2D array of component ids, where 0 is the background
+        ids ([int] / np.ndarray): The ids of the components to draw
+        colours (np.ndarray, optional): The colour of each component in ids, either one value per component or one
+                                        row of channels per component, e.g. [[255, 0, 0], [0, 255, 0]] for RGB.
+                                        Defaults to None, which draws every component in white (255).
+        out (np.ndarray, optional): A preallocated array to draw into, with the shape of mark (and the number of
+                                    channels of colours). Defaults to None, which allocates a new array.
+
+    Returns:
+        np.ndarray: The drawn image, where every other pixel is 0. The type is uint8, or the type of colours or out
+    """
+    ids = np.asarray(ids, np.intp).ravel()
+    if colours is None:
+        colours = np.full(len(ids), 255, np.uint8)
+    else:
+        colours = np.asarray(colours)
+        if colours.dtype == np.int_ and out is None:
+            colours = colours.astype(np.uint8)
+    if len(colours) != len(ids):
+        raise Exception("There must be a colour for each component!")
+    
+    lookup = np.zeros((max(int(mark.max(initial=0)), int(ids.max(initial=0))) + 1,) + colours.shape[1:],
+                      colours.dtype if out is None else out.dtype)
+    lookup[ids] = colours
+    # The background is never drawn, even if it is in ids
+    lookup[0] = 0
+    return np.take(lookup, mark, axis=0, out=out)
+
+def detect_connected_components_sorted(mark: np.ndarray, output_file="cc-output-2b.txt", image_file="cc-top-2.jpg",
+                                       writer=None, top=2):
     """Writes the connected components to "cc-output-2b.txt" in decending order and 
        Writes the largest 2 connected components to "cc-top-2.jpg" in white
 
     Args:
         mark (ndarray): A representation of the connected components' pixels, where
         mark's values represent the id of the connected component
+        output_file (str, optional): The file the sorted connected components are written to. Defaults to "cc-output-2b.txt".
+        image_file (str, optional): The file the largest components are written to. Defaults to "cc-top-2.jpg".
+        writer (ImageWriter, optional): The writer of the output files. Defaults to None, which uses DEFAULT_WRITER.
+        top (int, optional): The number of largest components drawn in the image. Defaults to 2.
+
+    Returns:
+        np.ndarray: The statistics of the connected components in descending order of size
     """
-    # Sort connected components
-    components = count_connected_components(mark)
-    sorted_components = bullshit_sort_values(components)
+    # Sort connected components by descending size
+    sorted_components = component_statistics(mark, sort_by="size")
     
-    write_connected_components_to_file("cc-output-2b.txt", sorted_components)
+    try:
+        get_writer(writer).submit(write_connected_components_to_file, output_file, sorted_components)
+    except Exception as err:
+        print(f"Failed to write connected components to file! Error: {err}")
 
-    # Get top 2 largest components' keys
-    largest_component_keys = list(sorted_components.keys())[:2]
-    x_size, y_size = mark.shape
-    output_image_data = np.empty((x_size, y_size), np.uint8)
-    # Write white pixles for the 2 largest connected components and black otherwise
-    for x in np.arange(x_size):
-        for y in np.arange(y_size):
-            if mark[x, y] in largest_component_keys:
-                output_image_data[x, y] = 255
-            else:
-                output_image_data[x, y] = 0
-                
+    # Write white pixles for the largest connected components and black otherwise
+    output_image_data = render_components(mark, sorted_components["id"][:top])
+    
     # Write the new image to file
     try:
-        skimage.io.imsave("cc-top-2.jpg", output_image_data)
+        get_writer(writer).write_image(image_file, output_image_data)
     except Exception as err:
-        print(f"Failed to save largest connected components to file! Error: {err}")
\ No newline at end of file
+        print(f"Failed to save largest connected components to file! Error: {err}")
+    
+    return sorted_components
+
+MAP_IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".tif", ".tiff", ".npy"]
+BATCH_INDEX_FILE = "index.json"
+
+def find_map_images(path):
+    """Finds the map images in a directory, or the files which match a glob pattern
+
+    Args:
+        path (str): A directory, which is searched for files with an extension in MAP_IMAGE_EXTENSIONS,
+                    or a glob pattern such as "maps/*.png"
+
+    Returns:
+        [str]: The sorted filenames of the map images
+    """
+    if os.path.isdir(path):
+        return sorted(file_name for file_name in glob.glob(os.path.join(path, "*"))
+                      if os.path.splitext(file_name)[1].lower() in MAP_IMAGE_EXTENSIONS)
+    return sorted(file_name for file_name in glob.glob(path) if os.path.isfile(file_name))
+
+def get_batch_output_dirs(map_filenames, output_dir):
+    """Gives each map image its own output directory, named after the image. Images with the same name
+       (from different directories) are numbered so their outputs do not overwrite each other
+
+    Args:
+        map_filenames ([str]): The filenames of the map images
+        output_dir (str): The directory that holds the output directories
+
+    Returns:
+        [str]: The output directory of each map image
+    """
+    output_dirs = []
+    used_names = set()
+    for map_filename in map_filenames:
+        base_name = os.path.splitext(os.path.basename(map_filename))[0]
+        name = base_name
+        number = 1
+        while name in used_names:
+            number += 1
+            name = f"{base_name}-{number}"
+        used_names.add(name)
+        output_dirs.append(os.path.join(output_dir, name))
+    return output_dirs
+
+def analyse_map(map_filename, output_dir, colours=("red", "cyan"), upper_threshold=100, lower_threshold=50,
+                connectivity=8, image_format="jpg", output_mode="async", compress_level=None):
+    """Runs the whole analysis of one map image and writes the outputs to its own directory. For each colour this writes
+       '<colour>-pixels.jpg', '<colour>-cc-output-2a.txt', '<colour>-cc-output-2b.txt' and '<colour>-cc-top-2.jpg'
+       (the images use image_format as their extension)
+
+    Args:
+        map_filename (str): The filename of the map image
+        output_dir (str): The directory the outputs are written to, which is created if it does not exist
+        colours ((str, ...), optional): The colour classes to analyse. Defaults to ("red", "cyan").
+        upper_threshold (int, optional): The minimum RGB value of a 'high' channel. Defaults to 100.
+        lower_threshold (int, optional): The maximum RGB value of a 'low' channel. Defaults to 50.
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        image_format (str, optional): The format of the output images, e.g. "jpg", "png" or "npy". Defaults to "jpg".
+        output_mode (str, optional): The output mode of the ImageWriter (see OUTPUT_MODES). Defaults to "async".
+        compress_level (int, optional): The compression level of "png" images. Defaults to None.
+
+    Returns:
+        dict: A summary of the analysis with the image, its output directory, an error message (or None) and, for each
+              colour, the number of pixels and components and the size of the largest component
+    """
+    summary = {"image": map_filename, "output_dir": output_dir, "error": None}
+    # The images of one colour are written while the next colour is analysed
+    writer = ImageWriter(output_mode, compress_level)
+    try:
+        image = open_image(map_filename)
+        if image is None:
+            raise Exception("Image could not be loaded")
+        os.makedirs(output_dir, exist_ok=True)
+        masks = classify_pixels(image, list(colours), upper_threshold, lower_threshold)
+        
+        for colour in colours:
+            output_file = os.path.join(output_dir, colour + "-")
+            writer.write_image(f"{output_file}pixels.{image_format}", masks[colour])
+            mark = detect_connected_components(masks[colour], connectivity, output_file=output_file + "cc-output-2a.txt",
+                                               writer=writer)
+            components = detect_connected_components_sorted(mark, output_file + "cc-output-2b.txt",
+                                                            f"{output_file}cc-top-2.{image_format}", writer)
+            summary[colour] = {
+                "pixels": int(np.count_nonzero(masks[colour])),
+                "components": len(components),
+                "largest_component": int(components["size"][0]) if len(components) > 0 else 0
+            }
+    except Exception as err:
+        summary["error"] = str(err)
+    
+    errors = writer.close()
+    if summary["error"] is None and len(errors) > 0:
+        summary["error"] = "; ".join(errors)
+    return summary
+
+def analyse_maps(path, output_dir="map-analysis", workers=None, colours=("red", "cyan"), upper_threshold=100,
+                 lower_threshold=50, connectivity=8, image_format="jpg", output_mode="async", compress_level=None):
+    """Analyses a batch of map images at the same time with a pool of processes, writing the outputs of each image to
+       its own directory in output_dir and a summary of every image to 'index.json' in output_dir
+
+    Args:
+        path (str / [str]): A directory or glob pattern of map images (see 'find_map_images'), or a list of filenames
+        output_dir (str, optional): The directory the outputs are written to. Defaults to "map-analysis".
+        workers (int, optional): The most images analysed at the same time, or None for one per CPU. Defaults to None.
+        colours ((str, ...), optional): The colour classes to analyse. Defaults to ("red", "cyan").
+        upper_threshold (int, optional): The minimum RGB value of a 'high' channel. Defaults to 100.
+        lower_threshold (int, optional): The maximum RGB value of a 'low' channel. Defaults to 50.
+        connectivity (int, optional): 8 if diagonal pixels are connected, or 4 if they are not. Defaults to 8.
+        image_format (str, optional): The format of the output images, e.g. "jpg", "png" or "npy". Defaults to "jpg".
+        output_mode (str, optional): The output mode of the ImageWriter (see OUTPUT_MODES). Defaults to "async".
+        compress_level (int, optional): The compression level of "png" images. Defaults to None.
+
+    Returns:
+        [dict]: The summary of each image (see 'analyse_map') in the order of the images
+    """
+    map_filenames = find_map_images(path) if isinstance(path, str) else list(path)
+    output_dirs = get_batch_output_dirs(map_filenames, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    summaries = []
+    if len(map_filenames) > 0:
+        count = len(map_filenames)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(analyse_map, map_filenames, output_dirs, [tuple(colours)] * count,
+                                          [upper_threshold] * count, [lower_threshold] * count, [connectivity] * count,
+                                          [image_format] * count, [output_mode] * count, [compress_level] * count))
+    
+    with open(os.path.join(output_dir, BATCH_INDEX_FILE), "w") as index_file:
+        json.dump(summaries, index_file, indent=4)
+    return summaries
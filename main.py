@@ -1,6 +1,14 @@
 
 from sys import exit
+import argparse
+import csv
 import datetime as dt
+import json
+import math
+import os
+import shlex
+import shutil
+import sys
 
 import pandas as pd
 import numpy as np
@@ -9,7 +17,23 @@ import utils
 import reporting
 import intelligence
 import monitoring
+
+REPORT_FORMATS = ["csv", "json", "parquet"]
+# The number of rows written to each parquet row group
+PARQUET_BATCH_SIZE = 65536
     
+def print_lines(*lines):
+    """Prints each line, recording them below the monitoring display so it knows when they have scrolled it.
+       Lines wider than the terminal are recorded as the number of rows they wrap onto
+
+    Args:
+        lines: The lines to print
+    """
+    width = shutil.get_terminal_size().columns
+    for line in lines:
+        print(line)
+        utils.DEFAULT_RENDERER.add_lines(max(1, math.ceil(len(str(line)) / width)))
+
 def get_valid_input(valid_inputs):
     """Loops until the user enter input that is specified in the valid_inputs list
 
@@ -22,9 +46,10 @@ def get_valid_input(valid_inputs):
     is_input_valid = False
     while not is_input_valid:
         user_input = input().lower()
+        # The terminal echoes the input on its own line below the monitoring display
+        utils.DEFAULT_RENDERER.add_lines(1)
         if not user_input in valid_inputs:
-            print("Invalid input! Please use one of these options:")
-            print(valid_inputs)
+            print_lines("Invalid input! Please use one of these options:", valid_inputs)
         else:
             return user_input
 
@@ -88,33 +113,31 @@ def reporting_menu():
         if user_input == "q":
             return
         
-        print("Please select a monitoring station by entering the 3-letter monitoring station code:")
-        print("HRL - London Harlington")
-        print("MY1 - London Marylebone Road")
-        print("KC1 - London N Kensington")
+        print("Please select a monitoring station by entering the monitoring station code:")
+        for station_code in data:
+            print(f"{station_code} - {data.get_name(station_code)}")
         # Functions take monitoring station codes only in uppercase
-        monitoring_station = get_valid_input(["hrl", "my1", "kc1"]).upper()
+        monitoring_station = get_valid_input([station_code.lower() for station_code in data]).upper()
         
         print("Please select a pollutant:")
-        print("'no', 'pm10', or 'pm25'")
-        pollutant = get_valid_input(["no", "pm10", "pm25"])
+        pollutants = data[monitoring_station].pollutants
+        print(", ".join(f"'{pollutant}'" for pollutant in pollutants))
+        pollutant = get_valid_input(pollutants)
         
         if user_input == "a":
             # Daily Average
             date = monitoring.get_valid_date()
-            date_index = reporting.get_date_index(data, monitoring_station, date)
             
-            # Calculate data and print it to user
-            avg_pollution = reporting.daily_average(data, monitoring_station, pollutant)
-            print(f"Average pollution on {date} was {avg_pollution[date_index]}")
+            # Calculate data and print it to user, only the measurements of the date are used
+            avg_pollution = reporting.daily_statistic(data, monitoring_station, pollutant, date, "mean")
+            print(f"Average pollution on {date} was {avg_pollution}")
             
         elif user_input == "m":
             # Daily Median
             date = monitoring.get_valid_date()
-            date_index = reporting.get_date_index(data, monitoring_station, date)
             
-            avg_pollution = reporting.daily_median(data, monitoring_station, pollutant)
-            print(f"Average pollution on {date} was {avg_pollution[date_index]}")
+            median_pollution = reporting.daily_statistic(data, monitoring_station, pollutant, date, "median")
+            print(f"Median pollution on {date} was {median_pollution}")
             
         elif user_input == "h":
             # Hourly Average
@@ -126,10 +149,20 @@ def reporting_menu():
             month_codes = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
             print("Please enter a 3-letter month code, e.g. 'feb' or 'jul'")
             month = get_valid_input(month_codes)
-            month_index = month_codes.index(month)
+            # The monthly averages have one entry for each month of every year in the data
+            years = sorted(set(str(month)[:4] for month in data[monitoring_station].months))
+            if len(years) == 1:
+                year = years[0]
+            else:
+                print(f"Please enter a year: {', '.join(years)}")
+                year = get_valid_input(years)
             
             avg_pollution = reporting.monthly_average(data, monitoring_station, pollutant)
-            print(f"Average pollution for '{month}' was {avg_pollution[month_index]}")
+            try:
+                month_index = reporting.get_month_index(data, monitoring_station, year, month_codes.index(month) + 1)
+                print(f"Average pollution for '{month}' {year} was {avg_pollution[month_index]}")
+            except Exception as err:
+                print(err)
             
         elif user_input == "p":
             # Peak Hour and Date
@@ -162,40 +195,59 @@ def monitoring_menu():
     display_options = ["mean_group", "median_group", "max_range", "min_range", "barchart"]
     
     # Fetch inital live data, additional data will only be fetched as needed
-    raw_data = monitoring.get_live_data_from_api(monitoring_station, pollutant, start_date, end_date)
+    session = monitoring.MonitoringSession()
+    raw_data = session.get_data(monitoring_station, pollutant, start_date, end_date)
+    # When background polling is on, the display reads the data the scheduler keeps fresh in the store
+    store = monitoring.MonitoringStore()
+    scheduler = monitoring.PollingScheduler(store, session)
+    is_polling = False
     
     while not has_exited_menu:
-        monitoring.display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_options)
+        monitoring.display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_options,
+                                           store if is_polling else None)
         
-        print("Please choose the data types and range to display. When you are finished, press L to load and display the data")
-        print("M - Select monitoring station")
-        print("P - Select pollutant type")
-        print("D - Select date")
-        print("R - Select date range")
-        print("G - Choose how the data is grouped")
-        print("V - Choose how the data is visualised")
-        print("L - Save changes and reload data")
-        print("Q - Return to menu")
+        print_lines("Please choose the data types and range to display. When you are finished, press L to load and display the data",
+                    "M - Select monitoring station",
+                    "P - Select pollutant type",
+                    "D - Select date",
+                    "R - Select date range",
+                    "G - Choose how the data is grouped",
+                    "V - Choose how the data is visualised",
+                    "L - Save changes and reload data",
+                    "B - Toggle background polling of the selected station and pollutant",
+                    "Q - Return to menu")
         
-        user_input = get_valid_input(["m", "p", "d", "r", "g", "v", "l", "q"])
+        user_input = get_valid_input(["m", "p", "d", "r", "g", "v", "l", "b", "q"])
+        selection = (monitoring_station, pollutant, start_date)
         
         # Return to menu
         if user_input == "q":
+            scheduler.stop()
             return
+        # Toggle Background Polling
+        elif user_input == "b":
+            is_polling = not is_polling
+            if is_polling:
+                scheduler.subscribe(monitoring_station, pollutant, start_date)
+                scheduler.start()
+            else:
+                scheduler.stop()
+                for site_code, species_code in list(scheduler.subscriptions):
+                    scheduler.unsubscribe(site_code, species_code)
         # Select Monitoring Station
         elif user_input == "m":
-            print("Select a monitoring station:")
-            print("(1) - London Harlington")
-            print("(2) - London Marylebone Road")
-            print("(3) - London N Kensington")
+            print_lines("Select a monitoring station:",
+                        "(1) - London Harlington",
+                        "(2) - London Marylebone Road",
+                        "(3) - London N Kensington")
             user_input = get_valid_input(["1", "2", "3"])
             monitoring_station = ["HRL", "MY1", "KC1"][int(user_input) - 1]
         # Select Pollutant Type
         elif user_input == "p":
-            print("Select a pollutant type:")
-            print("(1) - NO")
-            print("(2) - PM10")
-            print("(3) - PM25")
+            print_lines("Select a pollutant type:",
+                        "(1) - NO",
+                        "(2) - PM10",
+                        "(3) - PM25")
             user_input = get_valid_input(["1", "2", "3"])
             pollutant = ["NO", "PM10", "PM25"][int(user_input) - 1]
         # Select Date
@@ -207,7 +259,7 @@ def monitoring_menu():
             end_date = start_date
         # Select Date Range
         elif user_input == "r":
-            print("Enter a start date and a end date:")
+            print_lines("Enter a start date and a end date:")
             # Get dates as strings
             new_start_str = monitoring.get_valid_date()
             new_end_str = monitoring.get_valid_date()
@@ -216,41 +268,43 @@ def monitoring_menu():
             new_end_date = dt.datetime.strptime(new_end_str, "%Y-%m-%d").date()
             # Check dates are not in the wrong order
             if new_start_date >= new_end_date:
-                print("Start date must be before end date")
+                print_lines("Start date must be before end date")
                 return
             start_date, end_date = new_start_date, new_end_date
         # Choose How Data is Grouped
         elif user_input == "g":
-            print("Select a data group size:")
-            print("(1) - No Group")
-            print("(2) - Days of the month")
-            print("(3) - Weekdays")
-            print("(4) - Month")
-            print("(5) - Year")
+            print_lines("Select a data group size:",
+                        "(1) - No Group",
+                        "(2) - Days of the month",
+                        "(3) - Weekdays",
+                        "(4) - Month",
+                        "(5) - Year")
             user_input = get_valid_input(["1", "2", "3", "4", "5"])
             data_grouping = ["none", "day", "time", "month", "year"][int(user_input) - 1]
         # Choose How Data is Visulised
         elif user_input == "v":
-            print("(1) - Change data scale")
-            print("(2) - Change active data displays")
-            print("(3) - Back to menu")
+            print_lines("(1) - Change data scale",
+                        "(2) - Change active data displays",
+                        "(3) - Back to menu")
             
             user_input = get_valid_input(["1", "2", "3"])
             
             # Change Data Scale
             if user_input == "1":
                 is_valid_scale = False
-                print("Select a new maximum value as a whole number at least 20")
+                print_lines("Select a new maximum value as a whole number at least 20")
                 while not is_valid_scale:
                     new_scale_max = input()
+                    # The terminal echoes the input on its own line below the monitoring display
+                    utils.DEFAULT_RENDERER.add_lines(1)
                     # Check new scale is an integer
                     if not new_scale_max.isdigit():
-                        print("Value must be a whole number!")
+                        print_lines("Value must be a whole number!")
                     else:
                         new_scale_max = int(new_scale_max)
                         # Check if scale is below 20, which is too small to display on the console
                         if new_scale_max < 20:
-                            print("New scale is too small! Scale must be at least 20")
+                            print_lines("New scale is too small! Scale must be at least 20")
                         else:
                             scale_max = new_scale_max
                             is_valid_scale = True
@@ -262,18 +316,19 @@ def monitoring_menu():
                 
                 while not exited_options_menu:
                     # As this menu is quite large, redisplay options every time
-                    monitoring.display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_options)
+                    monitoring.display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_options,
+                                                       store if is_polling else None)
                     
-                    print("(1)  - Toggle mean   (range)")
-                    print("(2)  - Toggle median (range)")
-                    print("(3)  - Toggle max    (range)")
-                    print("(4)  - Toggle min    (range)")
-                    print("(5)  - Toggle mean   (group)")
-                    print("(6)  - Toggle median (group)")
-                    print("(7)  - Toggle bar-chart")
-                    print("(8) - Toggle table")
-                    print("(9) - Back to menu")
-                    print(f"Active options: {display_options}")
+                    print_lines("(1)  - Toggle mean   (range)",
+                                "(2)  - Toggle median (range)",
+                                "(3)  - Toggle max    (range)",
+                                "(4)  - Toggle min    (range)",
+                                "(5)  - Toggle mean   (group)",
+                                "(6)  - Toggle median (group)",
+                                "(7)  - Toggle bar-chart",
+                                "(8) - Toggle table",
+                                "(9) - Back to menu",
+                                f"Active options: {display_options}")
                     user_input = get_valid_input(["1", "2", "3", "4", "5", "6", "7", "8", "9"])
                     
                     # Check if user wants to exit menu
@@ -291,8 +346,19 @@ def monitoring_menu():
                 pass
         # Load new data from API
         elif user_input == "l":
-            print("Loading data...")
-            raw_data = monitoring.get_live_data_from_api(monitoring_station, pollutant, start_date, end_date)
+            print_lines("Loading data...")
+            if is_polling:
+                # The scheduler fetches the data, so the display does not wait on the network
+                scheduler.subscribe(monitoring_station, pollutant, start_date)
+            else:
+                # Only the measurements after the latest loaded value are fetched
+                raw_data = session.get_data(monitoring_station, pollutant, start_date, end_date)
+        
+        # While polling, the scheduler follows the selected station, pollutant and start date
+        if is_polling and selection != (monitoring_station, pollutant, start_date):
+            for site_code, species_code in list(scheduler.subscriptions):
+                scheduler.unsubscribe(site_code, species_code)
+            scheduler.subscribe(monitoring_station, pollutant, start_date)
             
 def intelligence_menu():
     """Displays the intelligence menu which allows the user to access the intelligence modules functions
@@ -307,12 +373,15 @@ def intelligence_menu():
         print("Please choose an option:")
         print("R - Analyze red pixles")
         print("C - Analyze cyan pixles")
+        print("B - Analyze a batch of maps")
         print("Q - Return to main menu")
         
-        user_input = get_valid_input(["r", "c", "q"])
+        user_input = get_valid_input(["r", "c", "b", "q"])
         
         if user_input == "q":
             return
+        elif user_input == "b":
+            batch_menu()
         else:
             colour_option = user_input
             
@@ -338,6 +407,27 @@ def intelligence_menu():
     mark = intelligence.detect_connected_components(data)
     intelligence.detect_connected_components_sorted(mark)
 
+def batch_menu():
+    """Asks the user for a directory or glob pattern of map images and analyses all of them with 'intelligence.analyse_maps'
+    """
+    print("Please enter a directory or glob pattern of map images (e.g. data/maps/*.png):")
+    path = input()
+    print("Please enter the output directory (leave empty for 'map-analysis'):")
+    output_dir = input() or "map-analysis"
+    
+    summaries = intelligence.analyse_maps(path, output_dir)
+    if len(summaries) == 0:
+        print("No map images were found!")
+        return
+    
+    for summary in summaries:
+        if summary["error"] is None:
+            print(f"{summary['image']}: {summary['red']['components']} red and {summary['cyan']['components']} cyan components")
+        else:
+            print(f"{summary['image']}: Failed! Error: {summary['error']}")
+    print(f"Analysed {len(summaries)} maps, the summary is in {output_dir}/{intelligence.BATCH_INDEX_FILE}")
+    print()
+
 def about():
     """Displays the 'about' information
     """
@@ -355,5 +445,174 @@ def quit():
     """
     exit(0)
 
+def get_list_argument(argument):
+    """Splits a comma separated command line argument, e.g. 'MY1,KC1', into a list"""
+    return [item.strip() for item in argument.split(",") if item.strip() != ""]
+
+def add_query_arguments(parser, defaults=None):
+    """Adds the arguments of a single report query to an argument parser. The defaults are taken from the
+    parsed arguments of another query if they are given, so a query file only has to list what changes"""
+    get_default = lambda name, default: default if defaults is None else getattr(defaults, name)
+    parser.add_argument("--station", default=get_default("station", None), help="Comma separated monitoring station codes, e.g. MY1,KC1")
+    parser.add_argument("--pollutant", default=get_default("pollutant", None), help="Comma separated pollutant codes, e.g. no,pm10")
+    parser.add_argument("--agg", default=get_default("agg", "daily-mean"),
+                        help="Comma separated aggregations, e.g. daily-mean,hourly-max,monthly-median")
+    parser.add_argument("--from", dest="start_date", default=get_default("start_date", None), help="The first date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", default=get_default("end_date", None), help="The last date (YYYY-MM-DD)")
+
+def get_argument_parser():
+    """Returns the parser for the command line interface, which runs reports without the interactive menus"""
+    parser = argparse.ArgumentParser(description="Pollution analysis tool. Run without arguments for the interactive menu.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    report_parser = subparsers.add_parser("report", help="Write the statistics of monitoring stations without the menus")
+    add_query_arguments(report_parser)
+    report_parser.add_argument("--format", default="csv", choices=REPORT_FORMATS, help="The output format (csv, json lines or parquet)")
+    report_parser.add_argument("--output", default="-", help="The output file, or '-' for stdout")
+    report_parser.add_argument("--registry", default=reporting.STATION_REGISTRY_FILE, help="The station registry file")
+    report_parser.add_argument("--queries", default=None,
+                               help="A file with one query per line (e.g. '--station KC1 --agg hourly-max'), or '-' for stdin. "
+                                    "The data is loaded once and every query is answered by the same process")
+    return parser
+
+def get_report_queries(args):
+    """Returns the queries of a report command as (station codes, pollutant codes, aggregations, start date, end date) tuples.
+    Without a query file the command line is the only query, otherwise every line of the file is a query which
+    takes its defaults from the command line
+
+    Exceptions:
+        Raises an exception if a query is not valid
+    """
+    if args.queries is None:
+        query_args = [args]
+    else:
+        query_parser = argparse.ArgumentParser(prog="query", add_help=False, exit_on_error=False)
+        add_query_arguments(query_parser, args)
+        with (sys.stdin if args.queries == "-" else open(args.queries, "r")) as file:
+            lines = [line.strip() for line in file]
+        query_args = []
+        for line in lines:
+            # Blank lines and comments are skipped
+            if line == "" or line.startswith("#"):
+                continue
+            try:
+                query_args.append(query_parser.parse_args(shlex.split(line)))
+            except (argparse.ArgumentError, SystemExit):
+                raise Exception(f"Query '{line}' is not valid!")
+    
+    queries = []
+    for query in query_args:
+        if query.station is None or query.pollutant is None:
+            raise Exception("Every query needs a --station and a --pollutant!")
+        try:
+            start_date = None if query.start_date is None else reporting.parse_date(query.start_date)
+            end_date = None if query.end_date is None else reporting.parse_date(query.end_date)
+        except ValueError:
+            raise Exception("Dates must be in the format YYYY-MM-DD!")
+        queries.append(([station.upper() for station in get_list_argument(query.station)],
+                        [pollutant.lower() for pollutant in get_list_argument(query.pollutant)],
+                        get_list_argument(query.agg), start_date, end_date))
+    return queries
+
+def get_report_row(query_number, row):
+    """Returns a report row as a dictionary, with the number of its query. Missing values ('nan') become None"""
+    row = dict(zip(["query"] + reporting.REPORT_COLUMNS, (query_number,) + row))
+    if isinstance(row["value"], float) and math.isnan(row["value"]):
+        row["value"] = None
+    return row
+
+def write_csv_report(rows, stream):
+    """Writes report rows as csv, one row at a time. Missing values are left empty"""
+    writer = csv.DictWriter(stream, ["query"] + reporting.REPORT_COLUMNS, lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+def write_json_report(rows, stream):
+    """Writes report rows as json lines, one object for each row. Missing values are null"""
+    for row in rows:
+        stream.write(json.dumps(row) + "\n")
+
+def write_parquet_report(rows, output):
+    """Writes report rows to a parquet file, one row group of PARQUET_BATCH_SIZE rows at a time
+
+    Exceptions:
+        Raises an exception if the optional 'pyarrow' package is not installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Writing parquet files needs the 'pyarrow' package!")
+    
+    schema = pyarrow.schema([("query", pyarrow.int64()), ("station", pyarrow.string()), ("pollutant", pyarrow.string()),
+                             ("aggregation", pyarrow.string()), ("group", pyarrow.string()), ("value", pyarrow.float64())])
+    with pyarrow.parquet.ParquetWriter(output, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == PARQUET_BATCH_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema))
+                batch = []
+        if len(batch) > 0:
+            writer.write_table(pyarrow.Table.from_pylist(batch, schema))
+
+def run_report(args, stream=None):
+    """Runs the queries of a report command against station data which is loaded once, and streams the rows out.
+    Every query is checked before anything is written, so an invalid query does not leave a partial report
+
+    Args:
+        args (argparse.Namespace): The parsed arguments of the report command
+        stream (file, optional): The text stream written to when the output is '-'. Defaults to None, which is sys.stdout.
+    """
+    data = reporting.get_monitering_station_data(args.registry)
+    queries = get_report_queries(args)
+    for query in queries:
+        reporting.check_report(data, *query)
+    
+    rows = (get_report_row(query_number, row)
+            for query_number, query in enumerate(queries)
+            for row in reporting.report(data, *query))
+    
+    if args.format == "parquet":
+        if args.output == "-":
+            raise Exception("Parquet reports have to be written to a file with --output!")
+        write_parquet_report(rows, args.output)
+        return
+    
+    write_report = write_csv_report if args.format == "csv" else write_json_report
+    if args.output == "-":
+        stream = sys.stdout if stream is None else stream
+        write_report(rows, stream)
+        stream.flush()
+    else:
+        with open(args.output, "w", newline="") as file:
+            write_report(rows, file)
+
+def run_command_line(argv, stream=None):
+    """Runs a command of the command line interface
+
+    Args:
+        argv ([str]): The command line arguments, without the program name
+        stream (file, optional): The text stream reports are written to. Defaults to None, which is sys.stdout.
+
+    Returns:
+        int: The exit code, 0 if the command succeeded and 1 if it failed
+    """
+    args = get_argument_parser().parse_args(argv)
+    try:
+        if args.command == "report":
+            run_report(args, stream)
+    except BrokenPipeError:
+        # The reader stopped early (e.g. 'head'), so the rest of the report is not needed. Python flushes stdout
+        # again when it exits, so it is pointed at devnull to stop a second error
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    except Exception as error:
+        print(f"Error: {error}", file=sys.stderr)
+        return 1
+    return 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        exit(run_command_line(sys.argv[1:]))
     main_menu()
\ No newline at end of file
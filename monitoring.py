@@ -6,13 +6,56 @@
 
 import datetime as dt
 import re
+import atexit
 import calendar
+import concurrent.futures
+import contextlib
+import heapq
+import io
+import json
+import random
+import sqlite3
+import threading
+import time
+import urllib.parse
+import weakref
+import zlib
 
 import pandas as pd
 import numpy as np
 
 import utils
 
+API_URL = "https://api.erg.ic.ac.uk/AirQuality"
+API_ENDPOINT = "{api_url}/Data/SiteSpecies/SiteCode={site_code}/SpeciesCode={species_code}/StartDate={start_date}/EndDate={end_date}/Json"
+
+# Responses are cached by (site, species, day). A day fetched more than COMPLETE_DAY_MARGIN seconds after it ended (in GMT)
+# is complete and is kept forever, as measurements are reported a little late. Any other day is still being measured,
+# so it is fetched again once it is older than CURRENT_DAY_TTL seconds
+RESPONSE_CACHE_FILE = "data/monitoring-cache.sqlite3"
+CURRENT_DAY_TTL = 300
+COMPLETE_DAY_MARGIN = 3 * 3600
+
+# Long ranges are split into requests of at most API_DAYS_PER_REQUEST days, which are sent by a pool of API_WORKERS
+# threads with at most API_HOST_CONCURRENCY requests to one host at a time. Failed requests are retried API_RETRIES
+# times, waiting API_BACKOFF seconds before the first retry and twice as long before each later retry
+API_DAYS_PER_REQUEST = 7
+API_WORKERS = 8
+API_HOST_CONCURRENCY = 4
+API_RETRIES = 3
+API_BACKOFF = 0.5
+API_TIMEOUT = 30
+
+# The polling scheduler refreshes each subscription every POLL_INTERVAL seconds, plus a random delay of up to
+# POLL_JITTER of the interval so subscriptions do not all poll at once. At most POLL_RATE_LIMIT polls start each
+# second. A failed poll is tried again after POLL_BACKOFF seconds, doubling for each failure up to POLL_MAX_BACKOFF
+POLL_INTERVAL = 300
+POLL_JITTER = 0.1
+POLL_RATE_LIMIT = 2
+POLL_BACKOFF = 10
+POLL_MAX_BACKOFF = 600
+POLL_WORKERS = 4
+
 def get_live_data_from_api(site_code='MY1',species_code='NO',start_date=None,end_date=None):
     """
     Return data from the LondonAir API using its AirQuality API. 
@@ -46,6 +89,982 @@ def get_live_data_from_api(site_code='MY1',species_code='NO',start_date=None,end
 
 
 
+def fetch_api_data(site_code, species_code, start_date, end_date, api_url=API_URL, session=None, timeout=API_TIMEOUT):
+    """Fetches the raw data of a date range from the LondonAir API
+
+    Args:
+        site_code (str): The monitoring station code
+        species_code (str): The pollutant code
+        start_date (date): The first day of the range
+        end_date (date): The last day of the range (included)
+        api_url (str, optional): The base url of the API. Defaults to API_URL.
+        session (requests.Session, optional): The session to send the request with. Defaults to None, which sends a
+                                              request without a session.
+        timeout (float, optional): The number of seconds to wait for the API. Defaults to API_TIMEOUT.
+
+    Exceptions:
+        Raises an exception if the request fails
+
+    Returns:
+        [dict]: The measurements, each with a '@MeasurementDateGMT' and a '@Value'
+    """
+    import requests
+    
+    url = API_ENDPOINT.format(
+        api_url = api_url,
+        site_code = site_code,
+        species_code = species_code,
+        start_date = start_date,
+        # The end date of the API is not included
+        end_date = end_date + dt.timedelta(days=1)
+    )
+    response = (requests if session is None else session).get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.json()["RawAQData"]["Data"]
+
+# Each thread keeps its own session in thread-local storage, and the fetch threads live as long as the program, so
+# connections are kept alive and reused between requests and between refreshes. A thread's session is closed when the
+# thread exits, and every session is closed when the program exits
+thread_sessions = threading.local()
+open_sessions = weakref.WeakSet()
+sessions_lock = threading.Lock()
+fetch_executors = {}
+fetch_executors_lock = threading.Lock()
+host_semaphores = {}
+host_semaphores_lock = threading.Lock()
+
+class ThreadSession:
+    """The requests session of one thread. It is only referenced by the thread's local storage, which is dropped when
+    the thread exits, so the session is closed then
+
+    Attributes:
+        session (requests.Session): The session, which keeps the thread's connections alive
+        closed (bool): True if the session was closed by 'close_api_connections', so the thread needs a new one
+    """
+    def __init__(self, session):
+        self.session = session
+        self.closed = False
+    
+    def close(self):
+        """Closes the session's connections"""
+        self.closed = True
+        self.session.close()
+    
+    def __del__(self):
+        self.session.close()
+
+def get_session():
+    """Returns the requests session of the current thread, creating it if needed"""
+    import requests
+    
+    thread_session = getattr(thread_sessions, "session", None)
+    if thread_session is None or thread_session.closed:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=API_HOST_CONCURRENCY, pool_maxsize=API_HOST_CONCURRENCY)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        thread_session = ThreadSession(session)
+        thread_sessions.session = thread_session
+        with sessions_lock:
+            open_sessions.add(thread_session)
+    return thread_session.session
+
+def get_fetch_executor(workers=API_WORKERS):
+    """Returns the long-lived pool of threads which sends requests, with the given number of threads"""
+    with fetch_executors_lock:
+        if not workers in fetch_executors:
+            fetch_executors[workers] = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-fetch")
+        return fetch_executors[workers]
+
+def close_api_connections():
+    """Stops the fetch threads and closes the session of every thread. Sessions and threads are created again if more
+       requests are sent"""
+    with fetch_executors_lock:
+        executors = list(fetch_executors.values())
+        fetch_executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
+    with sessions_lock:
+        for thread_session in list(open_sessions):
+            thread_session.close()
+        open_sessions.clear()
+
+atexit.register(close_api_connections)
+
+def get_host_semaphore(api_url):
+    """Returns the semaphore which limits the number of requests sent to the host of a url at the same time to
+       API_HOST_CONCURRENCY"""
+    host = urllib.parse.urlsplit(api_url).netloc
+    with host_semaphores_lock:
+        if not host in host_semaphores:
+            host_semaphores[host] = threading.BoundedSemaphore(API_HOST_CONCURRENCY)
+        return host_semaphores[host]
+
+def is_retryable(err):
+    """Returns True if a failed request might succeed if it is sent again: connection errors, timeouts, rate limits
+       (429) and server errors (5xx)"""
+    import requests
+    
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(err, requests.exceptions.HTTPError) and err.response is not None:
+        return err.response.status_code == 429 or err.response.status_code >= 500
+    return False
+
+def fetch_api_data_with_retry(site_code, species_code, start_date, end_date, api_url=API_URL, retries=API_RETRIES,
+                              backoff=API_BACKOFF):
+    """Fetches the raw data of a date range like 'fetch_api_data', using the session of the current thread, the
+       concurrency limit of the host and retrying failed requests with exponential backoff
+
+    Args:
+        site_code (str): The monitoring station code
+        species_code (str): The pollutant code
+        start_date (date): The first day of the range
+        end_date (date): The last day of the range (included)
+        api_url (str, optional): The base url of the API. Defaults to API_URL.
+        retries (int, optional): The number of times a failed request is retried. Defaults to API_RETRIES.
+        backoff (float, optional): The number of seconds before the first retry, which doubles for each later retry.
+                                   Defaults to API_BACKOFF.
+
+    Exceptions:
+        Raises the exception of the last attempt if every attempt fails, or of the first attempt that can not be retried
+
+    Returns:
+        [dict]: The measurements, each with a '@MeasurementDateGMT' and a '@Value'
+    """
+    semaphore = get_host_semaphore(api_url)
+    for attempt in range(retries + 1):
+        try:
+            with semaphore:
+                return fetch_api_data(site_code, species_code, start_date, end_date, api_url, get_session())
+        except Exception as err:
+            if attempt == retries or not is_retryable(err):
+                raise
+        time.sleep(backoff * 2 ** attempt)
+
+def split_date_range(start_date, end_date, days_per_request=API_DAYS_PER_REQUEST):
+    """Splits a date range into ranges of at most days_per_request days
+
+    Args:
+        start_date (date): The first day of the range
+        end_date (date): The last day of the range (included)
+        days_per_request (int, optional): The most days in each range. Defaults to API_DAYS_PER_REQUEST.
+
+    Returns:
+        [(date, date)]: The first and last day of each range, in order
+    """
+    ranges = []
+    while start_date <= end_date:
+        range_end = min(start_date + dt.timedelta(days=days_per_request - 1), end_date)
+        ranges.append((start_date, range_end))
+        start_date = range_end + dt.timedelta(days=1)
+    return ranges
+
+def fetch_api_data_concurrent(fetches, api_url=API_URL, days_per_request=API_DAYS_PER_REQUEST, workers=API_WORKERS,
+                              retries=API_RETRIES, backoff=API_BACKOFF):
+    """Fetches several date ranges, for any sites and species, at the same time. Each range is split into requests of
+       at most days_per_request days, which are sent by a pool of threads and merged back in order
+
+    Args:
+        fetches ([(str, str, date, date)]): The site code, species code, first day and last day (included) of each range
+        api_url (str, optional): The base url of the API. Defaults to API_URL.
+        days_per_request (int, optional): The most days in each request. Defaults to API_DAYS_PER_REQUEST.
+        workers (int, optional): The number of threads sending requests, from a pool which is kept between calls
+                                 (see 'get_fetch_executor'). Defaults to API_WORKERS.
+        retries (int, optional): The number of times a failed request is retried. Defaults to API_RETRIES.
+        backoff (float, optional): The number of seconds before the first retry. Defaults to API_BACKOFF.
+
+    Exceptions:
+        Raises an exception if a request still fails after its retries
+
+    Returns:
+        [[dict]]: The measurements of each range, in date order
+    """
+    sub_requests = [(fetch_index, site_code, species_code, range_start, range_end)
+                for fetch_index, (site_code, species_code, start_date, end_date) in enumerate(fetches)
+                for range_start, range_end in split_date_range(start_date, end_date, days_per_request)]
+    
+    results = [[] for _ in fetches]
+    if len(sub_requests) == 0:
+        return results
+    executor = get_fetch_executor(workers)
+    futures = [executor.submit(fetch_api_data_with_retry, site_code, species_code, range_start, range_end, api_url,
+                               retries, backoff)
+               for _, site_code, species_code, range_start, range_end in sub_requests]
+    try:
+        # The requests of each range are in date order, so the results are merged in the order they were sent
+        for (fetch_index, *_), future in zip(sub_requests, futures):
+            results[fetch_index] += future.result()
+    finally:
+        # If a request failed, the requests which have not started are not needed
+        for future in futures:
+            future.cancel()
+    return results
+
+MEASUREMENT_DATE_LENGTH = len("YYYY-MM-DD hh:mm:ss")
+# Matches one measurement in the raw json of the API, which always lists the date before the value
+MEASUREMENT_PATTERN = re.compile(rb'"@MeasurementDateGMT"\s*:\s*"([^"]*)"\s*,\s*"@Value"\s*:\s*"([^"]*)"')
+
+def parse_measurement_dates(dates):
+    """Parses dates in the fixed form 'YYYY-MM-DD hh:mm:ss' by reading the digits at their known positions,
+       which is much faster than a parser which has to work out the format
+
+    Args:
+        dates ([str / bytes]): The dates
+
+    Exceptions:
+        Raises an exception if a date is not in the form 'YYYY-MM-DD hh:mm:ss'
+
+    Returns:
+        np.ndarray: The dates as datetime64[s]
+    """
+    count = len(dates)
+    if count == 0:
+        return np.zeros(0, "datetime64[s]")
+    text = b"".join(dates) if isinstance(dates[0], bytes) else "".join(dates).encode("ascii", "replace")
+    if len(text) != count * MEASUREMENT_DATE_LENGTH:
+        raise Exception("Measurement date is not in the form YYYY-MM-DD hh:mm:ss!")
+    
+    characters = np.frombuffer(text, np.uint8).reshape(count, MEASUREMENT_DATE_LENGTH)
+    separators = characters[:, [4, 7, 10, 13, 16]]
+    digits = characters[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].astype(np.int64) - ord("0")
+    if np.any(separators != np.frombuffer(b"-- ::", np.uint8)) or np.any((digits < 0) | (digits > 9)):
+        raise Exception("Measurement date is not in the form YYYY-MM-DD hh:mm:ss!")
+    
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month, day, hour, minute, second = [digits[:, index] * 10 + digits[:, index + 1] for index in range(4, 14, 2)]
+    days = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+    return days.astype("datetime64[s]") + (hour * 3600 + minute * 60 + second)
+
+def parse_measurement_values(values):
+    """Parses the values of measurements, where an empty value (no measurement) is NaN
+
+    Args:
+        values ([str / bytes]): The values
+
+    Returns:
+        np.ndarray: The values as float64
+    """
+    # The count is given, so the array is allocated once instead of growing
+    return np.fromiter((float(value) if value else np.nan for value in values), np.float64, len(values))
+
+def decode_records(records):
+    """Decodes the measurements of the API into typed columns
+
+    Args:
+        records ([dict]): The measurements, each with a '@MeasurementDateGMT' and a '@Value'
+
+    Returns:
+        dict: The "date" of each measurement as datetime64[s] and its "value" as float64, which is NaN for
+              measurements without a value
+    """
+    return {
+        "date": parse_measurement_dates([record["@MeasurementDateGMT"] for record in records]),
+        "value": parse_measurement_values([record["@Value"] for record in records])
+    }
+
+def decode_response_body(chunks):
+    """Decodes the raw json of the API into typed columns as it arrives, without building the json objects
+
+    Args:
+        chunks (iterable of bytes): The body of the response in pieces, e.g. from 'requests.Response.iter_content'
+
+    Returns:
+        dict: The "date" and "value" columns (see 'decode_records')
+    """
+    measurements = []
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        # Every measurement ends with '}', so the buffer is complete up to the last one. The rest may be the start of
+        # a measurement that is completed by the next chunk
+        end = buffer.rfind(b"}") + 1
+        measurements += MEASUREMENT_PATTERN.findall(buffer, 0, end)
+        buffer = buffer[end:]
+    return {
+        "date": parse_measurement_dates([date for date, _ in measurements]),
+        "value": parse_measurement_values([value for _, value in measurements])
+    }
+
+def fetch_api_columns(site_code, species_code, start_date, end_date, api_url=API_URL, session=None, timeout=API_TIMEOUT):
+    """Fetches the data of a date range from the LondonAir API like 'fetch_api_data', but decodes the body into typed
+       columns with 'decode_response_body' while it is downloaded
+
+    Exceptions:
+        Raises an exception if the request fails
+
+    Returns:
+        dict: The "date" and "value" columns (see 'decode_records')
+    """
+    import requests
+    
+    url = API_ENDPOINT.format(
+        api_url = api_url,
+        site_code = site_code,
+        species_code = species_code,
+        start_date = start_date,
+        end_date = end_date + dt.timedelta(days=1)
+    )
+    with (requests if session is None else session).get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        return decode_response_body(response.iter_content(chunk_size=65536))
+
+def make_response(site_code, species_code, records):
+    """Wraps measurements in the same structure as the json from the API, so they can be used by 'convert_response_to_dataframe'"""
+    return {"RawAQData": {"@SiteCode": site_code, "@SpeciesCode": species_code, "Data": records}}
+
+def split_records_by_day(records):
+    """Splits measurements into lists for each day
+
+    Args:
+        records ([dict]): The measurements, each with a '@MeasurementDateGMT' in the form 'YYYY-MM-DD hh:mm:ss'
+
+    Returns:
+        dict: The measurements of each day, keyed by the date as a string
+    """
+    days = {}
+    for record in records:
+        days.setdefault(record["@MeasurementDateGMT"][:10], []).append(record)
+    return days
+
+def get_date_ranges(dates):
+    """Groups sorted dates into ranges of consecutive days
+
+    Args:
+        dates ([date]): The sorted dates
+
+    Returns:
+        [(date, date)]: The first and last day of each range
+    """
+    ranges = []
+    for date in dates:
+        if len(ranges) > 0 and ranges[-1][1] + dt.timedelta(days=1) == date:
+            ranges[-1] = (ranges[-1][0], date)
+        else:
+            ranges.append((date, date))
+    return ranges
+
+class ResponseCache:
+    """Stores the measurements of the LondonAir API in an SQLite database, with a row for each (site, species, day).
+    The measurements are stored as compressed json
+
+    Attributes:
+        file_name (str): The filename of the database
+        current_day_ttl (float): The number of seconds the data of an incomplete day is valid for
+        complete_day_margin (float): The number of seconds after the end of a day that it has to be fetched to be complete
+        clock (function): Returns the current time in seconds since the epoch
+        hits (int): The number of days found in the cache
+        misses (int): The number of days which were not in the cache, or had expired
+    """
+    def __init__(self, file_name=RESPONSE_CACHE_FILE, current_day_ttl=CURRENT_DAY_TTL, complete_day_margin=COMPLETE_DAY_MARGIN,
+                 clock=time.time):
+        self.file_name = file_name
+        self.current_day_ttl = current_day_ttl
+        self.complete_day_margin = complete_day_margin
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        with self._connection:
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(responses)")]
+            if len(columns) > 0 and not "complete" in columns:
+                # Caches from before days were marked complete cannot tell which days are, so they are fetched again
+                self._connection.execute("DROP TABLE responses")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                            site TEXT NOT NULL,
+                                            species TEXT NOT NULL,
+                                            day TEXT NOT NULL,
+                                            fetched REAL NOT NULL,
+                                            complete INTEGER NOT NULL,
+                                            records BLOB NOT NULL,
+                                            PRIMARY KEY (site, species, day))""")
+    
+    def close(self):
+        """Closes the database"""
+        with self._lock:
+            self._connection.close()
+    
+    def get_days(self, site_code, species_code, dates):
+        """Returns the cached measurements of several days
+
+        Args:
+            site_code (str): The monitoring station code
+            species_code (str): The pollutant code
+            dates ([date]): The days to look up
+
+        Returns:
+            dict: The measurements of each day which is cached and has not expired, keyed by date
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT day, fetched, complete, records FROM responses WHERE site = ? AND species = ? AND day BETWEEN ? AND ?",
+                (site_code, species_code, str(min(dates)), str(max(dates)))).fetchall() if len(dates) > 0 else []
+        
+        now = self.clock()
+        wanted = {str(date): date for date in dates}
+        days = {}
+        for day, fetched, complete, records in rows:
+            date = wanted.get(day)
+            if date is None:
+                continue
+            # Complete days never expire, but a day fetched while it was being measured does, even once it has passed
+            if not complete and now - fetched > self.current_day_ttl:
+                continue
+            days[date] = json.loads(zlib.decompress(records))
+        
+        self.hits += len(days)
+        self.misses += len(wanted) - len(days)
+        return days
+    
+    def put_days(self, site_code, species_code, days):
+        """Stores the measurements of several days, replacing any measurements already stored for them
+
+        Args:
+            site_code (str): The monitoring station code
+            species_code (str): The pollutant code
+            days (dict): The measurements of each day, keyed by date
+        """
+        now = self.clock()
+        rows = [(site_code, species_code, str(date), now, self.is_complete(date, now), zlib.compress(json.dumps(records).encode()))
+                for date, records in days.items()]
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", rows)
+    
+    def is_complete(self, date, fetched):
+        """Returns True if the measurements of a day fetched at a time (in seconds since the epoch) are complete,
+        which is when they were fetched 'complete_day_margin' seconds after the end of the day in GMT"""
+        end_of_day = calendar.timegm((date + dt.timedelta(days=1)).timetuple())
+        return fetched > end_of_day + self.complete_day_margin
+    
+    def invalidate(self, site_code=None, species_code=None):
+        """Removes the cached measurements of a site and species, or every measurement if they are None"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses WHERE (? IS NULL OR site = ?) AND (? IS NULL OR species = ?)",
+                                     (site_code, site_code, species_code, species_code))
+
+# The cache used by 'get_cached_data_from_api' when no cache is given, which is opened when it is first used
+default_response_cache = None
+
+def get_response_cache(cache=None):
+    """Returns the given cache, or the default response cache (opening it if needed) if it is None"""
+    global default_response_cache
+    if cache is not None:
+        return cache
+    if default_response_cache is None:
+        default_response_cache = ResponseCache()
+    return default_response_cache
+
+def get_cached_data_from_api(site_code='MY1', species_code='NO', start_date=None, end_date=None, cache=None, api_url=API_URL,
+                             days_per_request=API_DAYS_PER_REQUEST, workers=API_WORKERS):
+    """Returns data from the LondonAir API like 'get_live_data_from_api', but only fetches the days which are not in the
+    response cache. The ranges of consecutive missing days are fetched at the same time with 'fetch_api_data_concurrent'
+
+    Args:
+        site_code (str, optional): The monitoring station code. Defaults to 'MY1'.
+        species_code (str, optional): The pollutant code. Defaults to 'NO'.
+        start_date (date, optional): The first day of the range. Defaults to None, which is today.
+        end_date (date, optional): The last day of the range (included). Defaults to None, which is start_date.
+        cache (ResponseCache, optional): The cache to use. Defaults to None, which uses the default response cache.
+        api_url (str, optional): The base url of the API. Defaults to API_URL.
+        days_per_request (int, optional): The most days in each request. Defaults to API_DAYS_PER_REQUEST.
+        workers (int, optional): The number of threads sending requests. Defaults to API_WORKERS.
+
+    Exceptions:
+        Raises an exception if a request fails
+
+    Returns:
+        dict: The data in the same structure as the json from the API
+    """
+    start_date = dt.date.today() if start_date is None else start_date
+    end_date = start_date if end_date is None else end_date
+    cache = get_response_cache(cache)
+    
+    dates = [start_date + dt.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    days = cache.get_days(site_code, species_code, dates)
+    
+    missing_ranges = get_date_ranges([date for date in dates if not date in days])
+    fetched = fetch_api_data_concurrent([(site_code, species_code, range_start, range_end)
+                                         for range_start, range_end in missing_ranges], api_url, days_per_request, workers)
+    for (range_start, range_end), records in zip(missing_ranges, fetched):
+        records = split_records_by_day(records)
+        # Days without measurements are stored too, so they are not fetched again
+        fetched_days = {date: records.get(str(date), [])
+                        for date in dates if range_start <= date <= range_end}
+        cache.put_days(site_code, species_code, fetched_days)
+        days.update(fetched_days)
+    
+    return make_response(site_code, species_code, [record for date in dates for record in days[date]])
+
+# The groups of 'group_data' (other than "none") as integer codes: the day of the month, the day of the week
+# (Monday is 0), the month (January is 1) and the year
+GROUPINGS = ["day", "time", "month", "year"]
+
+def get_group_codes(dates: np.ndarray, data_grouping):
+    """Returns the integer group code of each date for a data grouping, which are the same as the group keys of
+       'group_data'
+
+    Args:
+        dates (np.ndarray): The dates as datetime64
+        data_grouping (str): "day", "time", "month" or "year"
+
+    Returns:
+        np.ndarray: The group code of each date as int64
+    """
+    days = dates.astype("datetime64[D]")
+    if data_grouping == "day":
+        return (days - days.astype("datetime64[M]")).astype(np.int64) + 1
+    elif data_grouping == "time":
+        # 1970-01-01 was a Thursday
+        return (days.astype(np.int64) + 3) % 7
+    elif data_grouping == "month":
+        return days.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    elif data_grouping == "year":
+        return days.astype("datetime64[Y]").astype(np.int64) + 1970
+    raise Exception("Data grouping is not valid!")
+
+class MeasurementBuffer:
+    """Holds the decoded measurements of one site and species in arrays which grow as measurements are appended, and
+    keeps the statistics of the whole range and of every group up to date as they are added, so a refresh only does
+    work for the new measurements.
+    The last measurements are often reported without a value at first and filled in later, so measurements after the
+    latest value (the tail) are replaced by the next append
+
+    Attributes:
+        start_date (date): The first day of the measurements
+        end_date (date): The last day which has been fetched
+        dates (np.ndarray): The date of each measurement as datetime64[s], where only the first 'size' are used
+        values (np.ndarray): The value of each measurement, or NaN for no value
+        size (int): The number of measurements
+        latest_size (int): The number of measurements up to and including the latest one with a value
+        range_statistics (dict): The "sum", "min", "max" and "median" accumulators (see utils) of every value
+        max_row (int): The position of the first maximum value, or None if there are no values
+        min_row (int): The position of the first minimum value, or None if there are no values
+        group_statistics (dict): The "rows" (measurements before the tail, with or without a value), "count", "sum",
+                                 "min" and "max" arrays and the "median" accumulators of every grouping, indexed by
+                                 the group code minus the grouping's "offset" (the lowest group code seen)
+    """
+    def __init__(self, start_date, capacity=1024):
+        self.start_date = start_date
+        self.end_date = None
+        self.dates = np.empty(capacity, "datetime64[s]")
+        self.values = np.empty(capacity, np.float64)
+        self.size = 0
+        self.latest_size = 0
+        self.range_statistics = {
+            "sum": utils.SumAccumulator(),
+            "min": utils.MinAccumulator(),
+            "max": utils.MaxAccumulator(),
+            "median": utils.MedianAccumulator()
+        }
+        self.max_row = None
+        self.min_row = None
+        self.group_statistics = {grouping: {"offset": 0, "rows": np.zeros(0, np.int64), "count": np.zeros(0, np.int64),
+                                            "sum": np.zeros(0), "min": np.zeros(0), "max": np.zeros(0), "median": []}
+                                 for grouping in GROUPINGS}
+    
+    def get_latest_date(self):
+        """Returns the date of the latest measurement with a value, or None if there are none"""
+        return self.dates[self.latest_size - 1] if self.latest_size > 0 else None
+    
+    def update_range_statistics(self, values, first_row):
+        """Adds values, the first of which is at position first_row, to the statistics of the whole range"""
+        has_value = ~np.isnan(values)
+        if not np.any(has_value):
+            return
+        # Earlier maximums and minimums are kept when they are equal, like np.nanargmax
+        batch_max_row = first_row + int(np.nanargmax(values))
+        if self.max_row is None or self.values[batch_max_row] > self.values[self.max_row]:
+            self.max_row = batch_max_row
+        batch_min_row = first_row + int(np.nanargmin(values))
+        if self.min_row is None or self.values[batch_min_row] < self.values[self.min_row]:
+            self.min_row = batch_min_row
+        for accumulator in self.range_statistics.values():
+            accumulator.update(values[has_value])
+    
+    def update_group_statistics(self, dates, values):
+        """Adds measurements which are before the tail to the statistics of every grouping"""
+        has_value = ~np.isnan(values)
+        for grouping, statistics in self.group_statistics.items():
+            codes = get_group_codes(dates, grouping)
+            if len(codes) == 0:
+                continue
+            capacity = len(statistics["count"])
+            if capacity == 0:
+                # Year codes are calendar years, so the arrays start at the first group instead of at code 0
+                statistics["offset"] = int(codes.min())
+            before = max(statistics["offset"] - int(codes.min()), 0)
+            after = max(int(codes.max()) + 1 - statistics["offset"] - capacity, 0)
+            if before > 0 or after > 0:
+                # The arrays only grow by the span of the groups which have been seen
+                statistics["offset"] -= before
+                statistics["rows"] = np.pad(statistics["rows"], (before, after))
+                statistics["count"] = np.pad(statistics["count"], (before, after))
+                statistics["sum"] = np.pad(statistics["sum"], (before, after))
+                statistics["min"] = np.pad(statistics["min"], (before, after), constant_values=np.inf)
+                statistics["max"] = np.pad(statistics["max"], (before, after), constant_values=-np.inf)
+                statistics["median"] = [utils.MedianAccumulator() for _ in range(before)] + statistics["median"] + \
+                                       [utils.MedianAccumulator() for _ in range(after)]
+                capacity += before + after
+            codes = codes - statistics["offset"]
+            statistics["rows"] += np.bincount(codes, minlength=capacity)
+            codes, group_values = codes[has_value], values[has_value]
+            statistics["count"] += np.bincount(codes, minlength=capacity)
+            statistics["sum"] += np.bincount(codes, weights=group_values, minlength=capacity)
+            np.minimum.at(statistics["min"], codes, group_values)
+            np.maximum.at(statistics["max"], codes, group_values)
+            # Only the groups with new values are sorted into
+            order = np.argsort(codes, kind="stable")
+            group_codes, starts = np.unique(codes[order], return_index=True)
+            for code, group_batch in zip(group_codes.tolist(), np.split(group_values[order], starts[1:])):
+                statistics["median"][code].update(group_batch)
+    
+    def append(self, columns):
+        """Appends the measurements which are after the latest value, replacing the measurements without a value at
+           the end of the buffer. This only does work for the new measurements
+
+        Args:
+            columns (dict): The "date" and "value" columns of the measurements in date order (see 'decode_records')
+        """
+        dates = np.asarray(columns["date"], "datetime64[s]")
+        values = np.asarray(columns["value"], np.float64)
+        latest_date = self.get_latest_date()
+        if latest_date is not None:
+            # The new measurements are sorted, so the ones after the latest value are at the end
+            first = np.searchsorted(dates, latest_date, side="right")
+            dates, values = dates[first:], values[first:]
+        
+        self.size = self.latest_size
+        if self.size + len(dates) > len(self.dates):
+            # Double the capacity, so growing the arrays is amortised over many appends
+            capacity = max(self.size + len(dates), 2 * len(self.dates))
+            self.dates = np.concatenate([self.dates[:self.size], np.empty(capacity - self.size, "datetime64[s]")])
+            self.values = np.concatenate([self.values[:self.size], np.empty(capacity - self.size)])
+        self.dates[self.size:self.size + len(dates)] = dates
+        self.values[self.size:self.size + len(dates)] = values
+        self.size += len(dates)
+        
+        # Everything up to the latest value is kept, and the tail after it is only counted when it is read
+        has_value = ~np.isnan(values)
+        kept = int(np.flatnonzero(has_value)[-1]) + 1 if np.any(has_value) else 0
+        self.update_range_statistics(values[:kept], self.latest_size)
+        self.update_group_statistics(dates[:kept], values[:kept])
+        self.latest_size += kept
+    
+    def get_columns(self):
+        """Returns the "date" and "value" columns of the measurements, which are views of the buffer"""
+        return {"date": self.dates[:self.size], "value": self.values[:self.size]}
+    
+    def get_dataframe(self):
+        """Returns the measurements as a dataframe like 'convert_response_to_dataframe'"""
+        return pd.DataFrame({"date": self.dates[:self.size].astype("datetime64[ns]"), "value": self.values[:self.size]})
+    
+    def get_range_statistics(self):
+        """Returns the "mean" and "median" of every value and the position of the first "max_row" and "min_row",
+           which are NaN if there are no values"""
+        total = self.range_statistics["sum"]
+        if total.count == 0:
+            return {"mean": np.nan, "median": np.nan, "max_row": np.nan, "min_row": np.nan}
+        return {"mean": total.result() / total.count, "median": self.range_statistics["median"].result(),
+                "max_row": self.max_row, "min_row": self.min_row}
+    
+    def get_group_statistics(self, data_grouping):
+        """Returns the statistics of every group with measurements. Groups with only measurements without a value have
+           a count of 0 and NaN statistics
+
+        Args:
+            data_grouping (str): "day", "time", "month" or "year"
+
+        Returns:
+            pd.DataFrame: The "rows" (measurements with or without a value), "count", "mean", "median", "min" and
+                          "max" of each group, indexed by the group code
+        """
+        statistics = self.group_statistics[data_grouping]
+        offset = statistics["offset"]
+        rows = statistics["rows"]
+        # The position of the statistics arrays in 'rows'
+        shift = 0
+        tail_codes = get_group_codes(self.dates[self.latest_size:self.size], data_grouping)
+        if len(tail_codes) > 0:
+            # The measurements after the latest value have no value, so they only add rows, and may be in groups
+            # before the first group of the statistics (e.g. the first days of the next month)
+            if len(rows) == 0:
+                offset = int(tail_codes.min())
+            shift = max(offset - int(tail_codes.min()), 0)
+            offset -= shift
+            rows = np.bincount(tail_codes - offset, minlength=shift + len(rows))
+            rows[shift:shift + len(statistics["rows"])] += statistics["rows"]
+        
+        codes = np.flatnonzero(rows)
+        statistics_codes = codes - shift
+        counts = np.zeros(len(codes), np.int64)
+        in_statistics = (statistics_codes >= 0) & (statistics_codes < len(statistics["count"]))
+        counts[in_statistics] = statistics["count"][statistics_codes[in_statistics]]
+        has_value = counts > 0
+        value_codes = statistics_codes[has_value]
+        
+        group_statistics = pd.DataFrame({
+            "rows": rows[codes],
+            "count": counts,
+            "mean": np.nan,
+            "median": np.nan,
+            "min": np.nan,
+            "max": np.nan
+        }, index=pd.Index(codes + offset, name="date"))
+        group_statistics.loc[has_value, "mean"] = statistics["sum"][value_codes] / counts[has_value]
+        group_statistics.loc[has_value, "median"] = [statistics["median"][code].result() for code in value_codes.tolist()]
+        group_statistics.loc[has_value, "min"] = statistics["min"][value_codes]
+        group_statistics.loc[has_value, "max"] = statistics["max"][value_codes]
+        return group_statistics
+
+class MonitoringSession:
+    """Keeps the measurements of every site and species that has been viewed, so refreshing live data only fetches
+    the measurements after the latest value instead of the whole date range
+
+    Attributes:
+        api_url (str): The base url of the API
+        cache (ResponseCache): The cache used for the first load of a range, or None for the default response cache
+        buffers (dict): The MeasurementBuffer of each (site, species)
+    """
+    def __init__(self, api_url=API_URL, cache=None):
+        self.api_url = api_url
+        self.cache = cache
+        self.buffers = {}
+    
+    def get_buffer(self, site_code, species_code, start_date, end_date):
+        """Returns the measurements of a site and species from start_date, loading them if they are not loaded (or
+           start at a different date) and otherwise fetching only the new measurements up to end_date.
+           Days before today are only fetched once, but today (and later days) are fetched again on every call
+
+        Args:
+            site_code (str): The monitoring station code
+            species_code (str): The pollutant code
+            start_date (date): The first day of the range
+            end_date (date): The last day of the range (included)
+
+        Exceptions:
+            Raises an exception if a request fails
+
+        Returns:
+            MeasurementBuffer: The measurements, which may go past end_date if a later end date was loaded before
+        """
+        key = (site_code, species_code)
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.start_date != start_date:
+            buffer = MeasurementBuffer(start_date)
+            response = get_cached_data_from_api(site_code, species_code, start_date, end_date, self.cache, self.api_url)
+            buffer.append(decode_records(response["RawAQData"]["Data"]))
+            buffer.end_date = end_date
+            self.buffers[key] = buffer
+        elif end_date > buffer.end_date or end_date >= dt.date.today():
+            # Fetch from the day of the latest value, as the measurements after it may not be complete
+            latest_date = buffer.get_latest_date()
+            fetch_start = start_date if latest_date is None else max(latest_date.astype(dt.datetime).date(), start_date)
+            buffer.append(fetch_api_columns(site_code, species_code, fetch_start, max(end_date, buffer.end_date), self.api_url,
+                                            get_session()))
+            buffer.end_date = max(end_date, buffer.end_date)
+        return buffer
+    
+    def get_data(self, site_code, species_code, start_date, end_date):
+        """Returns the measurements of a date range as a dataframe like 'convert_response_to_dataframe', fetching only
+           the new measurements (see 'get_buffer'). When the dataframe holds the whole buffer, its group index (see
+           'get_group_index') uses the statistics the buffer keeps, so they are not computed again for every refresh
+        """
+        buffer = self.get_buffer(site_code, species_code, start_date, end_date)
+        columns = buffer.get_columns()
+        last = np.searchsorted(columns["date"], np.datetime64(end_date + dt.timedelta(days=1), "s"))
+        data = pd.DataFrame({"date": columns["date"][:last].astype("datetime64[ns]"), "value": columns["value"][:last]})
+        if last == buffer.size:
+            set_group_index(data, BufferGroupIndex(data, buffer))
+        return data
+
+class MonitoringStore:
+    """Holds the latest measurements of each site and species published by a PollingScheduler, so they can be read
+    without waiting on the network
+
+    Attributes:
+        frames (dict): The latest dataframe (see 'convert_response_to_dataframe') of each (site, species)
+        updated (dict): The time (from time.time) each dataframe was published
+        errors (dict): The error of the last poll of each (site, species), or None if it succeeded
+    """
+    def __init__(self):
+        self.frames = {}
+        self.updated = {}
+        self.errors = {}
+        # The date ranges which have been read from each frame, so reading the same range again returns the same
+        # dataframe (and its group index can be reused) until new measurements are published
+        self.ranges = {}
+        self._lock = threading.Lock()
+    
+    def publish(self, site_code, species_code, data=None, error=None):
+        """Stores the latest measurements of a site and species, or the error of a poll which failed (keeping the
+           measurements from before)"""
+        with self._lock:
+            if error is None:
+                self.frames[(site_code, species_code)] = data
+                self.updated[(site_code, species_code)] = time.time()
+                self.ranges[(site_code, species_code)] = {}
+            self.errors[(site_code, species_code)] = error
+    
+    def get_data(self, site_code, species_code, start_date=None, end_date=None):
+        """Returns the latest measurements of a site and species
+
+        Args:
+            site_code (str): The monitoring station code
+            species_code (str): The pollutant code
+            start_date (date, optional): The first day of the measurements returned. Defaults to None, which is all.
+            end_date (date, optional): The last day of the measurements returned. Defaults to None, which is all.
+
+        Returns:
+            pd.DataFrame: The measurements, or None if none have been published
+        """
+        with self._lock:
+            data = self.frames.get((site_code, species_code))
+            if data is None:
+                return None
+            ranges = self.ranges[(site_code, species_code)]
+            if not (start_date, end_date) in ranges:
+                dates = data["date"].values
+                first = 0 if start_date is None else np.searchsorted(dates, np.datetime64(start_date, "ns"))
+                last = len(dates) if end_date is None else np.searchsorted(dates, np.datetime64(end_date + dt.timedelta(days=1), "ns"))
+                # A range with every measurement is the published dataframe, which keeps its group index
+                ranges[(start_date, end_date)] = data if first == 0 and last == len(dates) else data.iloc[first:last].reset_index(drop=True)
+            return ranges[(start_date, end_date)]
+    
+    def get_error(self, site_code, species_code):
+        """Returns the error of the last poll of a site and species, or None"""
+        with self._lock:
+            return self.errors.get((site_code, species_code))
+
+class PollingScheduler:
+    """Keeps the measurements of a set of (site, species) subscriptions fresh in a MonitoringStore, by polling each one
+    on an interval from a background thread. Polls are sent by a small thread pool through a MonitoringSession, so
+    each poll only fetches the new measurements. Polls have jitter, a rate limit and exponential backoff after failures
+
+    Attributes:
+        store (MonitoringStore): The store the measurements are published to
+        session (MonitoringSession): The session the measurements are fetched with
+        subscriptions (dict): The start date of each subscribed (site, species)
+        failures (dict): The number of polls in a row which have failed for each subscription
+    """
+    def __init__(self, store, session=None, interval=POLL_INTERVAL, jitter=POLL_JITTER, rate_limit=POLL_RATE_LIMIT,
+                 backoff=POLL_BACKOFF, max_backoff=POLL_MAX_BACKOFF, workers=POLL_WORKERS):
+        self.store = store
+        self.session = MonitoringSession() if session is None else session
+        self.interval = interval
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.workers = workers
+        self.subscriptions = {}
+        self.failures = {}
+        # A heap of (time due, site, species), which may hold subscriptions that have since been removed
+        self._due = []
+        self._polling = set()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, *args):
+        self.stop()
+    
+    def subscribe(self, site_code, species_code, start_date=None):
+        """Adds a subscription, which is polled straight away. Subscribing again changes the start date
+
+        Args:
+            site_code (str): The monitoring station code
+            species_code (str): The pollutant code
+            start_date (date, optional): The first day of the measurements. Defaults to None, which is today.
+        """
+        with self._condition:
+            self.subscriptions[(site_code, species_code)] = dt.date.today() if start_date is None else start_date
+            self.failures[(site_code, species_code)] = 0
+            heapq.heappush(self._due, (time.monotonic(), site_code, species_code))
+            self._condition.notify()
+    
+    def unsubscribe(self, site_code, species_code):
+        """Removes a subscription, whose measurements stay in the store"""
+        with self._condition:
+            self.subscriptions.pop((site_code, species_code), None)
+            self.failures.pop((site_code, species_code), None)
+    
+    def start(self):
+        """Starts polling in a background thread, if it is not already polling"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        """Stops polling, waiting for the polls which have been sent to finish"""
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+    
+    def get_delay(self, key):
+        """Returns the number of seconds until a subscription is polled again, from the number of failures in a row"""
+        failures = self.failures.get(key, 0)
+        if failures == 0:
+            delay = self.interval
+        else:
+            delay = min(self.backoff * 2 ** (failures - 1), self.max_backoff)
+        return delay + random.uniform(0, self.jitter * delay)
+    
+    def poll(self, site_code, species_code, start_date):
+        """Fetches the new measurements of a subscription and publishes them to the store"""
+        key = (site_code, species_code)
+        try:
+            data = self.session.get_data(site_code, species_code, start_date, dt.date.today())
+            self.store.publish(site_code, species_code, data)
+            error = None
+        except Exception as err:
+            self.store.publish(site_code, species_code, error=str(err))
+            error = err
+        
+        with self._condition:
+            self._polling.discard(key)
+            if key in self.subscriptions:
+                self.failures[key] = 0 if error is None else self.failures[key] + 1
+                heapq.heappush(self._due, (time.monotonic() + self.get_delay(key), site_code, species_code))
+                self._condition.notify()
+    
+    def _run(self):
+        """Sends each subscription's poll when it is due, no faster than the rate limit, until the scheduler is stopped"""
+        next_poll_time = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            with self._condition:
+                while not self._stopping:
+                    now = time.monotonic()
+                    if len(self._due) == 0:
+                        self._condition.wait()
+                        continue
+                    due_time, site_code, species_code = self._due[0]
+                    key = (site_code, species_code)
+                    if not key in self.subscriptions or key in self._polling:
+                        # Removed subscriptions, and polls which are already running, are skipped
+                        heapq.heappop(self._due)
+                        continue
+                    wait_until = max(due_time, next_poll_time)
+                    if wait_until > now:
+                        self._condition.wait(wait_until - now)
+                        continue
+                    
+                    heapq.heappop(self._due)
+                    self._polling.add(key)
+                    next_poll_time = now + 1 / self.rate_limit
+                    executor.submit(self.poll, site_code, species_code, self.subscriptions[key])
+
 def get_valid_date():
     """Uses ReGex to prompt the user to enter a date in YYYY-MM-DD format and loops until they enter a date in this format
 
@@ -57,15 +1076,19 @@ def get_valid_date():
     while not is_input_valid:
         print("Please enter a date (YYYY-MM-DD):")
         user_date = input()
+        # The prompt, the input and any error message are recorded below the monitoring display
+        utils.DEFAULT_RENDERER.add_lines(2)
         # Check if date is in the YYYY-MM-DD format
         if re.match("^\d{4}\-(0?[1-9]|1[012])\-(0?[1-9]|[12][0-9]|3[01])$", user_date):
             date = dt.datetime.strptime(user_date, "%Y-%m-%d")
             if date > dt.datetime.today():
                 print("Date is in the future! Please choose an earlier date")
+                utils.DEFAULT_RENDERER.add_lines(1)
             else:
                 is_input_valid = True
         else:
             print("Date format is invalid. Please enter a date in the (YYYY-MM-DD) format")
+            utils.DEFAULT_RENDERER.add_lines(1)
     # Return the string date as that is what the specification requires for the functions
     return user_date
 
@@ -78,16 +1101,219 @@ def convert_response_to_dataframe(response_data) -> pd.DataFrame:
     Returns:
         pd.DataFrame: A dataframe containing a datetime column and a pollution column
     """
-    data_frame = pd.DataFrame(response_data["RawAQData"]["Data"])
+    columns = decode_records(response_data["RawAQData"]["Data"])
+    return pd.DataFrame({"date": columns["date"].astype("datetime64[ns]"), "value": columns["value"]})
+
+class GroupedData:
+    """The values of a dataset grouped by integer group codes, which works like the pandas group of 'value' that
+    'group_data' used to return: it has mean, median, count, max and min methods which return a series indexed by the
+    group keys, and iterating over it gives each group key with its values. The groups are found once with a stable
+    sort, the statistics are computed with bincount and reduceat, and each result is cached
+
+    Attributes:
+        keys (pd.Index): The key of each group, in ascending order
+        counts (np.ndarray): The number of values (including NaN) in each group
+    """
+    def __init__(self, codes: np.ndarray, values: np.ndarray, keys=None):
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        self.keys = pd.Index(unique_codes if keys is None else keys(unique_codes), name="date")
+        self.values = values
+        self.group_ids = inverse
+        # A stable sort keeps the values of each group in their original order
+        self.order = np.argsort(inverse, kind="stable")
+        self.counts = np.bincount(inverse, minlength=len(unique_codes))
+        self.starts = np.cumsum(self.counts) - self.counts
+        self.results = {}
     
-    # Rename the columns so they are less verbose
-    data_frame.rename(columns = {"@MeasurementDateGMT" : "date", "@Value" : "value"}, inplace=True)
+    def __iter__(self):
+        for key, start, count in zip(self.keys, self.starts, self.counts):
+            rows = self.order[start:start + count]
+            yield key, pd.Series(self.values[rows], index=rows, name="value")
     
-    # Convert the types for easy processing
-    data_frame["date"] = pd.to_datetime(data_frame["date"])
-    data_frame["value"] = pd.to_numeric(data_frame["value"])
+    def __len__(self):
+        return len(self.keys)
     
-    return data_frame
+    def get_result(self, statistic):
+        """Returns a cached statistic of every group, computing it the first time"""
+        if not statistic in self.results:
+            has_value = ~np.isnan(self.values)
+            counts = np.bincount(self.group_ids[has_value], minlength=len(self.keys))
+            if statistic == "count":
+                result = counts
+            elif statistic == "mean":
+                sums = np.bincount(self.group_ids[has_value], weights=self.values[has_value], minlength=len(self.keys))
+                result = np.full(len(self.keys), np.nan)
+                np.divide(sums, counts, out=result, where=counts > 0)
+            elif statistic == "median":
+                # Sort by group and then value, so the values of each group are in order with NaN values last
+                sorted_values = self.values[np.lexsort((self.values, self.group_ids))]
+                lower = self.starts + np.maximum(counts - 1, 0) // 2
+                upper = self.starts + counts // 2
+                result = np.where(counts > 0, (sorted_values[np.minimum(lower, len(sorted_values) - 1)] +
+                                               sorted_values[np.minimum(upper, len(sorted_values) - 1)]) / 2, np.nan)
+            elif statistic in ("max", "min"):
+                ufunc = np.fmax if statistic == "max" else np.fmin
+                result = np.full(len(self.keys), np.nan)
+                has_rows = self.counts > 0
+                if len(self.values) > 0:
+                    # fmax and fmin skip NaN values, like pandas
+                    result[has_rows] = ufunc.reduceat(self.values[self.order], self.starts[has_rows])
+            else:
+                raise Exception("Statistic is not valid!")
+            self.results[statistic] = pd.Series(result, index=self.keys, name="value")
+        return self.results[statistic]
+    
+    def count(self):
+        return self.get_result("count")
+    
+    def mean(self):
+        return self.get_result("mean")
+    
+    def median(self):
+        return self.get_result("median")
+    
+    def max(self):
+        return self.get_result("max")
+    
+    def min(self):
+        return self.get_result("min")
+
+class DataGroupIndex:
+    """The group codes and groups of a dataset, which are computed when they are first needed and then reused.
+    Datasets are treated as unchanging, so a dataset with new data should be a new dataframe
+
+    Attributes:
+        dates (np.ndarray): The date of each measurement as datetime64[ns]
+        values (np.ndarray): The value of each measurement
+        codes (dict): The integer group codes of each data grouping (see 'get_group_codes')
+        groups (dict): The GroupedData of each data grouping
+        range_results (dict): The cached statistics of the whole range
+    """
+    def __init__(self, data: pd.DataFrame):
+        self.dates = data["date"].values
+        self.values = np.asarray(data["value"].values, np.float64)
+        self.index = data.index
+        self.codes = {}
+        self.groups = {}
+        self.range_results = {}
+    
+    def get_codes(self, data_grouping):
+        """Returns the integer group code of each measurement for a data grouping"""
+        if not data_grouping in self.codes:
+            if data_grouping == "none":
+                self.codes[data_grouping] = self.dates.astype(np.int64)
+            else:
+                self.codes[data_grouping] = get_group_codes(self.dates, data_grouping)
+        return self.codes[data_grouping]
+    
+    def get_groups(self, data_grouping):
+        """Returns the GroupedData of a data grouping"""
+        if not data_grouping in self.groups:
+            # Without grouping each date is a group, keyed by its timestamp
+            keys = (lambda codes: pd.DatetimeIndex(codes.astype("datetime64[ns]"))) if data_grouping == "none" else None
+            self.groups[data_grouping] = GroupedData(self.get_codes(data_grouping), self.values, keys)
+        return self.groups[data_grouping]
+    
+    def get_range_result(self, statistic):
+        """Returns a cached statistic of every value: "mean", "median", "idxmax" or "idxmin" (the index label of the
+           maximum or minimum value, or NaN if there are no values)"""
+        if not statistic in self.range_results:
+            has_value = ~np.isnan(self.values)
+            if not np.any(has_value):
+                result = np.nan
+            elif statistic == "mean":
+                result = np.mean(self.values[has_value])
+            elif statistic == "median":
+                result = np.median(self.values[has_value])
+            elif statistic == "idxmax":
+                result = self.index[np.nanargmax(self.values)]
+            elif statistic == "idxmin":
+                result = self.index[np.nanargmin(self.values)]
+            else:
+                raise Exception("Statistic is not valid!")
+            self.range_results[statistic] = result
+        return self.range_results[statistic]
+
+class BufferGroupedData(GroupedData):
+    """The groups of a data grouping, like GroupedData, but with the statistics a MeasurementBuffer kept as its
+    measurements were appended. The values of each group are only sorted out if the groups are iterated over
+
+    Attributes:
+        statistics (pd.DataFrame): The statistics of each group (see 'MeasurementBuffer.get_group_statistics')
+        keys (pd.Index): The key of each group, in ascending order
+        counts (np.ndarray): The number of values (including NaN) in each group
+    """
+    def __init__(self, statistics: pd.DataFrame, codes: np.ndarray, values: np.ndarray):
+        self.statistics = statistics
+        self.keys = statistics.index
+        self.counts = statistics["rows"].values
+        self.codes = codes
+        self.values = values
+        self.grouped = None
+        self.results = {}
+    
+    def __iter__(self):
+        if self.grouped is None:
+            self.grouped = GroupedData(self.codes, self.values)
+        return iter(self.grouped)
+    
+    def get_result(self, statistic):
+        """Returns a statistic of every group from the buffer statistics"""
+        if not statistic in self.results:
+            if not statistic in ["count", "mean", "median", "max", "min"]:
+                raise Exception("Statistic is not valid!")
+            self.results[statistic] = pd.Series(self.statistics[statistic].values, index=self.keys, name="value")
+        return self.results[statistic]
+
+class BufferGroupIndex(DataGroupIndex):
+    """The group index of a dataframe which holds every measurement of a MeasurementBuffer. The statistics are read
+    from the buffer when the index is created, which only takes time for each group rather than each measurement, so
+    the index stays correct when more measurements are appended to the buffer later
+
+    Attributes:
+        range_statistics (dict): The statistics of the whole range (see 'MeasurementBuffer.get_range_statistics')
+        group_statistics (dict): The statistics of every grouping (see 'MeasurementBuffer.get_group_statistics')
+    """
+    def __init__(self, data: pd.DataFrame, buffer: MeasurementBuffer):
+        super().__init__(data)
+        self.range_statistics = buffer.get_range_statistics()
+        self.group_statistics = {grouping: buffer.get_group_statistics(grouping) for grouping in GROUPINGS}
+    
+    def get_groups(self, data_grouping):
+        """Returns the grouped data of a data grouping"""
+        if data_grouping == "none":
+            # Every measurement is its own group
+            return super().get_groups(data_grouping)
+        if not data_grouping in self.groups:
+            self.groups[data_grouping] = BufferGroupedData(self.group_statistics[data_grouping],
+                                                           self.get_codes(data_grouping), self.values)
+        return self.groups[data_grouping]
+    
+    def get_range_result(self, statistic):
+        """Returns a statistic of every value from the buffer statistics (see 'DataGroupIndex.get_range_result')"""
+        if statistic in ["mean", "median"]:
+            return self.range_statistics[statistic]
+        elif statistic in ["idxmax", "idxmin"]:
+            row = self.range_statistics["max_row" if statistic == "idxmax" else "min_row"]
+            return row if np.isnan(row) else self.index[row]
+        raise Exception("Statistic is not valid!")
+
+# The group index of each dataframe which is still in use, keyed by the id of the dataframe
+group_indexes = {}
+
+def set_group_index(data: pd.DataFrame, group_index):
+    """Sets the group index of a dataframe, which is kept until the dataframe is deleted"""
+    group_indexes[id(data)] = group_index
+    weakref.finalize(data, group_indexes.pop, id(data), None)
+
+def get_group_index(data: pd.DataFrame):
+    """Returns the DataGroupIndex of a dataframe, creating it the first time. The index is kept until the
+       dataframe is deleted"""
+    group_index = group_indexes.get(id(data))
+    if group_index is None:
+        group_index = DataGroupIndex(data)
+        set_group_index(data, group_index)
+    return group_index
 
 def group_data(data: pd.DataFrame, data_grouping):
     """Groups the data according to the data_grouping
@@ -97,31 +1323,32 @@ def group_data(data: pd.DataFrame, data_grouping):
         data_grouping (str): How the data will be grouped. Can be 'none', 'day', 'time', 'month', or 'year'
 
     Returns:
-        Pandas Group Object: The grouped data
+        GroupedData: The grouped data, which is only computed the first time a dataframe is grouped this way
     """
-    freq_dict = {"none" : None, "day": "D", "time" : "H", "month" : "M", "year" : "Y"}
-    freq = freq_dict[data_grouping]
+    if not data_grouping in ["none"] + GROUPINGS:
+        raise Exception("Data grouping is not valid!")
+    return get_group_index(data).get_groups(data_grouping)
 
-    if data_grouping == "none":
-        # Do not group data
-        data_group = data.groupby(data["date"])
-    elif data_grouping == "day":
-        data_group = data.groupby(data["date"].dt.day)
-    elif data_grouping == "time":
-        data_group = data.groupby(data["date"].dt.day_of_week)
-    elif data_grouping == "month":
-        data_group = data.groupby(data["date"].dt.month)
-    elif data_grouping == "year":
-        data_group = data.groupby(data["date"].dt.year)
+# The last response converted by 'get_response_dataframe' and its dataframe
+last_response = (None, None)
 
-    data = data_group["value"]
-    return data
+def get_response_dataframe(raw_data):
+    """Converts a response with 'convert_response_to_dataframe', reusing the dataframe if the response is the same as
+       last time so its group index is reused too. Dataframes are returned as they are"""
+    global last_response
+    if isinstance(raw_data, pd.DataFrame):
+        return raw_data
+    if last_response[0] is not raw_data:
+        last_response = (raw_data, convert_response_to_dataframe(raw_data))
+    return last_response[1]
 
-def display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_settings):
+def display_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_settings,
+                            store=None, renderer=None):
     """Displays all the currently active data displays using the supplied data
 
     Args:
-        raw_data (reponse): The raw json data fetched from the API
+        raw_data (reponse / pd.DataFrame): The raw json data fetched from the API, or the data already converted by
+                                           'convert_response_to_dataframe' (or from a MonitoringSession)
         data_grouping (str): A enum like string which describes how the data will be grouped
         monitoring_station (str): The  monitoring station code
         pollutant (str): The pollutant code
@@ -129,12 +1356,31 @@ def display_monitoring_data(raw_data, data_grouping, monitoring_station, polluta
         end_date (datetime): The latest date in the data
         scale_max (int): The maximum value shown in barcharts
         display_settings ([str]): Specifies which data displays will be shown
+        store (MonitoringStore, optional): If given, the data is read from this store (which a PollingScheduler keeps
+                                           fresh) instead of raw_data, without any network calls. Defaults to None.
+        renderer (utils.FrameRenderer, optional): The renderer the frame is drawn with. Defaults to None, which uses
+                                                  utils.DEFAULT_RENDERER.
     """
-    utils.clear_screen()
-    
+    # The frame is composed in a buffer and written to the terminal at once, redrawing only the lines that changed
+    with contextlib.redirect_stdout(io.StringIO()) as frame:
+        show_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max,
+                             display_settings, store)
+    utils.get_renderer(renderer).render(frame.getvalue())
+
+def show_monitoring_data(raw_data, data_grouping, monitoring_station, pollutant, start_date, end_date, scale_max, display_settings,
+                         store=None):
+    """Prints the data displays of 'display_monitoring_data', which takes the same arguments"""
     print(f"Monitoring station: {monitoring_station}. Pollutant: {pollutant}. Date: {start_date} - {end_date}")
     
-    data = convert_response_to_dataframe(raw_data)
+    if store is not None:
+        raw_data = store.get_data(monitoring_station, pollutant, start_date, end_date)
+        if store.get_error(monitoring_station, pollutant) is not None:
+            print(f"The last update failed! Error: {store.get_error(monitoring_station, pollutant)}")
+        if raw_data is None:
+            print("Waiting for the first update...")
+            return
+    
+    data = get_response_dataframe(raw_data)
     data_group = group_data(data, data_grouping)
     
     # Data for ranges
@@ -178,6 +1424,8 @@ def show_data_as_table(data: pd.DataFrame, data_grouping):
     elif data_grouping == "year":
         date_converter = lambda date: date
     
+    # The table is built as a list of lines and printed with one write
+    lines = []
     for group in data:
         date = group[0]
         pollution_data = group[1].values
@@ -185,17 +1433,19 @@ def show_data_as_table(data: pd.DataFrame, data_grouping):
         date = date_converter(date)
         
         # Display the date with padding
-        print(str(date).ljust(21), end="")
+        line = [str(date).ljust(21)]
         
         # Get all the data, until the console runs out of column space
         for value in pollution_data[:MAX_DATA]:
             value = round(value, 1)
             # Print value with spacing so values are aligned
-            print(str(value).ljust(7), end="")
+            line.append(str(value).ljust(7))
         # If there is too much data to show, show ellipses
         if len(pollution_data) > MAX_DATA:
-            print("...", end="")
-        print()
+            line.append("...")
+        lines.append("".join(line))
+    if len(lines) > 0:
+        print("\n".join(lines))
 
 def show_data_as_barchart(data: pd.DataFrame, data_grouping, scale_max):  
     """Displays the data in a barchart format
@@ -208,40 +1458,38 @@ def show_data_as_barchart(data: pd.DataFrame, data_grouping, scale_max):
     step = scale_max // 20
     MAX_DATA = 48
     
+    # The chart is built as a list of lines and printed with one write
+    lines = []
     # Console will only show around 48 columns of data
     data_count = data.shape[0]
     if data_count > MAX_DATA:
-        print("Too much data to show! Only showing the first 48 values!")
+        lines.append("Too much data to show! Only showing the first 48 values!")
         data_count = MAX_DATA
     width = data_count * 3
     
-    print("   ^")
+    lines.append("   ^")
     for i in range(scale_max, 0, -step):
         # Print index
-        print(str(i).rjust(3) + "|", end="")
+        line = [str(i).rjust(3) + "|"]
         # Print bar if data is high enough
-        j = 0
         # Only print values upto the maximum width
         for value in data[:MAX_DATA]:
             if np.isnan(value) and i == step:
-                print("NaN", end="")
+                line.append("NaN")
             elif value > scale_max and i == scale_max:
                 # Value is off the scale
-                print("!#!", end="")
+                line.append("!#!")
             elif value - i > 0:
-                print(" # ", end="")
+                line.append(" # ")
             else:
-                print("   ", end="")
-        print()
+                line.append("   ")
+        lines.append("".join(line))
      
     # Print hours   
-    print("---+" + "".rjust(width - 1, "-"), end="")
-    print(">")
-    print("   |", end="")
-    for i in range(min(data_count, MAX_DATA)):
-        print(str(i % data_count).ljust(3), end="")
-    print()
-    print(("Grouping: " + data_grouping).rjust(width // 2))
+    lines.append("---+" + "".rjust(width - 1, "-") + ">")
+    lines.append("   |" + "".join(str(i % data_count).ljust(3) for i in range(min(data_count, MAX_DATA))))
+    lines.append(("Grouping: " + data_grouping).rjust(width // 2))
+    print("\n".join(lines))
 
 def show_data_mean(data: pd.DataFrame):
     """Computes the mean of the data for a dataframe
@@ -250,7 +1498,7 @@ def show_data_mean(data: pd.DataFrame):
         data (pd.DataFrame or Group): The data which will be used for computation
     """
     if type(data) == pd.DataFrame:
-        mean = data.mean(numeric_only=True).value
+        mean = get_group_index(data).get_range_result("mean")
     else:
         mean = data.mean().mean()
     if np.isnan(mean):
@@ -266,7 +1514,7 @@ def show_data_median(data: pd.DataFrame):
         data (pd.DataFrame or Group): The data which will be used for computation
     """
     if type(data) == pd.DataFrame:
-        median = data.median(numeric_only=True).value
+        median = get_group_index(data).get_range_result("median")
     else:
         median = data.median().median()
     if np.isnan(median):
@@ -281,7 +1529,7 @@ def show_data_max(data: pd.DataFrame):
     Args:
         data (pd.DataFrame or Group): The data which will be used for computation
     """
-    idxmax = data["value"].idxmax()
+    idxmax = get_group_index(data).get_range_result("idxmax")
     if np.isnan(idxmax):
         print("There is no maximum value as there is no data")
     else:
@@ -296,7 +1544,7 @@ def show_data_min(data: pd.DataFrame):
     Args:
         data (pd.DataFrame or Group): The data which will be used for computation
     """
-    idxmin = data["value"].idxmin()
+    idxmin = get_group_index(data).get_range_result("idxmin")
     if np.isnan(idxmin):
         print("There is no minimum value as there is no data")
     else:
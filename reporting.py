@@ -1,182 +1,1070 @@
-
 import pandas as pd
 import numpy as np
 
 import datetime as dt
+import collections
+import collections.abc
+import concurrent.futures
+import glob
+import hashlib
+import itertools
+import json
+import os
+import threading
+
+import utils
+
+# The station registry lists the monitoring stations and their csv files (relative to the registry file)
+STATION_REGISTRY_FILE = "data/stations.json"
+
+# Bump this whenever the layout of the columnar cache changes, so old sidecar files are rebuilt
+CACHE_VERSION = 1
+SECONDS_PER_DAY = 86400
+# The most memory the aggregate cache may use for computed arrays
+AGGREGATE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Group by day, by hour of the day or by month
+AGGREGATE_FREQUENCIES = ["D", "H", "M"]
+AGGREGATE_STATISTICS = ["mean", "median", "max", "min", "count", "missing"]
+# Report aggregations are named '<period>-<statistic>', e.g. 'daily-mean' or 'hourly-max'
+REPORT_PERIODS = {"hourly": "H", "daily": "D", "monthly": "M"}
+REPORT_COLUMNS = ["station", "pollutant", "aggregation", "group", "value"]
+# The number of csv rows read at a time when streaming station files
+STREAM_CHUNK_SIZE = 100000
+# The most date ranges of a station whose StationData is kept, the least recently used range is dropped first
+RANGE_DATA_CACHE_SIZE = 16
+
+def get_cache_file_names(file_name):
+    """Returns the file names of the columnar cache (data, metadata) that sit next to a csv file"""
+    return (file_name + ".cache.npy", file_name + ".cache.json")
 
-VALID_MONITORING_STATIONS = ["HRL", "MY1", "KC1"]
-VALID_POLLUTANT_TYPES = ["no", "pm10", "pm25"]
+def get_file_hash(file_name):
+    """Returns the sha256 hash of a file as a hex string"""
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
 
-def get_data_from_csv(file_name):
-    """Returns a numpy array containing the data from the csv file"""
-    # Uses pandas library to read the csv file into a pandas DataFrame
-    data = pd.read_csv(file_name)
+def get_missing_mask_type(pollutant_count):
+    """Returns the smallest unsigned integer type which has a bit for every pollutant"""
+    for mask_type in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if pollutant_count <= np.iinfo(mask_type).bits:
+            return mask_type
+    raise Exception("Too many pollutant columns for the missing data mask!")
+
+def parse_csv_columns(file_name):
+    """Parses a monitoring station csv file into a structured numpy array.
+    The array has an int64 'timestamp' column (seconds since the epoch at the end of the measurement hour),
+    a float32 column for each pollutant where missing data is 'nan', and a 'missing' bitmask column
+    where bit i is set when the i-th pollutant is missing"""
+    # "No data" is how the csv files mark missing values
+    return dataframe_to_columns(pd.read_csv(file_name, na_values=["No data"]))
+
+def dataframe_to_columns(data):
+    """Converts a DataFrame read from a monitoring station csv file into a structured numpy array (see 'parse_csv_columns')"""
+    pollutants = [column for column in data.columns if column not in ("date", "time")]
+    mask_type = get_missing_mask_type(len(pollutants))
+    
+    columns = np.empty(len(data), dtype=[("timestamp", np.int64)]
+                                        + [(pollutant, np.float32) for pollutant in pollutants]
+                                        + [("missing", mask_type)])
+    
+    # The time column runs from 01:00:00 to 24:00:00, so it is added to the date as a time delta
+    timestamps = pd.to_datetime(data["date"], format='%Y-%m-%d') + pd.to_timedelta(data["time"])
+    columns["timestamp"] = timestamps.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    
+    missing = np.zeros(len(data), dtype=mask_type)
+    for bit, pollutant in enumerate(pollutants):
+        values = data[pollutant].to_numpy(dtype=np.float32)
+        columns[pollutant] = values
+        missing |= np.isnan(values).astype(mask_type) << mask_type(bit)
+    columns["missing"] = missing
     
-    # Convert date format to a better format for pandas
-    data["date"] = pd.to_datetime(data["date"], format='%Y-%m-%d')
+    return columns
+
+def read_cache_metadata(file_name):
+    """Returns the metadata of the columnar cache for a csv file, or None if there is no usable cache"""
+    cache_file_name, metadata_file_name = get_cache_file_names(file_name)
+    if not os.path.exists(cache_file_name):
+        return None
+    try:
+        with open(metadata_file_name, "r") as file:
+            metadata = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if metadata.get("version") != CACHE_VERSION:
+        return None
+    return metadata
+
+def write_cache(file_name, columns, metadata):
+    """Writes the columnar cache and its metadata next to the csv file.
+    Files are written to a temporary name first, so a crash never leaves a half written cache behind"""
+    cache_file_name, metadata_file_name = get_cache_file_names(file_name)
+    try:
+        # np.save would add '.npy' to the temporary name, so an open file is passed instead
+        with open(cache_file_name + ".tmp", "wb") as file:
+            np.save(file, columns)
+        os.replace(cache_file_name + ".tmp", cache_file_name)
+        with open(metadata_file_name + ".tmp", "w") as file:
+            json.dump(metadata, file)
+        os.replace(metadata_file_name + ".tmp", metadata_file_name)
+    except OSError as err:
+        print(f"Failed to write cache for '{file_name}'! Error: {err}")
+
+def load_csv_columns(file_name, use_cache=True):
+    """Returns the columns of a monitoring station csv file as a structured numpy array (see 'parse_csv_columns').
+    The columns are memory-mapped from the sidecar cache file, which is only rebuilt when the csv file changes"""
+    if not use_cache:
+        return parse_csv_columns(file_name)
     
+    cache_file_name, metadata_file_name = get_cache_file_names(file_name)
+    file_stat = os.stat(file_name)
+    metadata = read_cache_metadata(file_name)
+
+    is_cache_valid = metadata is not None and metadata["size"] == file_stat.st_size
+    # Only hash the file if the modification time changed (e.g. the file was copied or touched)
+    if is_cache_valid and metadata["mtime_ns"] != file_stat.st_mtime_ns:
+        is_cache_valid = metadata["sha256"] == get_file_hash(file_name)
+        if is_cache_valid:
+            # Remember the new modification time so the file is not hashed again next time
+            metadata["mtime_ns"] = file_stat.st_mtime_ns
+            try:
+                with open(metadata_file_name, "w") as file:
+                    json.dump(metadata, file)
+            except OSError:
+                pass
+
+    if is_cache_valid:
+        try:
+            return np.load(cache_file_name, mmap_mode="r")
+        except (OSError, ValueError) as err:
+            print(f"Failed to read cache for '{file_name}'! Error: {err}")
+
+    columns = parse_csv_columns(file_name)
+    write_cache(file_name, columns, {
+        "version": CACHE_VERSION,
+        "mtime_ns": file_stat.st_mtime_ns,
+        "size": file_stat.st_size,
+        "sha256": get_file_hash(file_name),
+    })
+    return columns
+
+def build_csv_cache(file_name):
+    """Builds the columnar cache of a csv file if it is missing or out of date. Used by worker processes, which
+    return nothing so the columns are never copied back to the caller, who memory-maps the cache instead"""
+    load_csv_columns(file_name)
+
+def split_timestamps(timestamps):
+    """Splits timestamps (seconds since the epoch) into the day number since the epoch and the time of day in seconds.
+    A measurement at 24:00:00 belongs to the day before, so the time of day is in the range (0, 86400]"""
+    days = (timestamps - 1) // SECONDS_PER_DAY
+    seconds = timestamps - days * SECONDS_PER_DAY
+    return days, seconds
+
+def format_time_of_day(seconds):
+    """Formats a time of day in seconds as a 'HH:MM:SS' string"""
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def columns_to_dataframe(columns):
+    """Converts the structured array from 'load_csv_columns' to a pandas DataFrame with the same
+    'date', 'time' and pollutant columns as the csv file. Missing data is 'nan'"""
+    days, seconds = split_timestamps(np.asarray(columns["timestamp"]))
+    
+    # There are only a handful of distinct times, so only those are formatted as strings
+    unique_seconds, time_index = np.unique(seconds, return_inverse=True)
+    unique_times = np.array([format_time_of_day(s) for s in unique_seconds], dtype=object)
+    
+    data = pd.DataFrame({
+        "date": days.astype("datetime64[D]").astype("datetime64[ns]"),
+        "time": unique_times[time_index],
+    })
+    for pollutant in columns.dtype.names:
+        if pollutant not in ("timestamp", "missing"):
+            data[pollutant] = np.array(columns[pollutant])
     return data
 
-def get_monitering_station_data():
-    """Returns a pandas DataFrame containing all the data from all 3 monitering stations"""
-    HRLdata = get_data_from_csv("data/Pollution-London Harlington.csv")
-    MY1data = get_data_from_csv("data/Pollution-London Marylebone Road.csv")
-    KC1data = get_data_from_csv("data/Pollution-London N Kensington.csv")
+def get_data_from_csv(file_name, use_cache=True):
+    """Returns a pandas DataFrame containing the data from the csv file, where missing data is 'nan'"""
+    return columns_to_dataframe(load_csv_columns(file_name, use_cache))
 
-    stations_data = {"HRL":HRLdata, "MY1":MY1data, "KC1":KC1data}
-    return stations_data
+class StationData:
+    """The typed data of a single monitoring station, which is built once when the station is loaded.
+
+    Attributes:
+        pollutants ([str]): The pollutant codes in the data
+        timestamps (np.ndarray): The end of each measurement hour in seconds since the epoch
+        dates (np.ndarray): The date of each measurement (datetime64[D])
+        seconds (np.ndarray): The time of day of each measurement in seconds, in the range (0, 86400]
+        values (dict): The float32 measurements for each pollutant, where missing data is 'nan'
+        missing (dict): A boolean mask for each pollutant, which is True where the data is missing
+        days (np.ndarray): The sorted distinct dates (datetime64[D])
+        day_index (np.ndarray): The position of each measurement's date in 'days'
+        day_starts (np.ndarray): The first measurement of each date in 'days', followed by the number of measurements,
+                                 so the measurements of days[i] are day_starts[i]:day_starts[i + 1]
+        hours (np.ndarray): The sorted distinct times of day in seconds
+        hour_index (np.ndarray): The position of each measurement's time of day in 'hours'
+        months (np.ndarray): Every month from the first to the last measurement (datetime64[M])
+        month_index (np.ndarray): The position of each measurement's month in 'months'
+        generation (int): A number which is unique to this StationData, used to invalidate cached aggregates
+        group_layouts (dict): The GroupLayout for each aggregation frequency that has been used
+        range_data (OrderedDict): The StationData of the most recently used date ranges, see 'get_range_data'
+    """
+    # Every StationData gets a new generation, so cached aggregates of replaced data are never used
+    generations = itertools.count()
+
+    def __init__(self, timestamps, values, missing):
+        self.generation = next(StationData.generations)
+        self.pollutants = list(values.keys())
+        
+        # The date index needs the measurements in time order, which the csv files normally already are
+        if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = {pollutant: values[pollutant][order] for pollutant in self.pollutants}
+            missing = {pollutant: missing[pollutant][order] for pollutant in self.pollutants}
+        self.timestamps = timestamps
+        self.values = values
+        self.missing = missing
+        
+        days, self.seconds = split_timestamps(timestamps)
+        self.dates = days.astype("datetime64[D]")
+        
+        # Integer group indexes, so the reporting functions never have to compare dates or strings.
+        # As the data is sorted, each date is a contiguous run of measurements
+        is_first_of_day = np.ones(len(days), dtype=bool)
+        is_first_of_day[1:] = days[1:] != days[:-1]
+        self.day_index = np.cumsum(is_first_of_day) - 1
+        self.days = self.dates[is_first_of_day]
+        self.day_starts = np.append(np.flatnonzero(is_first_of_day), len(days))
+        self.hours, self.hour_index = np.unique(self.seconds, return_inverse=True)
+        # Months are not only the distinct months, so months without any data still get a 'nan' mean
+        months = self.dates.astype("datetime64[M]")
+        self.months = np.arange(months.min(), months.max() + 1)
+        self.month_index = (months - self.months[0]).astype(np.int64)
+        self.group_layouts = {}
+        self.range_data = collections.OrderedDict()
+    
+    @classmethod
+    def from_columns(cls, columns_list):
+        """Builds the station data from one or more structured arrays returned by 'load_csv_columns', e.g. one for each year.
+        If several arrays have a measurement for the same time, the measurement from the last array is used"""
+        if not isinstance(columns_list, (list, tuple)):
+            columns_list = [columns_list]
+        
+        # Every pollutant of every file, in the order they first appear
+        pollutants = []
+        for columns in columns_list:
+            pollutants += [name for name in columns.dtype.names if name not in ("timestamp", "missing") and name not in pollutants]
+        
+        timestamps = []
+        values = {pollutant: [] for pollutant in pollutants}
+        missing = {pollutant: [] for pollutant in pollutants}
+        for columns in columns_list:
+            missing_mask = np.asarray(columns["missing"])
+            file_pollutants = [name for name in columns.dtype.names if name not in ("timestamp", "missing")]
+            timestamps.append(np.asarray(columns["timestamp"]))
+            for pollutant in pollutants:
+                if pollutant in file_pollutants:
+                    bit = missing_mask.dtype.type(file_pollutants.index(pollutant))
+                    values[pollutant].append(np.asarray(columns[pollutant]))
+                    missing[pollutant].append((missing_mask >> bit) & 1 == 1)
+                else:
+                    # The pollutant was not measured for this file
+                    values[pollutant].append(np.full(len(columns), np.nan, dtype=np.float32))
+                    missing[pollutant].append(np.ones(len(columns), dtype=bool))
+        
+        if len(columns_list) == 1:
+            # A single file does not need to be copied, so memory-mapped columns stay memory-mapped
+            return cls(timestamps[0], {p: values[p][0] for p in pollutants}, {p: missing[p][0] for p in pollutants})
+        
+        timestamps = np.concatenate(timestamps)
+        values = {pollutant: np.concatenate(values[pollutant]) for pollutant in pollutants}
+        missing = {pollutant: np.concatenate(missing[pollutant]) for pollutant in pollutants}
+        # Sort by time, then keep the last measurement for each time
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        is_last = np.ones(len(timestamps), dtype=bool)
+        is_last[:-1] = timestamps[1:] != timestamps[:-1]
+        order = order[is_last]
+        return cls(timestamps[is_last], {p: values[p][order] for p in pollutants}, {p: missing[p][order] for p in pollutants})
+    
+    def get_day_position(self, date):
+        """Returns the position of a date (datetime64[D]) in 'days' with a binary search, or None if there is no data for the date"""
+        position = np.searchsorted(self.days, date)
+        if position < len(self.days) and self.days[position] == date:
+            return int(position)
+        return None
+    
+    def get_day_rows(self, date):
+        """Returns a slice of the measurements for a date (datetime64[D]). The slice is empty if there is no data for the date"""
+        position = np.searchsorted(self.days, date)
+        if position < len(self.days) and self.days[position] == date:
+            return slice(self.day_starts[position], self.day_starts[position + 1])
+        return slice(0, 0)
+    
+    def get_range_rows(self, start_date, end_date):
+        """Returns a slice of the measurements from the start date to the end date (datetime64[D]), including both dates"""
+        start = np.searchsorted(self.days, start_date, side="left")
+        end = np.searchsorted(self.days, end_date, side="right")
+        return slice(self.day_starts[start], self.day_starts[max(start, end)])
+    
+    def get_range_data(self, start_date=None, end_date=None):
+        """Returns the StationData of the measurements from the start date to the end date (datetime64[D]), including
+        both dates. The last RANGE_DATA_CACHE_SIZE date ranges are kept, so their group layouts and cached aggregates
+        are reused
+
+        Args:
+            start_date (np.datetime64, optional): The first date. Defaults to None, which is the first date of the data.
+            end_date (np.datetime64, optional): The last date. Defaults to None, which is the last date of the data.
+
+        Exceptions:
+            Raises an exception if there are no measurements in the date range
+
+        Returns:
+            StationData: The data of the date range
+        """
+        start_date = self.days[0] if start_date is None else start_date
+        end_date = self.days[-1] if end_date is None else end_date
+        key = (start_date, end_date)
+        if key in self.range_data:
+            self.range_data.move_to_end(key)
+        else:
+            rows = self.get_range_rows(start_date, end_date)
+            if rows.stop <= rows.start:
+                raise Exception("There is no data for this date range!")
+            self.range_data[key] = StationData(self.timestamps[rows],
+                                               {p: self.values[p][rows] for p in self.pollutants},
+                                               {p: self.missing[p][rows] for p in self.pollutants})
+            if len(self.range_data) > RANGE_DATA_CACHE_SIZE:
+                self.range_data.popitem(last=False)
+        return self.range_data[key]
+    
+    def get_group_layout(self, freq):
+        """Returns the GroupLayout for 'D' (days), 'H' (hours of the day) or 'M' (months), building it on first use"""
+        if not freq in self.group_layouts:
+            if freq == "D":
+                self.group_layouts[freq] = GroupLayout(self.day_index, self.days)
+            elif freq == "H":
+                self.group_layouts[freq] = GroupLayout(self.hour_index, self.hours.astype("timedelta64[s]"))
+            elif freq == "M":
+                self.group_layouts[freq] = GroupLayout(self.month_index, self.months)
+            else:
+                raise Exception("Aggregation frequency is not valid!")
+        return self.group_layouts[freq]
+    
+    def fill_missing(self, pollutant, new_value):
+        """Returns a copy of the station data where the missing data for the pollutant is replaced by the new value"""
+        values = dict(self.values)
+        missing = dict(self.missing)
+        values[pollutant] = np.where(self.missing[pollutant], np.float32(new_value), self.values[pollutant])
+        missing[pollutant] = np.zeros_like(self.missing[pollutant])
+        return StationData(self.timestamps, values, missing)
+
+def get_station_data(file_names, use_cache=True):
+    """Returns the StationData for one monitoring station csv file, or for a list of csv files (e.g. one for each year)"""
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    return StationData.from_columns([load_csv_columns(file_name, use_cache) for file_name in file_names])
+
+def load_station_registry(registry_file=STATION_REGISTRY_FILE):
+    """Reads the station registry, a json file which maps each monitoring station code to its name and csv files.
+    File names are relative to the registry file and may be glob patterns, e.g. "Pollution-London Harlington-*.csv"
+
+    Args:
+        registry_file (str, optional): The file name of the registry. Defaults to STATION_REGISTRY_FILE.
+
+    Exceptions:
+        Raises an exception if a station has no csv files
+
+    Returns:
+        dict: The name ('name') and the sorted list of csv file names ('files') for each monitoring station code
+    """
+    with open(registry_file, "r") as file:
+        registry = json.load(file)
+    
+    directory = os.path.dirname(registry_file)
+    stations = {}
+    for monitoring_station, station in registry.items():
+        file_names = []
+        for pattern in station["files"]:
+            file_names += sorted(glob.glob(os.path.join(directory, pattern)))
+        if len(file_names) == 0:
+            raise Exception(f"There are no csv files for monitoring station '{monitoring_station}'!")
+        stations[monitoring_station] = {"name": station.get("name", monitoring_station), "files": file_names}
+    return stations
+
+class StationRegistry(collections.abc.Mapping):
+    """A dictionary of monitoring station codes to StationData, which only loads a station the first time it is used.
+    It can be used anywhere the reporting functions expect the monitoring station data.
+
+    Attributes:
+        stations (dict): The name and csv files of each monitoring station (see 'load_station_registry')
+        use_cache (bool): Whether the columnar csv cache is used
+        workers (int): The number of processes used by 'preload', or None for one per CPU
+    """
+    def __init__(self, stations, use_cache=True, workers=None):
+        self.stations = stations
+        self.use_cache = use_cache
+        self.workers = workers
+        self.loaded = {}
+        self.lock = threading.Lock()
+    
+    def __getitem__(self, monitoring_station):
+        if not monitoring_station in self.stations:
+            raise KeyError(monitoring_station)
+        with self.lock:
+            if not monitoring_station in self.loaded:
+                # The new StationData has a new generation, so aggregates cached from other data for the same station
+                # code (e.g. by another registry) are never used for it
+                self.loaded[monitoring_station] = get_station_data(self.stations[monitoring_station]["files"], self.use_cache)
+            return self.loaded[monitoring_station]
+    
+    def __iter__(self):
+        return iter(self.stations)
+    
+    def __len__(self):
+        return len(self.stations)
+    
+    def get_name(self, monitoring_station):
+        """Returns the full name of a monitoring station"""
+        return self.stations[monitoring_station]["name"]
+    
+    def is_loaded(self, monitoring_station):
+        """Returns True if the data for the monitoring station has been loaded"""
+        return monitoring_station in self.loaded
+    
+    def preload(self, monitoring_stations=None):
+        """Loads several monitoring stations at once, parsing their csv files in parallel in a process pool.
+        With the columnar cache the workers only build the cache files, which are then memory-mapped here
+
+        Args:
+            monitoring_stations ([str], optional): The station codes to load. Defaults to every station.
+        """
+        monitoring_stations = list(self.stations) if monitoring_stations is None else monitoring_stations
+        monitoring_stations = [station for station in monitoring_stations if not self.is_loaded(station)]
+        file_names = [file_name for station in monitoring_stations for file_name in self.stations[station]["files"]]
+        if len(file_names) == 0:
+            return
+        
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            if self.use_cache:
+                list(executor.map(build_csv_cache, file_names))
+            else:
+                columns = dict(zip(file_names, executor.map(parse_csv_columns, file_names)))
+        if self.use_cache:
+            columns = {file_name: load_csv_columns(file_name) for file_name in file_names}
+        
+        with self.lock:
+            for monitoring_station in monitoring_stations:
+                files = self.stations[monitoring_station]["files"]
+                self.loaded[monitoring_station] = StationData.from_columns([columns[file_name] for file_name in files])
+
+def check_station_and_pollutant(data, monitoring_station, pollutant):
+    """Raises an exception if the monitoring station is not in the data, or if the station does not measure the pollutant"""
+    if not monitoring_station in data:
+        raise Exception("Monitoring station type is not valid!")
+    if not pollutant in data[monitoring_station].pollutants:
+        raise Exception("Pollutant type is not valid!")
+
+class AggregateCache:
+    """A least recently used cache for aggregate arrays, keyed by (monitoring station, pollutant, aggregation).
+    Each entry remembers the generation of the StationData it was computed from, so entries computed from
+    data that has since been reloaded or changed are treated as misses and thrown away.
+
+    Attributes:
+        max_bytes (int): The most memory the cached arrays may use
+        size_bytes (int): The memory currently used by the cached arrays
+        hits (int): The number of lookups that were answered from the cache
+        misses (int): The number of lookups that had to compute the aggregate
+    """
+    def __init__(self, max_bytes=AGGREGATE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key, station_data):
+        """Returns a copy of the cached array for the key, so the caller may change it, or None if it is not cached for
+        this station data"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != station_data.generation:
+                # The station data was reloaded or changed since the entry was computed
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1].copy()
+    
+    def put(self, key, station_data, array):
+        """Caches a copy of an array for the key, evicting the least recently used arrays until it fits. The caller's
+        array is not changed, and may still be changed by the caller"""
+        if array.nbytes > self.max_bytes:
+            return
+        # The cached copy is never handed out, so it is read-only to catch accidental changes
+        array = array.copy()
+        array.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            while self.size_bytes + array.nbytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+            self.entries[key] = (station_data.generation, array)
+            self.size_bytes += array.nbytes
+    
+    def get_or_compute(self, key, station_data, compute):
+        """Returns a copy of the cached array for the key, calling compute() and caching its result on a miss"""
+        array = self.get(key, station_data)
+        if array is None:
+            array = compute()
+            self.put(key, station_data, array)
+        return array
+    
+    def remove(self, key):
+        """Removes a cached array. The lock must be held by the caller"""
+        _, array = self.entries.pop(key)
+        self.size_bytes -= array.nbytes
+    
+    def invalidate(self, monitoring_station=None):
+        """Removes every cached array for a monitoring station, or the whole cache if no station is given"""
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if monitoring_station is None or key[0] == monitoring_station:
+                    self.remove(key)
+
+# The cache shared by all the reporting functions
+AGGREGATE_CACHE = AggregateCache()
+
+class GroupLayout:
+    """Describes how the measurements of a StationData are split into contiguous groups for one frequency.
+
+    Attributes:
+        labels (np.ndarray): The label of each group (a date, a time of day or a month)
+        order (np.ndarray): The permutation which makes every group contiguous, or None if they already are
+        starts (np.ndarray): The position of the first measurement of each group, after 'order' is applied
+        row_counts (np.ndarray): The number of measurements in each group
+        width (int): The number of measurements in every group if all groups are the same size, otherwise None
+    """
+    def __init__(self, group_index, labels):
+        self.labels = labels
+        # The day and month indexes are already sorted for time ordered data, so they need no permutation
+        if len(group_index) > 1 and np.any(group_index[1:] < group_index[:-1]):
+            self.order = np.argsort(group_index, kind="stable")
+        else:
+            self.order = None
+        self.row_counts = np.bincount(group_index, minlength=len(labels))
+        self.starts = np.cumsum(self.row_counts) - self.row_counts
+        # A full year of hourly data is 365 days of 24 hours, so it can be reshaped instead of reduced group by group
+        if len(labels) > 0 and np.all(self.row_counts == self.row_counts[0]):
+            self.width = int(self.row_counts[0])
+        else:
+            self.width = None
+    
+    def sort(self, array):
+        """Returns the array reordered so that every group is contiguous"""
+        return array if self.order is None else array[self.order]
+    
+    def reduce(self, ufunc, array, empty_value):
+        """Applies a ufunc (e.g. np.add, np.maximum) to every group of a sorted array in a single pass"""
+        if self.width is not None and self.width > 0:
+            return ufunc.reduce(array.reshape(-1, self.width), axis=1)
+        result = np.full(len(self.labels), empty_value, dtype=array.dtype)
+        non_empty = self.row_counts > 0
+        result[non_empty] = ufunc.reduceat(array, self.starts[non_empty])
+        return result
+    
+    def sort_within_groups(self, array):
+        """Returns a sorted array with the values of each group sorted in ascending order, with 'nan' last"""
+        if self.width is not None and self.width > 0:
+            return np.sort(array.reshape(-1, self.width), axis=1).ravel()
+        group_index = np.repeat(np.arange(len(self.labels)), self.row_counts)
+        return array[np.lexsort((array, group_index))]
+
+def compute_statistics(station_data, pollutant, freq, stats):
+    """Computes every requested statistic for a pollutant in one pass over the groups of a frequency.
+
+    Args:
+        station_data (StationData): The data of one monitoring station
+        pollutant (str): The pollutant code
+        freq (str): 'D' for each day, 'H' for each hour of the day, or 'M' for each month
+        stats ([str]): The statistics to compute, from AGGREGATE_STATISTICS
+
+    Returns:
+        dict: An array with a value for each group for every statistic. Groups without data have 'nan' statistics
+    """
+    layout = station_data.get_group_layout(freq)
+    missing = layout.sort(station_data.missing[pollutant])
+    values = layout.sort(station_data.values[pollutant]).astype(np.float64)
+    
+    counts = layout.reduce(np.add, (~missing).astype(np.int64), 0)
+    has_values = counts > 0
+    results = {}
+    
+    if "count" in stats:
+        results["count"] = counts
+    if "missing" in stats:
+        results["missing"] = layout.row_counts - counts
+    if "mean" in stats:
+        sums = layout.reduce(np.add, np.where(missing, 0.0, values), 0.0)
+        results["mean"] = np.full(len(counts), np.nan)
+        np.divide(sums, counts, out=results["mean"], where=has_values)
+    if "max" in stats:
+        results["max"] = np.where(has_values, layout.reduce(np.maximum, np.where(missing, -np.inf, values), -np.inf), np.nan)
+    if "min" in stats:
+        results["min"] = np.where(has_values, layout.reduce(np.minimum, np.where(missing, np.inf, values), np.inf), np.nan)
+    if "median" in stats:
+        # Missing values are sorted to the end of their group, so the middle of the first 'count' values is the median
+        sorted_values = layout.sort_within_groups(np.where(missing, np.nan, values))
+        starts = layout.starts[has_values]
+        lower = sorted_values[starts + (counts[has_values] - 1) // 2]
+        upper = sorted_values[starts + counts[has_values] // 2]
+        results["median"] = np.full(len(counts), np.nan)
+        results["median"][has_values] = (lower + upper) / 2
+    
+    return results
+
+def get_station_range_data(data, monitoring_station, start_date=None, end_date=None):
+    """Returns the StationData of a monitoring station, or of a date range of it if either date is given"""
+    if start_date is None and end_date is None:
+        return data[monitoring_station]
+    return data[monitoring_station].get_range_data(start_date, end_date)
+
+def get_statistics(data, monitoring_station, pollutant, freq, stats, start_date=None, end_date=None):
+    """Returns a dictionary with an array for every requested statistic, using the aggregate cache.
+    Statistics that are not cached are all computed together in one pass. If a start or end date (datetime64[D])
+    is given, only the measurements of that date range are used"""
+    station_data = get_station_range_data(data, monitoring_station, start_date, end_date)
+    # Aggregates of a date range are cached separately from the aggregates of the whole data
+    date_range = () if start_date is None and end_date is None else (start_date, end_date)
+    results = {}
+    for stat in stats:
+        cached = AGGREGATE_CACHE.get((monitoring_station, pollutant, (freq, stat) + date_range), station_data)
+        if cached is not None:
+            results[stat] = cached
+    
+    missing_stats = [stat for stat in stats if stat not in results]
+    if len(missing_stats) > 0:
+        computed = compute_statistics(station_data, pollutant, freq, missing_stats)
+        for stat in missing_stats:
+            AGGREGATE_CACHE.put((monitoring_station, pollutant, (freq, stat) + date_range), station_data, computed[stat])
+            results[stat] = computed[stat]
+    return results
+
+def aggregate(data, monitoring_station, pollutants=None, freq="D", stats=None, start_date=None, end_date=None):
+    """Computes several statistics for several pollutants of a monitoring station at once.
+
+    Args:
+        data (dict): The monitoring station data from 'get_monitering_station_data'
+        monitoring_station (str): The monitoring station code
+        pollutants ([str], optional): The pollutant codes. Defaults to every pollutant of the station.
+        freq (str, optional): 'D' for each day, 'H' for each hour of the day, or 'M' for each month. Defaults to 'D'.
+        stats ([str], optional): The statistics from AGGREGATE_STATISTICS. Defaults to all of them.
+        start_date (np.datetime64, optional): The first date (datetime64[D]) used. Defaults to None, the first date of the data.
+        end_date (np.datetime64, optional): The last date (datetime64[D]) used. Defaults to None, the last date of the data.
+
+    Exceptions:
+        Raises an exception if the monitoring station, a pollutant, the frequency or a statistic is not valid, or if
+        there is no data in the date range
+
+    Returns:
+        np.ndarray: A structured array with a row for each group. The 'group' field holds the group label, and there is
+                    a field for each pollutant holding a field for each statistic, e.g. result["no"]["mean"]
+    """
+    if not monitoring_station in data:
+        raise Exception("Monitoring station type is not valid!")
+    pollutants = data[monitoring_station].pollutants if pollutants is None else pollutants
+    for pollutant in pollutants:
+        check_station_and_pollutant(data, monitoring_station, pollutant)
+    if not freq in AGGREGATE_FREQUENCIES:
+        raise Exception("Aggregation frequency is not valid!")
+    stats = AGGREGATE_STATISTICS if stats is None else stats
+    for stat in stats:
+        if not stat in AGGREGATE_STATISTICS:
+            raise Exception("Aggregation statistic is not valid!")
+    
+    labels = get_station_range_data(data, monitoring_station, start_date, end_date).get_group_layout(freq).labels
+    stat_types = [(stat, np.int64 if stat in ("count", "missing") else np.float64) for stat in stats]
+    result = np.empty(len(labels), dtype=[("group", labels.dtype)] + [(pollutant, stat_types) for pollutant in pollutants])
+    result["group"] = labels
+    for pollutant in pollutants:
+        statistics = get_statistics(data, monitoring_station, pollutant, freq, stats, start_date, end_date)
+        for stat in stats:
+            result[pollutant][stat] = statistics[stat]
+    return result
+
+def parse_aggregation(aggregation):
+    """Splits a report aggregation such as 'daily-mean' into the aggregation frequency and statistic, e.g. ('D', 'mean')"""
+    period, _, stat = aggregation.lower().partition("-")
+    if not period in REPORT_PERIODS or not stat in AGGREGATE_STATISTICS:
+        raise Exception(f"Aggregation '{aggregation}' is not valid! Use a period from {list(REPORT_PERIODS)} "
+                        f"and a statistic from {AGGREGATE_STATISTICS}, e.g. 'daily-mean'")
+    return REPORT_PERIODS[period], stat
+
+def format_group_labels(labels):
+    """Formats the group labels of 'aggregate' as strings: 'YYYY-MM-DD' for days, 'HH:MM:SS' for hours and 'YYYY-MM' for months"""
+    if labels.dtype.kind == "m":
+        return [format_time_of_day(seconds) for seconds in labels.astype(np.int64).tolist()]
+    return np.datetime_as_string(labels).tolist()
+
+def check_report(data, monitoring_stations, pollutants, aggregations, start_date=None, end_date=None):
+    """Raises an exception if any of the monitoring stations, pollutants or aggregations of a report is not valid,
+    or if a monitoring station has no data in the date range"""
+    for aggregation in aggregations:
+        parse_aggregation(aggregation)
+    for monitoring_station in monitoring_stations:
+        for pollutant in pollutants:
+            check_station_and_pollutant(data, monitoring_station, pollutant)
+        get_station_range_data(data, monitoring_station, start_date, end_date)
+
+def report(data, monitoring_stations, pollutants, aggregations, start_date=None, end_date=None):
+    """Generates the rows of a report one at a time, so reports can be written out without being kept in memory.
+    The statistics come from 'aggregate', so each frequency is computed in a single pass and cached for later reports
+
+    Args:
+        data (dict): The monitoring station data from 'get_monitering_station_data'
+        monitoring_stations ([str]): The monitoring station codes
+        pollutants ([str]): The pollutant codes, which every monitoring station must measure
+        aggregations ([str]): The aggregations, e.g. ['daily-mean', 'monthly-max'] (see 'parse_aggregation')
+        start_date (np.datetime64, optional): The first date (datetime64[D]) used. Defaults to None, the first date of the data.
+        end_date (np.datetime64, optional): The last date (datetime64[D]) used. Defaults to None, the last date of the data.
+
+    Exceptions:
+        Raises an exception if a monitoring station, pollutant or aggregation is not valid, or if there is no data in the date range
+
+    Yields:
+        tuple: A row with a value for each of REPORT_COLUMNS. Groups without data have a 'nan' value
+    """
+    check_report(data, monitoring_stations, pollutants, aggregations, start_date, end_date)
+    
+    # The statistics of each frequency, in the order the frequencies are first used
+    frequencies = {}
+    for aggregation in aggregations:
+        freq, stat = parse_aggregation(aggregation)
+        frequencies.setdefault(freq, []).append((aggregation, stat))
+    
+    for monitoring_station in monitoring_stations:
+        for freq, freq_aggregations in frequencies.items():
+            stats = list(dict.fromkeys(stat for _, stat in freq_aggregations))
+            result = aggregate(data, monitoring_station, pollutants, freq, stats, start_date, end_date)
+            groups = format_group_labels(result["group"])
+            for pollutant in pollutants:
+                for aggregation, stat in freq_aggregations:
+                    for group, value in zip(groups, result[pollutant][stat].tolist()):
+                        yield (monitoring_station, pollutant, aggregation, group, value)
+
+def get_monitering_station_data(registry_file=STATION_REGISTRY_FILE, use_cache=True, workers=None):
+    """Returns a StationRegistry for all the monitering stations in the station registry file.
+    Each station's data is loaded the first time it is used"""
+    return StationRegistry(load_station_registry(registry_file), use_cache, workers)
 
 def get_inital_date(data, monitoring_station):
     """Returns the first date for the specific monitoring station as a DateTime object"""
     data = data[monitoring_station]
-    return data["date"].at[0]
+    return pd.Timestamp(data.days[0])
+
+def parse_date(date):
+    """Converts a 'YYYY-MM-DD' string to a numpy date (datetime64[D])"""
+    return np.datetime64(dt.datetime.strptime(date, "%Y-%m-%d").date(), "D")
 
 def get_date_index(data, monitoring_station, date):
-    """Returns the numerical position of the date in the monitoring station data sheet in days (integer)"""
-    return (dt.datetime.strptime(date, "%Y-%m-%d") - get_inital_date(data, monitoring_station)).days
+    """Returns the numerical position of the date in the daily arrays of the monitoring station (integer).
+    Days without any measurements are not in the daily arrays, so an exception is raised for them"""
+    position = data[monitoring_station].get_day_position(parse_date(date))
+    if position is None:
+        raise Exception("There is no data for this date!")
+    return position
 
-def daily_average(data, monitoring_station, pollutant):
-    """Returns the mean pollutant concentration for each day for the specified monitoring station.
-    If there is no data avaliable, the mean will be 'nan'"""
+def get_month_index(data, monitoring_station, year, month):
+    """Returns the numerical position of a month (the year and the month number from 1 to 12) in the monthly arrays
+    of the monitoring station (integer). The monthly arrays have every month from the first to the last measurement,
+    so an exception is raised for months outside of them"""
+    months = data[monitoring_station].months
+    position = int((np.datetime64(f"{int(year):04d}-{int(month):02d}", "M") - months[0]).astype(np.int64))
+    if position < 0 or position >= len(months):
+        raise Exception("There is no data for this month!")
+    return position
+
+def daily_statistic(data, monitoring_station, pollutant, date, stat="mean"):
+    """Returns one statistic ('mean', 'median', 'max', 'min' or 'count') of the pollutant concentration for a single date.
+    Only the measurements of that date are used. If there is no data avaliable, the statistic will be 'nan'"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
+    check_station_and_pollutant(data, monitoring_station, pollutant)
+    if not stat in ["mean", "median", "max", "min", "count"]:
+        raise Exception("Aggregation statistic is not valid!")
     
-    # Remove missing data, so it does not alter the mean (pandas.groupby automatically removes 'nan' values)
-    data = fill_missing_data(data, np.nan, monitoring_station, pollutant)
     data = data[monitoring_station]
+    rows = data.get_day_rows(parse_date(date))
+    values = data.values[pollutant][rows][~data.missing[pollutant][rows]].astype(np.float64)
     
-    # Convert data from string to float to calculate mean
-    data[pollutant] = data[pollutant].astype(float)
+    if stat == "count":
+        return len(values)
+    if len(values) == 0:
+        return np.nan
+    if stat == "mean":
+        return values.mean()
+    elif stat == "median":
+        return np.median(values)
+    elif stat == "max":
+        return values.max()
+    return values.min()
+
+def daily_average(data, monitoring_station, pollutant):
+    """Returns the mean pollutant concentration for each day for the specified monitoring station.
+    If there is no data avaliable, the mean will be 'nan'"""
+    # Check that monitoring stations and pollutants are valid
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
-    # Group the data by date
-    data = data.groupby(["date"])[pollutant]
-    # Use pandas for mean
-    mean = data.mean()
-    return mean.to_numpy()
+    return get_statistics(data, monitoring_station, pollutant, "D", ["mean"])["mean"]
 
 def daily_median(data, monitoring_station, pollutant):
     """Returns the median pollutant concentration for each day for the specified monitoring station.
     If there is no data avaliable, the mean will be 'nan'"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
-    
-    # Remove missing data, so it does not alter the mean (pandas.groupby automatically removes 'nan' values)
-    data = fill_missing_data(data, np.nan, monitoring_station, pollutant)
-    data = data[monitoring_station]
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
-    # Convert data from string to float to calculate mean
-    data[pollutant] = data[pollutant].astype(float)
-    
-    # Group the data by date
-    data = data.groupby(["date"])[pollutant]
-    # Use pandas for median
-    median = data.median()
-    return median.to_numpy()
+    return get_statistics(data, monitoring_station, pollutant, "D", ["median"])["median"]
 
 def hourly_average(data, monitoring_station, pollutant):
     """Returns the mean value for pollutant concentration for each hour (24 hours) for the specified monitoring station.
     If there is no data avaliable, the mean will be 'nan'"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
-    
-    # Remove missing data, so it does not alter the mean (pandas.groupby automatically removes 'nan' values)
-    data = fill_missing_data(data, np.nan, monitoring_station, pollutant)
-    data = data[monitoring_station]
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
-    # Convert data from string to float to calculate mean
-    data[pollutant] = data[pollutant].astype(float)
-    
-    # Group the data by hour
-    data = data.groupby(["time"])[pollutant]
-    # Use pandas for mean
-    mean = data.mean()
-    return mean.to_numpy()
+    return get_statistics(data, monitoring_station, pollutant, "H", ["mean"])["mean"]
 
 def monthly_average(data, monitoring_station, pollutant):
     """Returns the mean value for pollutant concentration for each month for the specified monitoring station.
     If there is no data avaliable, the mean will be 'nan'"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
-    
-    # Remove missing data, so it does not alter the mean (pandas.groupby automatically removes 'nan' values)
-    data = fill_missing_data(data, np.nan, monitoring_station, pollutant)
-    data = data[monitoring_station]
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
-    # Convert data from string to float to calculate mean
-    data[pollutant] = data[pollutant].astype(float)
-    
-    # Group the data by month
-    data = data.groupby(pd.Grouper(key="date", freq="M"))[pollutant]
-    # Use pandas for mean
-    mean = data.mean()
-    return mean.to_numpy()
+    return get_statistics(data, monitoring_station, pollutant, "M", ["mean"])["mean"]
 
 def peak_hour_date(data, date, monitoring_station,pollutant):
     """Returns the peak pollution and the hour that pollution was reached for a specific date, monitoring station and pollutant.
     If all the data for the specific date and pollutant are missing, this function will return None
     """
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
-    
-    date = dt.datetime.strptime(date, "%Y-%m-%d")
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
-    # Remove missing data, so data can safely be converted to a float
-    data = fill_missing_data(data, -1, monitoring_station, pollutant)
     # Shadow data with data from relavent monitering station
     data = data[monitoring_station]
-    # Filter data by the specific date
-    data = data.loc[data["date"] == date]
-    
-    # First convert type from string to float, so max gives the numerical maximum
-    max_index = data[pollutant].astype(float).idxmax()
-    max_value = data[pollutant].at[max_index]
-    max_time = data["time"].at[max_index]
-    # Cut off the last 2 digits as the specification requires (removes the ':00' at the end of the hour)
-    max_time = max_time[:-3]
+    # Only look at the rows of the specific date, which are found with a binary search
+    rows = data.get_day_rows(parse_date(date))
+    present_rows = np.flatnonzero(~data.missing[pollutant][rows]) + rows.start
     
     # Check if all the value is missing
-    if max_value == -1:
+    if len(present_rows) == 0:
         return None
     
+    # argmax returns the first maximum, so the earliest hour is used if the peak is reached more than once
+    max_row = present_rows[np.argmax(data.values[pollutant][present_rows])]
+    # The values are float32, so they are converted through their shortest decimal form to print as they appear in the csv file
+    max_value = float(str(data.values[pollutant][max_row]))
+    # Cut off the seconds as the specification requires (removes the ':00' at the end of the hour)
+    max_time = format_time_of_day(data.seconds[max_row])[:-3]
+    
     return (max_time, max_value)
 
 def count_missing_data(data, monitoring_station, pollutant):
     """Returns the count of 'No data' items for a specific station and pollutant"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
+    check_station_and_pollutant(data, monitoring_station, pollutant)
     
     data = data[monitoring_station]
-    # Find all occourences of "No data" for the specific pollutant
-    data = data.loc[data[pollutant] == "No data", pollutant]
-    return data.count()
+    # The missing mask is computed once when the data is loaded
+    return int(np.count_nonzero(data.missing[pollutant]))
 
 def fill_missing_data(data, new_value, monitoring_station, pollutant):
-    """Takes the monitoring station datasheet, the monitoring station code, the pollutant code and a replacement value and returns the datasheet
-    with the missing data replaced by the new value"""
+    """Takes the monitoring station datasheet, the monitoring station code, the pollutant code and a replacement value and returns a copy
+    of the datasheet with the missing data replaced by the new value"""
     # Check that monitoring stations and pollutants are valid
-    if not monitoring_station in VALID_MONITORING_STATIONS:
-        raise Exception("Monitoring station type is not valid!")
-    if not pollutant in VALID_POLLUTANT_TYPES:
-        raise Exception("Pollutant type is not valid!")
+    check_station_and_pollutant(data, monitoring_station, pollutant)
+    
+    # Copy the datasheet, so the shared datasheet is not changed for other functions
+    data = dict(data)
+    data[monitoring_station] = data[monitoring_station].fill_missing(pollutant, new_value)
+    return data
+
+class StreamingAggregator:
+    """Accumulates statistics for each group of a frequency chunk by chunk, without keeping the measurements.
+    Means, counts, minimums and maximums are exact. Medians come from a logarithmic quantile sketch which is
+    within utils.SKETCH_RELATIVE_ACCURACY of the exact median, and uses a fixed number of buckets per group.
+
+    Attributes:
+        freq (str): 'D' for each day, 'H' for each hour of the day, or 'M' for each month
+        pollutants ([str]): The pollutant codes being accumulated
+        gamma (float): The ratio between the bounds of a sketch bucket
+        slots (dict): The position of each group key in the accumulator arrays
+    """
+    def __init__(self, freq, pollutants, relative_accuracy=utils.SKETCH_RELATIVE_ACCURACY):
+        if not freq in AGGREGATE_FREQUENCIES:
+            raise Exception("Aggregation frequency is not valid!")
+        self.freq = freq
+        self.pollutants = list(pollutants)
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.slots = {}
+        self.row_counts = np.zeros(0, dtype=np.int64)
+        self.counts = {pollutant: np.zeros(0, dtype=np.int64) for pollutant in self.pollutants}
+        self.sums = {pollutant: np.zeros(0) for pollutant in self.pollutants}
+        self.maximums = {pollutant: np.zeros(0) for pollutant in self.pollutants}
+        self.minimums = {pollutant: np.zeros(0) for pollutant in self.pollutants}
+        # Sketch bucket counts, keyed by slot * 8192 + (sketch key + 4096)
+        self.sketches = {pollutant: collections.Counter() for pollutant in self.pollutants}
+    
+    def get_group_keys(self, timestamps):
+        """Returns the integer group key of each timestamp: the day number, the time of day in seconds or the month number"""
+        days, seconds = split_timestamps(timestamps)
+        if self.freq == "D":
+            return days
+        elif self.freq == "H":
+            return seconds
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    
+    def get_slots(self, keys):
+        """Returns the accumulator position of every group key, adding new groups and growing the arrays as needed"""
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        # Only the distinct keys of the chunk are looked up, which is a few hundred at most
+        unique_slots = np.array([self.slots.setdefault(key, len(self.slots)) for key in unique_keys.tolist()], dtype=np.int64)
+        
+        capacity = len(self.row_counts)
+        if len(self.slots) > capacity:
+            # Double the capacity, so growing the arrays is amortised over many chunks
+            grow = max(len(self.slots), 2 * capacity) - capacity
+            self.row_counts = np.append(self.row_counts, np.zeros(grow, dtype=np.int64))
+            for pollutant in self.pollutants:
+                self.counts[pollutant] = np.append(self.counts[pollutant], np.zeros(grow, dtype=np.int64))
+                self.sums[pollutant] = np.append(self.sums[pollutant], np.zeros(grow))
+                self.maximums[pollutant] = np.append(self.maximums[pollutant], np.full(grow, -np.inf))
+                self.minimums[pollutant] = np.append(self.minimums[pollutant], np.full(grow, np.inf))
+        return unique_slots[inverse]
+    
+    def update(self, columns):
+        """Adds a chunk of measurements, given as a structured array like the one from 'dataframe_to_columns'"""
+        slots = self.get_slots(self.get_group_keys(np.asarray(columns["timestamp"])))
+        capacity = len(self.row_counts)
+        self.row_counts += np.bincount(slots, minlength=capacity)
+        
+        for pollutant in self.pollutants:
+            if pollutant in columns.dtype.names:
+                values = np.asarray(columns[pollutant], dtype=np.float64)
+            else:
+                values = np.full(len(slots), np.nan)
+            present = ~np.isnan(values)
+            values = values[present]
+            present_slots = slots[present]
+            
+            self.counts[pollutant] += np.bincount(present_slots, minlength=capacity)
+            self.sums[pollutant] += np.bincount(present_slots, weights=values, minlength=capacity)
+            np.maximum.at(self.maximums[pollutant], present_slots, values)
+            np.minimum.at(self.minimums[pollutant], present_slots, values)
+            
+            sketch_keys = present_slots * 8192 + utils.get_sketch_keys(values, self.gamma) + 4096
+            unique_keys, key_counts = np.unique(sketch_keys, return_counts=True)
+            self.sketches[pollutant].update(dict(zip(unique_keys.tolist(), key_counts.tolist())))
+    
+    def get_medians(self, pollutant):
+        """Returns the approximate median of every slot from the quantile sketch of a pollutant"""
+        medians = np.full(len(self.slots), np.nan)
+        sketch = self.sketches[pollutant]
+        if len(sketch) == 0:
+            return medians
+        
+        keys = np.sort(np.fromiter(sketch.keys(), dtype=np.int64, count=len(sketch)))
+        key_counts = np.array([sketch[key] for key in keys.tolist()], dtype=np.int64)
+        cumulative_counts = np.cumsum(key_counts)
+        
+        counts = self.counts[pollutant][:len(self.slots)]
+        has_values = counts > 0
+        # The number of values in all the slots before each slot, as the keys are sorted by slot first
+        offsets = np.cumsum(counts) - counts
+        lower = np.searchsorted(cumulative_counts, offsets + (counts - 1) // 2, side="right")[has_values]
+        upper = np.searchsorted(cumulative_counts, offsets + counts // 2, side="right")[has_values]
+        bucket_values = utils.get_sketch_values(keys % 8192 - 4096, self.gamma)
+        medians[has_values] = (bucket_values[lower] + bucket_values[upper]) / 2
+        return medians
+    
+    def result(self, stats=None):
+        """Returns the accumulated statistics as a structured array with the same layout as 'aggregate'"""
+        stats = AGGREGATE_STATISTICS if stats is None else stats
+        slot_count = len(self.slots)
+        keys = np.fromiter(self.slots.keys(), dtype=np.int64, count=slot_count)
+        slots = np.fromiter(self.slots.values(), dtype=np.int64, count=slot_count)
+        
+        # Order the groups by key. Every month between the first and the last is included, like 'monthly_average'
+        if self.freq == "M" and slot_count > 0:
+            group_keys = np.arange(keys.min(), keys.max() + 1)
+        else:
+            group_keys = np.sort(keys)
+        group_slots = np.full(len(group_keys), -1, dtype=np.int64)
+        group_slots[np.searchsorted(group_keys, keys)] = slots
+        has_slot = group_slots >= 0
+        
+        if self.freq == "D":
+            labels = group_keys.astype("datetime64[D]")
+        elif self.freq == "H":
+            labels = group_keys.astype("timedelta64[s]")
+        else:
+            labels = group_keys.astype("datetime64[M]")
+        
+        stat_types = [(stat, np.int64 if stat in ("count", "missing") else np.float64) for stat in stats]
+        result = np.zeros(len(labels), dtype=[("group", labels.dtype)] + [(pollutant, stat_types) for pollutant in self.pollutants])
+        result["group"] = labels
+        for pollutant in self.pollutants:
+            counts = self.counts[pollutant][:slot_count]
+            statistics = {
+                "count": counts,
+                "missing": self.row_counts[:slot_count] - counts,
+                "max": np.where(counts > 0, self.maximums[pollutant][:slot_count], np.nan),
+                "min": np.where(counts > 0, self.minimums[pollutant][:slot_count], np.nan),
+            }
+            statistics["mean"] = np.full(slot_count, np.nan)
+            np.divide(self.sums[pollutant][:slot_count], counts, out=statistics["mean"], where=counts > 0)
+            if "median" in stats:
+                statistics["median"] = self.get_medians(pollutant)
+            
+            for stat in stats:
+                column = np.zeros(len(labels), dtype=result[pollutant][stat].dtype)
+                if column.dtype == np.float64:
+                    column[:] = np.nan
+                column[has_slot] = statistics[stat][group_slots[has_slot]]
+                result[pollutant][stat] = column
+        return result
+
+def stream_aggregate(file_names, freq="D", pollutants=None, stats=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Computes statistics for monitoring station csv files while reading them in chunks, so only one chunk of rows
+    is in memory at a time. Measurements that appear in several files are counted once for each file.
+
+    Args:
+        file_names (str or [str]): The csv file name, or a list of csv files for the same station (e.g. one for each year)
+        freq (str, optional): 'D' for each day, 'H' for each hour of the day, or 'M' for each month. Defaults to 'D'.
+        pollutants ([str], optional): The pollutant codes. Defaults to the pollutants in the first file.
+        stats ([str], optional): The statistics from AGGREGATE_STATISTICS. Defaults to all of them.
+        chunk_size (int, optional): The number of rows read at a time. Defaults to STREAM_CHUNK_SIZE.
+
+    Exceptions:
+        Raises an exception if the frequency or a statistic is not valid
+
+    Returns:
+        np.ndarray: A structured array with the same layout as 'aggregate'. Medians are approximate
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    stats = AGGREGATE_STATISTICS if stats is None else stats
+    for stat in stats:
+        if not stat in AGGREGATE_STATISTICS:
+            raise Exception("Aggregation statistic is not valid!")
+    if pollutants is None:
+        header = pd.read_csv(file_names[0], nrows=0).columns
+        pollutants = [column for column in header if column not in ("date", "time")]
     
-    sdata = data[monitoring_station]
-    sdata.loc[sdata[pollutant] == "No data", pollutant] = new_value
-    return data
\ No newline at end of file
+    aggregator = StreamingAggregator(freq, pollutants)
+    for file_name in file_names:
+        for chunk in pd.read_csv(file_name, na_values=["No data"], chunksize=chunk_size):
+            aggregator.update(dataframe_to_columns(chunk))
+    return aggregator.result(stats)
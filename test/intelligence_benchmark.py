@@ -0,0 +1,37 @@
+import sys
+import time
+sys.path.insert(0,'..')
+
+import numpy as np
+
+import intelligence
+
+def benchmark(function, repeats=3):
+    """Returns the fastest time in seconds of a few calls to a function"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(worker_counts):
+    """Compares serial labelling of the map, tiled to a large image, with parallel labelling for each worker count"""
+    # Random noise is the worst case for run-based labelling, as almost every pixel starts or ends a run
+    noise = np.random.default_rng(0).random((3163, 3163)) < 0.5
+    print(f"Labelling a {noise.shape[0]} x {noise.shape[1]} random mask: {benchmark(lambda: intelligence.label_components(noise)):.3f}s")
+    
+    mask = intelligence.classify_pixels(intelligence.load_image("../data/map.png"), ["red"])["red"]
+    mask = np.tile(mask, (4, 4))
+    print(f"Labelling a {mask.shape[0]} x {mask.shape[1]} mask")
+    
+    serial_time = benchmark(lambda: intelligence.label_components(mask))
+    print(f"serial: {serial_time:.3f}s")
+    expected = intelligence.label_components(mask)
+    for workers in worker_counts:
+        assert np.array_equal(intelligence.label_components_parallel(mask, workers=workers), expected)
+        parallel_time = benchmark(lambda: intelligence.label_components_parallel(mask, workers=workers))
+        print(f"{workers} workers: {parallel_time:.3f}s ({serial_time / parallel_time:.2f}x)")
+
+if __name__ == "__main__":
+    main([int(workers) for workers in sys.argv[1:]] or [2, 4, 8])
@@ -1,11 +1,227 @@
-
+import pytest
 import sys
+import os
+import json
 sys.path.insert(0,'..')
 
+import numpy as np
+import skimage
+import skimage.measure
+
 import intelligence
 
 def test_find_red_pixels():
-    assert intelligence.find_red_pixels("data/test.png") == 25
+    assert np.count_nonzero(intelligence.find_red_pixels("data/test.png") == 255) == 25
     
 def test_find_cyan_pixels():
-    assert intelligence.find_cyan_pixels("data/test.png") == 6
\ No newline at end of file
+    assert np.count_nonzero(intelligence.find_cyan_pixels("data/test.png") == 255) == 6
+
+def test_classify_pixels():
+    image = skimage.io.imread("data/test.png")
+    masks = intelligence.classify_pixels(image, ["red", "cyan"])
+    assert masks["red"].dtype == np.uint8
+    assert set(np.unique(masks["red"])) <= {0, 255}
+    assert np.array_equal(masks["red"], intelligence.find_red_pixels(image))
+    assert np.array_equal(masks["cyan"], intelligence.find_cyan_pixels("data/test.png"))
+    # A pixel can not be red and cyan
+    assert not np.any(masks["red"] & masks["cyan"])
+    
+    pixel = np.array([[[200, 10, 10], [10, 200, 200], [0, 0, 0]]], dtype=np.uint8)
+    masks = intelligence.classify_pixels(pixel, ["red", "cyan", "blue"])
+    assert masks["red"].tolist() == [[255, 0, 0]]
+    assert masks["cyan"].tolist() == [[0, 255, 0]]
+    assert masks["blue"].tolist() == [[0, 0, 0]]
+
+def test_label_components():
+    mask = np.array([[1, 1, 0, 0, 1],
+                     [0, 0, 1, 0, 1],
+                     [1, 0, 0, 0, 0],
+                     [1, 0, 1, 1, 0]], dtype=np.uint8)
+    
+    # Diagonal pixels are connected with 8-connectivity
+    mark = intelligence.label_components(mask)
+    assert mark.tolist() == [[1, 1, 0, 0, 2],
+                             [0, 0, 1, 0, 2],
+                             [3, 0, 0, 0, 0],
+                             [3, 0, 4, 4, 0]]
+    # But not with 4-connectivity
+    mark, first_pixels = intelligence.label_components(mask, 4, return_first_pixels=True)
+    assert mark.tolist() == [[1, 1, 0, 0, 2],
+                             [0, 0, 3, 0, 2],
+                             [4, 0, 0, 0, 0],
+                             [4, 0, 5, 5, 0]]
+    assert first_pixels.tolist() == [0, 4, 7, 10, 17]
+    
+    with pytest.raises(Exception):
+        intelligence.label_components(mask, 6)
+
+def test_label_components_random():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        mask = rng.random(rng.integers(1, 40, 2)) < rng.random()
+        # scikit-image also numbers components in raster order
+        assert np.array_equal(intelligence.label_components(mask, 8), skimage.measure.label(mask, connectivity=2))
+        assert np.array_equal(intelligence.label_components(mask, 4), skimage.measure.label(mask, connectivity=1))
+
+def test_label_components_tiled():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        mask = rng.random(rng.integers(1, 40, 2)) < rng.random()
+        tile_size = tuple(rng.integers(1, 10, 2))
+        for connectivity in (4, 8):
+            assert np.array_equal(intelligence.label_components_tiled(mask, tile_size, connectivity),
+                                  intelligence.label_components(mask, connectivity))
+
+def test_label_components_tiled_memmap(tmp_path):
+    image = intelligence.load_image("../data/map.png")[:200, :300]
+    np.save(tmp_path / "map.npy", image)
+    expected = intelligence.label_components(intelligence.classify_pixels(image, ["red"])["red"])
+    
+    mark = intelligence.label_components_tiled(str(tmp_path / "map.npy"), 64, colour_class="red",
+                                               output_filename=str(tmp_path / "labels.npy"))
+    assert np.array_equal(mark, expected)
+    assert np.array_equal(np.load(tmp_path / "labels.npy"), expected)
+
+def test_label_components_parallel():
+    rng = np.random.default_rng(2)
+    for _ in range(5):
+        mask = rng.random(rng.integers(1, 60, 2)) < rng.random()
+        for connectivity in (4, 8):
+            assert np.array_equal(intelligence.label_components_parallel(mask, connectivity, workers=3),
+                                  intelligence.label_components(mask, connectivity))
+    
+    # The processes and shared memory are kept between calls, and only replaced when a larger mask needs more memory
+    executor = intelligence.label_executors[3]
+    mark_memory = intelligence.label_memory["mark"]
+    mask = rng.random((20, 20)) < 0.5
+    intelligence.label_components_parallel(mask, workers=3)
+    assert intelligence.label_executors[3] is executor and intelligence.label_memory["mark"] is mark_memory
+    mask = rng.random((200, 200)) < 0.5
+    assert np.array_equal(intelligence.label_components_parallel(mask, workers=3), intelligence.label_components(mask))
+    assert intelligence.label_memory["mark"].size >= mask.size * 4
+    intelligence.close_label_executors()
+    assert len(intelligence.label_executors) == 0 and intelligence.label_memory["mark"] is None
+
+def test_detect_connected_components(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    image = np.zeros((5, 5), np.uint8)
+    image[0, 0:2] = 255
+    image[2:5, 3] = 255
+    image[4, 0] = 255
+    
+    mark = intelligence.detect_connected_components(image)
+    assert mark.max() == 3
+    assert mark[0, 0] == 1 and mark[2, 3] == 2 and mark[4, 0] == 3
+    with open("cc-output-2a.txt", "r") as file:
+        assert file.read().splitlines() == ["Connected Component 1, number of pixles = 2",
+                                            "Connected Component 2, number of pixles = 3",
+                                            "Connected Component 3, number of pixles = 1",
+                                            "Total number of connected components = 3"]
+
+def test_component_statistics():
+    mark = np.array([[1, 1, 0, 2],
+                     [1, 1, 0, 2],
+                     [0, 0, 0, 2],
+                     [3, 0, 0, 0]], dtype=np.int32)
+    
+    statistics = intelligence.component_statistics(mark)
+    assert statistics["id"].tolist() == [1, 2, 3]
+    assert statistics["size"].tolist() == [4, 3, 1]
+    assert statistics[1]["row_min"] == 0 and statistics[1]["row_max"] == 2
+    assert statistics[1]["column_min"] == 3 and statistics[1]["column_max"] == 3
+    assert statistics[0]["centroid_row"] == 0.5 and statistics[0]["centroid_column"] == 0.5
+    assert statistics["perimeter"].tolist() == [8, 8, 4]
+    
+    # Sorted by descending size, then ascending id
+    mark[3, 0] = 4
+    mark[3, 1] = 4
+    mark[0, 3] = 0
+    statistics = intelligence.component_statistics(mark, sort_by="size")
+    assert statistics["id"].tolist() == [1, 2, 4]
+    
+    assert intelligence.count_connected_components(mark) == {1: 4, 2: 2, 4: 2}
+    assert list(intelligence.bullshit_sort_values({1: 4, 2: 2, 4: 2, 5: 7})) == [5, 1, 2, 4]
+    assert list(intelligence.bullshit_sort_keys({4: 2, 1: 4, 2: 2})) == [1, 2, 4]
+    
+    with pytest.raises(Exception):
+        intelligence.component_statistics(mark, sort_by="perimeter")
+
+def test_render_components():
+    mark = np.array([[1, 1, 0, 2],
+                     [0, 3, 0, 2],
+                     [4, 4, 4, 0]])
+    assert np.array_equal(intelligence.render_components(mark, [2, 4]), np.array([[0, 0, 0, 255],
+                                                                                [0, 0, 0, 255],
+                                                                                [255, 255, 255, 0]]))
+    
+    colours = intelligence.render_components(mark, [1, 3], [[255, 0, 0], [0, 0, 255]])
+    assert colours.shape == (3, 4, 3) and colours.dtype == np.uint8
+    assert colours[0, 0].tolist() == [255, 0, 0] and colours[1, 1].tolist() == [0, 0, 255]
+    assert np.count_nonzero(colours.any(axis=2)) == 3
+    
+    out = np.full(mark.shape, 7, np.int32)
+    assert intelligence.render_components(mark, [], out=out) is out
+    assert np.count_nonzero(out) == 0
+    
+    with pytest.raises(Exception):
+        intelligence.render_components(mark, [1, 2], [255])
+
+def test_detect_connected_components_sorted_top(tmp_path):
+    mark = intelligence.label_components(np.random.default_rng(3).random((60, 60)) < 0.5)
+    components = intelligence.detect_connected_components_sorted(mark, str(tmp_path / "cc.txt"), str(tmp_path / "top.npy"),
+                                                                 top=5)
+    assert np.array_equal(np.load(tmp_path / "top.npy") == 255, np.isin(mark, components["id"][:5]))
+
+def test_image_writer(tmp_path):
+    image = intelligence.find_red_pixels(intelligence.load_image("../data/map.png")[:300, :300],
+                                         output_file=str(tmp_path / "red.npy"))
+    assert np.array_equal(np.load(tmp_path / "red.npy"), image)
+    
+    with intelligence.ImageWriter("async", compress_level=1, queue_size=2) as writer:
+        for index in range(5):
+            writer.write_image(str(tmp_path / f"red-{index}.png"), image)
+        writer.write_image(str(tmp_path / "missing" / "red.png"), image)
+        intelligence.detect_connected_components(image, output_file=str(tmp_path / "missing" / "cc.txt"), writer=writer)
+        errors = writer.flush()
+        assert len(errors) == 2 and all("missing" in error for error in errors)
+        assert "cc.txt" in errors[1]
+        for index in range(5):
+            assert np.array_equal(skimage.io.imread(tmp_path / f"red-{index}.png"), image)
+    
+    # In "sync" mode a failed text report is printed, and the analysis result is still returned
+    missing_file = str(tmp_path / "missing" / "cc.txt")
+    mark = intelligence.detect_connected_components(image, output_file=missing_file)
+    assert mark.shape == image.shape
+    components = intelligence.detect_connected_components_sorted(mark, missing_file, str(tmp_path / "top.npy"))
+    assert len(components) == mark.max()
+    
+    writer = intelligence.ImageWriter("off")
+    mark = intelligence.detect_connected_components(image, output_file=str(tmp_path / "cc.txt"), writer=writer)
+    intelligence.detect_connected_components_sorted(mark, str(tmp_path / "cc-2b.txt"), str(tmp_path / "top.png"), writer)
+    assert not any(os.path.exists(tmp_path / file_name) for file_name in ["cc.txt", "cc-2b.txt", "top.png"])
+    
+    with pytest.raises(Exception):
+        intelligence.ImageWriter("later")
+
+def test_analyse_maps(tmp_path):
+    image = intelligence.load_image("../data/map.png")[:200, :300]
+    os.makedirs(tmp_path / "maps")
+    skimage.io.imsave(tmp_path / "maps" / "tile-a.png", image)
+    np.save(tmp_path / "maps" / "tile-b.npy", image)
+    
+    summaries = intelligence.analyse_maps(str(tmp_path / "maps"), str(tmp_path / "output"), workers=2)
+    assert [summary["image"] for summary in summaries] == [str(tmp_path / "maps" / "tile-a.png"),
+                                                            str(tmp_path / "maps" / "tile-b.npy")]
+    with open(tmp_path / "output" / "index.json") as index_file:
+        assert json.load(index_file) == summaries
+    
+    red = intelligence.classify_pixels(image, ["red"])["red"]
+    for summary in summaries:
+        assert summary["error"] is None
+        assert summary["red"]["pixels"] == np.count_nonzero(red)
+        assert summary["red"]["components"] == intelligence.label_components(red).max()
+        for file_name in ["red-pixels.jpg", "red-cc-output-2a.txt", "cyan-cc-output-2b.txt", "cyan-cc-top-2.jpg"]:
+            assert os.path.exists(os.path.join(summary["output_dir"], file_name))
+    
+    summaries = intelligence.analyse_maps([str(tmp_path / "missing.png")], str(tmp_path / "output"))
+    assert summaries[0]["error"] is not None
@@ -0,0 +1,43 @@
+import pytest
+import io
+import json
+import os
+import shutil
+
+import sys
+sys.path.insert(0,'..')
+
+import main
+
+def test_report_command(tmp_path):
+    shutil.copy("test_sheet.csv", tmp_path / "Station.csv")
+    with open(tmp_path / "stations.json", "w") as file:
+        json.dump({"ST1": {"files": ["Station.csv"]}}, file)
+    registry = str(tmp_path / "stations.json")
+    
+    stream = io.StringIO()
+    assert main.run_command_line(["report", "--registry", registry, "--station", "st1", "--pollutant", "NO,pm10",
+                                  "--agg", "daily-mean,daily-count", "--from", "2021-10-08", "--to", "2021-12-21"], stream) == 0
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "query,station,pollutant,aggregation,group,value"
+    assert len(lines) == 1 + 2 * 2 * 2
+    assert lines[3] == "0,ST1,no,daily-count,2021-10-08,24"
+    
+    # Every query in a query file is answered, taking its defaults from the command line
+    with open(tmp_path / "queries.txt", "w") as file:
+        file.write("# Hourly maximums\n--agg hourly-max\n\n--pollutant pm25 --from 2021-12-31 --to 2021-12-31\n")
+    output_file = str(tmp_path / "report.json")
+    assert main.run_command_line(["report", "--registry", registry, "--station", "ST1", "--pollutant", "no",
+                                  "--queries", str(tmp_path / "queries.txt"), "--format", "json", "--output", output_file]) == 0
+    with open(output_file, "r") as file:
+        rows = [json.loads(line) for line in file]
+    assert len(rows) == 24 + 1
+    assert [row["query"] for row in rows] == [0] * 24 + [1]
+    assert rows[24]["pollutant"] == "pm25" and rows[24]["aggregation"] == "daily-mean" and rows[24]["group"] == "2021-12-31"
+    
+    # Invalid queries fail before anything is written
+    for arguments in [["--station", "ST2", "--pollutant", "no"], ["--station", "ST1", "--pollutant", "no", "--agg", "weekly-mean"],
+                      ["--station", "ST1", "--pollutant", "no", "--from", "01/01/2021"], ["--station", "ST1"]]:
+        stream = io.StringIO()
+        assert main.run_command_line(["report", "--registry", registry] + arguments, stream) == 1
+        assert stream.getvalue() == ""
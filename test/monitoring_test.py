@@ -0,0 +1,453 @@
+import pytest
+import calendar
+import contextlib
+import datetime as dt
+import gc
+import http.server
+import io
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.insert(0,'..')
+
+import monitoring
+
+class FakeAPIHandler(http.server.BaseHTTPRequestHandler):
+    """Answers requests like the LondonAir API, with a measurement of hour + day of the month for every hour.
+    Each response waits server.latency seconds, the first server.failures requests fail with server.failure_status and
+    measurements after server.values_until have no value"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.most_active = max(self.server.most_active, self.server.active)
+            is_failure = self.server.failures > 0
+            self.server.failures -= 1
+        try:
+            time.sleep(self.server.latency)
+            if is_failure:
+                self.send_response(self.server.failure_status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_api_response()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def send_api_response(self):
+        match = re.search(r"SiteCode=(\w+)/SpeciesCode=(\w+)/StartDate=([\d-]+)/EndDate=([\d-]+)/Json", self.path)
+        start_date = dt.date.fromisoformat(match.group(3))
+        end_date = dt.date.fromisoformat(match.group(4))
+        self.server.requests.append((match.group(1), match.group(2), start_date, end_date))
+
+        records = []
+        date = start_date
+        while date < end_date:
+            for hour in range(24):
+                time_measured = dt.datetime(date.year, date.month, date.day, hour)
+                # Measurements after server.values_until have not been reported yet
+                is_reported = self.server.values_until is None or time_measured <= self.server.values_until
+                records.append({"@MeasurementDateGMT": f"{date} {hour:02}:00:00",
+                                "@Value": str(hour + date.day) if is_reported else ""})
+            date += dt.timedelta(days=1)
+        body = json.dumps(monitoring.make_response(match.group(1), match.group(2), records)).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_api():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeAPIHandler)
+    server.requests = []
+    server.latency = 0
+    server.failures = 0
+    server.failure_status = 503
+    server.values_until = None
+    server.lock = threading.Lock()
+    server.active = 0
+    server.most_active = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_port}/AirQuality"
+    server.shutdown()
+    server.server_close()
+
+def test_response_cache(fake_api, tmp_path):
+    server, api_url = fake_api
+    cache = monitoring.ResponseCache(str(tmp_path / "cache.sqlite3"))
+
+    response = monitoring.get_cached_data_from_api("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 3), cache, api_url)
+    assert server.requests == [("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 4))]
+    data = monitoring.convert_response_to_dataframe(response)
+    assert len(data) == 72
+    assert data["value"].iloc[-1] == 23 + 3
+
+    # Cached days are not fetched again, even after the cache is reopened
+    cache.close()
+    cache = monitoring.ResponseCache(str(tmp_path / "cache.sqlite3"))
+    assert monitoring.get_cached_data_from_api("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 3), cache, api_url) == response
+    assert len(server.requests) == 1
+
+    # Only the missing days of a longer range are fetched, as one request for each gap
+    response = monitoring.get_cached_data_from_api("MY1", "NO", dt.date(2021, 12, 31), dt.date(2022, 1, 5), cache, api_url)
+    assert sorted(server.requests[1:]) == [("MY1", "NO", dt.date(2021, 12, 31), dt.date(2022, 1, 1)),
+                                           ("MY1", "NO", dt.date(2022, 1, 4), dt.date(2022, 1, 6))]
+    assert len(response["RawAQData"]["Data"]) == 6 * 24
+    assert response["RawAQData"]["Data"][0]["@MeasurementDateGMT"] == "2021-12-31 00:00:00"
+
+    # Other species are cached separately
+    monitoring.get_cached_data_from_api("MY1", "PM10", dt.date(2022, 1, 1), dt.date(2022, 1, 1), cache, api_url)
+    assert len(server.requests) == 4
+
+def test_response_cache_current_day(fake_api, tmp_path):
+    server, api_url = fake_api
+    today = dt.date.today()
+    # Midday of today in GMT, so yesterday is complete
+    now = [calendar.timegm(today.timetuple()) + 12 * 3600]
+    cache = monitoring.ResponseCache(str(tmp_path / "cache.sqlite3"), clock=lambda: now[0])
+
+    monitoring.get_cached_data_from_api("KC1", "NO", today - dt.timedelta(days=1), today, cache, api_url)
+    monitoring.get_cached_data_from_api("KC1", "NO", today - dt.timedelta(days=1), today, cache, api_url)
+    assert len(server.requests) == 1
+
+    # Once today's data expires only today is fetched again
+    cache.current_day_ttl = 0
+    now[0] += 1
+    monitoring.get_cached_data_from_api("KC1", "NO", today - dt.timedelta(days=1), today, cache, api_url)
+    assert server.requests[-1] == ("KC1", "NO", today, today + dt.timedelta(days=1))
+
+    cache.invalidate("KC1")
+    monitoring.get_cached_data_from_api("KC1", "NO", today - dt.timedelta(days=1), today, cache, api_url)
+    assert len(server.requests) == 3
+
+def test_response_cache_complete_days(tmp_path):
+    date = dt.date(2022, 3, 14)
+    midday = calendar.timegm(date.timetuple()) + 12 * 3600
+    now = [midday]
+    cache = monitoring.ResponseCache(str(tmp_path / "cache.sqlite3"), current_day_ttl=300, clock=lambda: now[0])
+    
+    # A day fetched while it is being measured expires, even after midnight has passed
+    cache.put_days("MY1", "NO", {date: [{"@MeasurementDateGMT": "2022-03-14 00:00:00", "@Value": "1"}]})
+    assert date in cache.get_days("MY1", "NO", [date])
+    now[0] = midday + 13 * 3600
+    assert cache.get_days("MY1", "NO", [date]) == {}
+    
+    # Within the reporting margin after midnight the day is still not complete
+    cache.put_days("MY1", "NO", {date: []})
+    now[0] += 3600
+    assert cache.get_days("MY1", "NO", [date]) == {}
+    
+    # Fetched after the margin, the day is kept forever
+    now[0] = midday + 12 * 3600 + monitoring.COMPLETE_DAY_MARGIN + 1
+    cache.put_days("MY1", "NO", {date: []})
+    now[0] += 365 * 86400
+    assert cache.get_days("MY1", "NO", [date]) == {date: []}
+    cache.close()
+    
+    # Caches written before days were marked complete are rebuilt
+    connection = sqlite3.connect(str(tmp_path / "old.sqlite3"))
+    with connection:
+        connection.execute("CREATE TABLE responses (site TEXT, species TEXT, day TEXT, fetched REAL, records BLOB)")
+    connection.close()
+    cache = monitoring.ResponseCache(str(tmp_path / "old.sqlite3"))
+    cache.put_days("MY1", "NO", {date: []})
+    assert cache.get_days("MY1", "NO", [date]) == {date: []}
+    cache.close()
+
+def test_fetch_api_data_concurrent(fake_api):
+    server, api_url = fake_api
+    server.latency = 0.2
+
+    start = time.perf_counter()
+    results = monitoring.fetch_api_data_concurrent([("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 8)),
+                                                    ("KC1", "PM10", dt.date(2022, 2, 1), dt.date(2022, 2, 2))],
+                                                   api_url, days_per_request=1, workers=10)
+    # 10 requests of 0.2 seconds, sent at most API_HOST_CONCURRENCY at a time
+    assert time.perf_counter() - start < 10 * 0.2 / 2
+    assert len(server.requests) == 10
+    assert 1 < server.most_active <= monitoring.API_HOST_CONCURRENCY
+
+    # The results are merged in date order, whatever order the responses arrive in
+    assert [len(records) for records in results] == [8 * 24, 2 * 24]
+    dates = [record["@MeasurementDateGMT"] for record in results[0]]
+    assert dates == sorted(dates) and dates[0] == "2022-01-01 00:00:00" and dates[-1] == "2022-01-08 23:00:00"
+
+def test_fetch_api_connections(fake_api):
+    server, api_url = fake_api
+    fetches = [("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 4))]
+    monitoring.close_api_connections()
+    monitoring.fetch_api_data_concurrent(fetches, api_url, days_per_request=1, workers=2)
+    sessions = set(monitoring.open_sessions)
+    
+    # Later calls reuse the same threads, so their sessions (and connections) are reused too
+    monitoring.fetch_api_data_concurrent(fetches, api_url, days_per_request=1, workers=2)
+    assert set(monitoring.open_sessions) == sessions and len(sessions) <= 2
+    assert len(server.requests) == 8
+    
+    # A thread's session is closed when the thread exits
+    thread = threading.Thread(target=monitoring.get_session)
+    thread.start()
+    thread.join()
+    gc.collect()
+    assert set(monitoring.open_sessions) == sessions
+    
+    # Closing the connections closes every session, and they are created again when needed
+    monitoring.close_api_connections()
+    assert all(session.closed for session in sessions)
+    assert len(monitoring.open_sessions) == 0 and monitoring.fetch_executors == {}
+    del sessions
+    assert len(monitoring.fetch_api_data_concurrent(fetches, api_url, workers=2)[0]) == 4 * 24
+
+def test_fetch_api_data_retry(fake_api):
+    server, api_url = fake_api
+    server.failures = 2
+
+    records = monitoring.fetch_api_data_with_retry("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 1), api_url,
+                                                   retries=2, backoff=0.01)
+    assert len(records) == 24
+
+    server.failures = 2
+    with pytest.raises(Exception):
+        monitoring.fetch_api_data_with_retry("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 1), api_url,
+                                             retries=1, backoff=0.01)
+
+def test_convert_response_to_dataframe():
+    records = [{"@MeasurementDateGMT": "2022-01-01 00:00:00", "@Value": "12.5"},
+               {"@MeasurementDateGMT": "2022-01-01 01:00:00", "@Value": ""},
+               {"@MeasurementDateGMT": "2024-02-29 23:59:58", "@Value": "-1"}]
+    data = monitoring.convert_response_to_dataframe(monitoring.make_response("MY1", "NO", records))
+
+    expected = pd.DataFrame(records).rename(columns={"@MeasurementDateGMT": "date", "@Value": "value"})
+    expected["date"] = pd.to_datetime(expected["date"])
+    expected["value"] = pd.to_numeric(expected["value"])
+    pd.testing.assert_frame_equal(data, expected)
+
+    with pytest.raises(Exception):
+        monitoring.parse_measurement_dates(["2022-01-01T00:00:00"])
+    with pytest.raises(Exception):
+        monitoring.parse_measurement_dates(["2022-1-01 00:00:00"])
+
+def test_group_data():
+    rng = np.random.default_rng(0)
+    dates = np.datetime64("2021-11-03T00:00:00") + np.arange(24 * 70) * np.timedelta64(1, "h")
+    values = rng.random(len(dates)) * 100
+    values[rng.random(len(dates)) < 0.2] = np.nan
+    values[300:400] = np.nan
+    data = pd.DataFrame({"date": dates.astype("datetime64[ns]"), "value": values})
+
+    accessors = {"none": lambda dates: dates, "day": lambda dates: dates.dt.day, "time": lambda dates: dates.dt.day_of_week,
+                 "month": lambda dates: dates.dt.month, "year": lambda dates: dates.dt.year}
+    for data_grouping, accessor in accessors.items():
+        data_group = monitoring.group_data(data, data_grouping)
+        expected = data.groupby(accessor(data["date"]))["value"]
+        for statistic in ["mean", "median", "count", "max", "min"]:
+            pd.testing.assert_series_equal(getattr(data_group, statistic)(), getattr(expected, statistic)(),
+                                           check_dtype=False, check_index_type=False)
+        for (key, group), (expected_key, expected_group) in zip(data_group, expected):
+            assert key == expected_key
+            pd.testing.assert_series_equal(group, expected_group, check_index_type=False)
+        assert len(data_group) == len(expected)
+
+    # The groups and their statistics are only computed once for each dataframe
+    assert monitoring.group_data(data, "day") is monitoring.group_data(data, "day")
+    assert monitoring.group_data(data, "day").mean() is monitoring.group_data(data, "day").mean()
+    assert monitoring.get_group_index(data).get_range_result("idxmax") == data["value"].idxmax()
+    assert monitoring.group_data(data.copy(), "day") is not monitoring.group_data(data, "day")
+
+    with pytest.raises(Exception):
+        monitoring.group_data(data, "week")
+
+def test_decode_response_body(fake_api):
+    server, api_url = fake_api
+    response = monitoring.get_cached_data_from_api("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 20),
+                                                   monitoring.ResponseCache(":memory:"), api_url)
+    expected = monitoring.decode_records(response["RawAQData"]["Data"])
+
+    body = json.dumps(response).encode()
+    for chunk_size in [1, 7, 1000, len(body)]:
+        columns = monitoring.decode_response_body(body[index:index + chunk_size] for index in range(0, len(body), chunk_size))
+        assert np.array_equal(columns["date"], expected["date"])
+        assert np.array_equal(columns["value"], expected["value"], equal_nan=True)
+
+    columns = monitoring.fetch_api_columns("MY1", "NO", dt.date(2022, 1, 1), dt.date(2022, 1, 20), api_url)
+    assert np.array_equal(columns["date"], expected["date"])
+    assert columns["date"][0] == np.datetime64("2022-01-01T00:00:00") and columns["value"][-1] == 23 + 20
+
+DISPLAY_SETTINGS = ["mean_range", "median_range", "max_range", "min_range", "mean_group", "median_group", "barchart", "table"]
+
+def check_buffer_group_index(data):
+    """Checks that the buffer statistics of a dataframe match the statistics computed from its measurements"""
+    group_index = monitoring.get_group_index(data)
+    computed_index = monitoring.DataGroupIndex(data)
+    for statistic in ["mean", "median", "idxmax", "idxmin"]:
+        assert group_index.get_range_result(statistic) == pytest.approx(computed_index.get_range_result(statistic), nan_ok=True)
+    for data_grouping in monitoring.GROUPINGS:
+        groups = group_index.get_groups(data_grouping)
+        computed_groups = computed_index.get_groups(data_grouping)
+        assert groups.keys.equals(computed_groups.keys)
+        assert np.array_equal(groups.counts, computed_groups.counts)
+        for statistic in ["count", "mean", "median", "max", "min"]:
+            assert np.allclose(groups.get_result(statistic), computed_groups.get_result(statistic), equal_nan=True)
+        assert [key for key, _ in groups] == list(computed_groups.keys)
+
+def test_monitoring_session(fake_api):
+    server, api_url = fake_api
+    today = dt.date.today()
+    start_date = today - dt.timedelta(days=40)
+    server.values_until = dt.datetime(today.year, today.month, today.day, 10)
+    session = monitoring.MonitoringSession(api_url, monitoring.ResponseCache(":memory:"))
+
+    data = session.get_data("MY1", "NO", start_date, today)
+    assert len(data) == 41 * 24
+    assert data["value"].isna().sum() == 13
+    request_count = len(server.requests)
+
+    # Only the day of the latest value is fetched again, and the new values replace the empty ones
+    server.values_until = dt.datetime(today.year, today.month, today.day, 15)
+    data = session.get_data("MY1", "NO", start_date, today)
+    assert server.requests[request_count:] == [("MY1", "NO", today, today + dt.timedelta(days=1))]
+    assert len(data) == 41 * 24
+    assert data["value"].isna().sum() == 8
+
+    # The statistics are updated as values are appended, and match the statistics of the whole range
+    buffer = session.buffers[("MY1", "NO")]
+    values = data["value"].dropna()
+    assert buffer.range_statistics["sum"].result() == pytest.approx(values.sum())
+    assert buffer.range_statistics["median"].result() == values.median()
+    assert buffer.range_statistics["max"].result() == values.max()
+    # The displays read the buffer statistics through the group index of the dataframe
+    assert isinstance(monitoring.get_group_index(data), monitoring.BufferGroupIndex)
+    check_buffer_group_index(data)
+    
+    output = []
+    for frame in [data, data.copy()]:
+        with contextlib.redirect_stdout(io.StringIO()) as printed:
+            for data_grouping in ["none"] + monitoring.GROUPINGS:
+                monitoring.show_monitoring_data(frame, data_grouping, "MY1", "NO", start_date, today, 100, DISPLAY_SETTINGS)
+        output.append(printed.getvalue())
+    assert output[0] == output[1]
+
+    # A different start date loads the range again, and an earlier end date only returns part of the buffer
+    assert len(session.get_data("MY1", "NO", start_date, today - dt.timedelta(days=1))) == 40 * 24
+    assert len(session.get_data("MY1", "NO", today - dt.timedelta(days=1), today)) == 2 * 24
+
+def test_measurement_buffer_growth():
+    buffer = monitoring.MeasurementBuffer(dt.date(2022, 1, 1), capacity=4)
+    dates = np.arange(np.datetime64("2022-01-01T00:00:00"), np.datetime64("2022-01-11T00:00:00"), np.timedelta64(1, "h"))
+    values = np.arange(len(dates), dtype=np.float64)
+    for start in range(0, len(dates), 7):
+        # Each batch repeats the last measurement of the one before, which is not appended again
+        first = max(start - 1, 0)
+        buffer.append({"date": dates[first:start + 7], "value": values[first:start + 7]})
+    columns = buffer.get_columns()
+    assert np.array_equal(columns["date"], dates) and np.array_equal(columns["value"], values)
+    assert buffer.range_statistics["sum"].result() == values.sum()
+    
+    # Missing values, and a tail without values which is filled in by the next append
+    values[[5, 6, 30]] = np.nan
+    buffer = monitoring.MeasurementBuffer(dt.date(2022, 1, 1))
+    tail_values = values.copy()
+    tail_values[200:] = np.nan
+    buffer.append({"date": dates[:220], "value": tail_values[:220]})
+    assert buffer.size == 220 and buffer.latest_size == 200
+    statistics = buffer.get_group_statistics("day")
+    assert statistics.loc[9, "rows"] == 24 and statistics.loc[9, "count"] == 200 - 8 * 24
+    buffer.append({"date": dates[190:], "value": values[190:]})
+    assert buffer.size == len(dates) and buffer.range_statistics["median"].result() == np.nanmedian(values)
+    data = pd.DataFrame({"date": dates.astype("datetime64[ns]"), "value": values})
+    monitoring.set_group_index(data, monitoring.BufferGroupIndex(data, buffer))
+    check_buffer_group_index(data)
+    
+    # The statistics only span the groups which have been seen, and the tail can be in earlier groups
+    dates = np.arange(np.datetime64("2021-12-20T00:00:00"), np.datetime64("2022-01-05T00:00:00"), np.timedelta64(1, "h"))
+    values = np.arange(len(dates), dtype=np.float64)
+    tail_values = values.copy()
+    tail_values[len(dates) - 100:] = np.nan
+    buffer = monitoring.MeasurementBuffer(dt.date(2021, 12, 20))
+    buffer.append({"date": dates, "value": tail_values})
+    assert buffer.group_statistics["year"]["offset"] == 2021 and len(buffer.group_statistics["year"]["count"]) == 1
+    assert buffer.group_statistics["day"]["offset"] == 20 and len(buffer.group_statistics["day"]["median"]) == 12
+    assert list(buffer.get_group_statistics("year").index) == [2021, 2022]
+    assert buffer.get_group_statistics("day").loc[4, "count"] == 0
+    buffer.append({"date": dates, "value": values})
+    assert len(buffer.group_statistics["year"]["count"]) == 2 and len(buffer.group_statistics["day"]["median"]) == 31
+    data = pd.DataFrame({"date": dates.astype("datetime64[ns]"), "value": values})
+    monitoring.set_group_index(data, monitoring.BufferGroupIndex(data, buffer))
+    check_buffer_group_index(data)
+
+def wait_for(condition, timeout=5):
+    """Waits until a condition is true, and returns whether it became true before the timeout"""
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_polling_scheduler(fake_api, capsys):
+    server, api_url = fake_api
+    store = monitoring.MonitoringStore()
+    session = monitoring.MonitoringSession(api_url, monitoring.ResponseCache(":memory:"))
+    yesterday = dt.date.today() - dt.timedelta(days=1)
+
+    with monitoring.PollingScheduler(store, session, interval=0.1, jitter=0, rate_limit=20) as scheduler:
+        scheduler.subscribe("MY1", "NO", yesterday)
+        scheduler.subscribe("KC1", "PM10", yesterday)
+        assert wait_for(lambda: store.get_data("MY1", "NO") is not None and store.get_data("KC1", "PM10") is not None)
+        assert len(store.get_data("MY1", "NO")) == 2 * 24
+
+        # Each subscription keeps being polled, fetching only today
+        request_count = len(server.requests)
+        assert wait_for(lambda: len(server.requests) >= request_count + 4)
+        assert server.requests[-1][2] == dt.date.today()
+
+        scheduler.unsubscribe("KC1", "PM10")
+        time.sleep(0.1)
+        request_count = len(server.requests)
+        time.sleep(0.5)
+        assert all(request[0] == "MY1" for request in server.requests[request_count:])
+
+    # The display reads the store, so it works without the API
+    server.shutdown()
+    monitoring.display_monitoring_data(None, "day", "MY1", "NO", dt.date.today(), dt.date.today(), 200, ["mean_range"], store)
+    assert f"The mean   for the date range is: {round(store.get_data('MY1', 'NO', dt.date.today())['value'].mean(), 2)}" in capsys.readouterr().out
+    monitoring.display_monitoring_data(None, "day", "HRL", "NO", dt.date.today(), dt.date.today(), 200, ["mean_range"], store)
+    assert "Waiting for the first update" in capsys.readouterr().out
+
+def test_polling_scheduler_limits(fake_api):
+    server, api_url = fake_api
+    store = monitoring.MonitoringStore()
+    session = monitoring.MonitoringSession(api_url, monitoring.ResponseCache(":memory:"))
+
+    # Polls start no faster than the rate limit, however many subscriptions are due
+    with monitoring.PollingScheduler(store, session, interval=0.01, jitter=0, rate_limit=10) as scheduler:
+        for site_code in ["MY1", "KC1", "HRL", "BL0", "CT3"]:
+            scheduler.subscribe(site_code, "NO")
+        time.sleep(1)
+    assert 5 <= len(server.requests) <= 12
+
+    # Failed polls are published as errors and tried again with backoff
+    server.failures = 1000
+    server.failure_status = 404
+    with monitoring.PollingScheduler(store, session, interval=0.01, jitter=0, backoff=0.2) as scheduler:
+        scheduler.subscribe("WM6", "NO")
+        time.sleep(1)
+        assert scheduler.failures[("WM6", "NO")] >= 2
+    # Polls are sent after 0, 0.2 and 0.6 seconds, and the next would be after 1.4 seconds
+    assert 2 <= 1000 - server.failures <= 4
+    assert store.get_data("WM6", "NO") is None and "404" in store.get_error("WM6", "NO")
@@ -3,11 +3,15 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 import math
+import json
+import os
+import shutil
 
 import sys
 sys.path.insert(0,'..')
 
 import reporting
+import utils
 
 # ALL THE MAGIC NUMBERS WERE COMPUTED IN EXCEL
 FLOAT_TOLERANCE = 1e-5
@@ -145,6 +149,13 @@ def test_monthly_average():
     dataKC1pm25 = reporting.monthly_average(test_data, "KC1", "pm25")
     
     # Test data
+    assert reporting.get_month_index(test_data, "HRL", 2021, 1) == 0
+    assert np.isclose(dataHRLno[reporting.get_month_index(test_data, "HRL", "2021", 1)], 5.647247, rtol=FLOAT_TOLERANCE)
+    assert reporting.get_month_index(test_data, "HRL", 2021, 12) == len(dataHRLno) - 1
+    with pytest.raises(Exception):
+        reporting.get_month_index(test_data, "HRL", 2020, 12)
+    with pytest.raises(Exception):
+        reporting.get_month_index(test_data, "HRL", 2022, 1)
     assert np.isclose(dataHRLno[0], 5.647247, rtol=FLOAT_TOLERANCE)
     assert np.isclose(dataMY1no[0], 35.605124, rtol=FLOAT_TOLERANCE)
     assert np.isclose(dataKC1no[0], 6.415822, rtol=FLOAT_TOLERANCE)
@@ -202,9 +213,9 @@ def test_peak_hour_date():
     assert dataMY1partial[0] == "08:00"
     assert np.isclose(dataMY1partial[1], 8.2, rtol=FLOAT_TOLERANCE)
     
-    # Test no data (CRASHES - IDK WHY)
-    #dataMY1full = reportin.peak_hour_date(test_data, "2021-12-31", "MY1", "pm25")
-    #assert dataMY1full == None
+    # Test no data
+    dataMY1full = reporting.peak_hour_date(test_data, "2021-12-31", "MY1", "pm25")
+    assert dataMY1full == None
 
     # Test for exceptions
     with pytest.raises(Exception):
@@ -213,7 +224,9 @@ def test_peak_hour_date():
         reporting.peak_hour_date(test_data, "Invalid Station", "Invalid Pollutant")
 
 def test_count_missing_data():
-    
+    assert reporting.count_missing_data(test_data, "HRL", "no") == 70
+    assert reporting.count_missing_data(test_data, "MY1", "pm10") == 2120
+    assert reporting.count_missing_data(test_data, "KC1", "pm25") == 8
 
     # Test for exceptions
     with pytest.raises(Exception):
@@ -222,10 +235,273 @@ def test_count_missing_data():
         reporting.count_missing_data(test_data, "Invalid Station", "Invalid Pollutant")
 
 def test_fill_missing_data():
-    
+    filled_data = reporting.fill_missing_data(test_data, -1, "MY1", "pm10")
+    assert reporting.count_missing_data(filled_data, "MY1", "pm10") == 0
+    assert (filled_data["MY1"].values["pm10"] == -1).sum() == (test_data["MY1"].values["pm10"] == -1).sum() + 2120
+    # The original datasheet is not changed
+    assert reporting.count_missing_data(test_data, "MY1", "pm10") == 2120
 
     # Test for exceptions
     with pytest.raises(Exception):
         reporting.fill_missing_data(test_data, None, "Invalid Station", "no")
         reporting.fill_missing_data(test_data, None, "HRL", "Invalid Pollutant")
         reporting.fill_missing_data(test_data, None, "Invalid Station", "Invalid Pollutant")
+
+def test_csv_cache(tmp_path):
+    file_name = str(tmp_path / "sheet.csv")
+    shutil.copy("test_sheet.csv", file_name)
+    
+    uncached_data = reporting.get_data_from_csv(file_name, use_cache=False)
+    assert not os.path.exists(reporting.get_cache_file_names(file_name)[0])
+    
+    # The first load writes the cache and the second load reads it
+    first_data = reporting.get_data_from_csv(file_name)
+    assert os.path.exists(reporting.get_cache_file_names(file_name)[0])
+    second_data = reporting.get_data_from_csv(file_name)
+    pd.testing.assert_frame_equal(uncached_data, first_data)
+    pd.testing.assert_frame_equal(uncached_data, second_data)
+    
+    # Changing the csv file rebuilds the cache
+    with open(file_name, "a") as file:
+        file.write("\n2022-01-01,01:00:00,No data,1.5,2.5\n")
+    changed_data = reporting.get_data_from_csv(file_name)
+    assert len(changed_data) == len(uncached_data) + 1
+    assert changed_data["date"].iat[-1] == pd.Timestamp("2022-01-01")
+    assert changed_data["time"].iat[-1] == "01:00:00"
+    assert np.isnan(changed_data["no"].iat[-1])
+    assert np.isclose(changed_data["pm25"].iat[-1], 2.5)
+    
+    # Touching the csv file without changing it keeps the cache
+    os.utime(file_name, ns=(0, 0))
+    columns = reporting.load_csv_columns(file_name)
+    assert isinstance(columns, np.memmap)
+    assert columns["missing"][-1] == 1
+
+def test_aggregate_cache():
+    cache = reporting.AggregateCache()
+    station_data = test_data["HRL"]
+    compute = lambda: np.arange(10, dtype=float)
+    
+    first = cache.get_or_compute(("HRL", "no", "test"), station_data, compute)
+    second = cache.get_or_compute(("HRL", "no", "test"), station_data, compute)
+    assert np.array_equal(second, first)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Callers get their own arrays, so changing them does not change the cache
+    first[0] = 1
+    second[1] = 1
+    assert np.array_equal(cache.get(("HRL", "no", "test"), station_data), compute())
+    
+    # Arrays which are too large to cache are left writeable
+    large = np.arange(10, dtype=float)
+    reporting.AggregateCache(max_bytes=8).put("large", station_data, large)
+    large[0] = 1
+    
+    # Entries computed from replaced station data are not used
+    filled_data = reporting.fill_missing_data(test_data, 0, "HRL", "no")
+    assert cache.get(("HRL", "no", "test"), filled_data["HRL"]) is None
+    assert cache.size_bytes == 0
+    
+    # The least recently used entry is evicted when the cache is full
+    cache = reporting.AggregateCache(max_bytes=2 * compute().nbytes)
+    cache.get_or_compute("a", station_data, compute)
+    cache.get_or_compute("b", station_data, compute)
+    cache.get("a", station_data)
+    cache.get_or_compute("c", station_data, compute)
+    assert list(cache.entries.keys()) == ["a", "c"]
+    
+    cache.invalidate()
+    assert len(cache.entries) == 0 and cache.size_bytes == 0
+
+def test_reporting_uses_aggregate_cache():
+    hits = reporting.AGGREGATE_CACHE.hits
+    first = reporting.daily_average(test_data, "KC1", "pm10")
+    second = reporting.daily_average(test_data, "KC1", "pm10")
+    assert np.array_equal(second, first, equal_nan=True)
+    assert reporting.AGGREGATE_CACHE.hits > hits
+    # The results belong to the caller, who may change them in place
+    first[:] = 0
+    assert np.array_equal(reporting.daily_average(test_data, "KC1", "pm10"), second, equal_nan=True)
+
+def test_aggregate():
+    result = reporting.aggregate(test_data, "MY1", ["no", "pm25"], "D", ["mean", "median", "max", "min", "count", "missing"])
+    dateIndex = reporting.get_date_index(test_data, "MY1", "2021-03-14")
+    
+    assert result["group"][dateIndex] == np.datetime64("2021-03-14")
+    assert np.isclose(result["no"]["mean"][dateIndex], 11.747027, rtol=FLOAT_TOLERANCE)
+    assert np.isclose(result["no"]["median"][dateIndex], 10.84549, rtol=FLOAT_TOLERANCE)
+    assert np.allclose(result["pm25"]["mean"], reporting.daily_average(test_data, "MY1", "pm25"), equal_nan=True)
+    assert np.all(result["pm25"]["count"] + result["pm25"]["missing"] == 24)
+    assert result["pm25"]["missing"].sum() == reporting.count_missing_data(test_data, "MY1", "pm25")
+    
+    # Missing days have no statistics
+    missingDateIndex = reporting.get_date_index(test_data, "MY1", "2021-12-31")
+    assert result["pm25"]["count"][missingDateIndex] == 0
+    assert np.isnan(result["pm25"]["max"][missingDateIndex])
+    
+    # Peak hour of the day matches the daily maximum
+    assert np.isclose(result["pm25"]["max"][0], reporting.peak_hour_date(test_data, "2021-01-01", "MY1", "pm25")[1])
+    
+    hourly = reporting.aggregate(test_data, "HRL", ["no"], "H", ["mean"])
+    assert len(hourly) == 24
+    assert np.isclose(hourly["no"]["mean"][0], 6.1148450, rtol=FLOAT_TOLERANCE)
+    
+    monthly = reporting.aggregate(test_data, "KC1", freq="M")
+    assert len(monthly) == 12
+    assert np.isclose(monthly["pm10"]["mean"][0], 11.747577, rtol=FLOAT_TOLERANCE)
+    assert monthly["pm10"]["min"][0] <= monthly["pm10"]["median"][0] <= monthly["pm10"]["max"][0]
+    
+    # Test for exceptions
+    with pytest.raises(Exception):
+        reporting.aggregate(test_data, "HRL", ["no"], "Invalid Frequency")
+    with pytest.raises(Exception):
+        reporting.aggregate(test_data, "HRL", ["no"], "D", ["Invalid Statistic"])
+
+def test_report():
+    start_date, end_date = np.datetime64("2021-03-14"), np.datetime64("2021-03-15")
+    rows = list(reporting.report(test_data, ["MY1", "KC1"], ["no", "pm25"], ["daily-mean", "hourly-count", "monthly-max"], start_date, end_date))
+    # 2 days, 24 hours and 1 month for each station and pollutant
+    assert len(rows) == 2 * 2 * (2 + 24 + 1)
+    assert rows[0][:4] == ("MY1", "no", "daily-mean", "2021-03-14")
+    assert np.isclose(rows[0][4], 11.747027, rtol=FLOAT_TOLERANCE)
+    assert ("KC1", "pm25", "hourly-count", "24:00:00", 2) in rows
+    assert np.isclose(dict(((row[0], row[1], row[2]), row[4]) for row in rows)[("MY1", "pm25", "monthly-max")],
+                      max(reporting.daily_statistic(test_data, "MY1", "pm25", date, "max") for date in ["2021-03-14", "2021-03-15"]))
+    
+    # Aggregates of a date range are the same as filtering the aggregates of the whole data
+    ranged = reporting.aggregate(test_data, "HRL", ["no"], "D", ["median"], start_date, end_date)
+    whole = reporting.aggregate(test_data, "HRL", ["no"], "D", ["median"])
+    assert np.array_equal(ranged, whole[(whole["group"] >= start_date) & (whole["group"] <= end_date)])
+    assert test_data["HRL"].get_range_data(start_date, end_date) is test_data["HRL"].get_range_data(start_date, end_date)
+    # Only the most recently used date ranges are kept
+    station_data = test_data["HRL"]
+    ranges = [(station_data.days[0] + i, station_data.days[-1]) for i in range(reporting.RANGE_DATA_CACHE_SIZE + 1)]
+    for range_start, range_end in ranges:
+        station_data.get_range_data(range_start, range_end)
+    assert len(station_data.range_data) == reporting.RANGE_DATA_CACHE_SIZE
+    assert not ranges[0] in station_data.range_data and ranges[-1] in station_data.range_data
+    
+    assert reporting.parse_aggregation("Hourly-Median") == ("H", "median")
+    # Test for exceptions
+    with pytest.raises(Exception):
+        reporting.parse_aggregation("weekly-mean")
+    with pytest.raises(Exception):
+        list(reporting.report(test_data, ["MY1"], ["Invalid Pollutant"], ["daily-mean"]))
+    with pytest.raises(Exception):
+        list(reporting.report(test_data, ["MY1"], ["no"], ["daily-mean"], np.datetime64("2022-01-01")))
+
+def test_date_index():
+    assert reporting.get_date_index(test_data, "HRL", "2021-01-01") == 0
+    assert reporting.get_date_index(test_data, "HRL", "2021-12-31") == 364
+    # Dates without any data raise an exception
+    with pytest.raises(Exception):
+        reporting.get_date_index(test_data, "HRL", "2022-01-01")
+    
+    rows = test_data["HRL"].get_day_rows(np.datetime64("2021-03-14"))
+    assert rows.stop - rows.start == 24
+    rows = test_data["HRL"].get_range_rows(np.datetime64("2021-03-14"), np.datetime64("2021-03-16"))
+    assert rows.stop - rows.start == 72
+    
+    # Station data with a gap and unsorted rows
+    timestamps = np.array([3 * 86400 + 3600, 3600, 7200, 3 * 86400 + 7200], dtype=np.int64)
+    values = {"no": np.array([4.0, 1.0, 2.0, 8.0], dtype=np.float32)}
+    missing = {"no": np.zeros(4, dtype=bool)}
+    gap_data = {"HRL": reporting.StationData(timestamps, values, missing)}
+    assert reporting.get_date_index(gap_data, "HRL", "1970-01-01") == 0
+    assert reporting.get_date_index(gap_data, "HRL", "1970-01-04") == 1
+    with pytest.raises(Exception):
+        reporting.get_date_index(gap_data, "HRL", "1970-01-03")
+    assert np.allclose(reporting.daily_average(gap_data, "HRL", "no"), [1.5, 6.0])
+    assert reporting.peak_hour_date(gap_data, "1970-01-04", "HRL", "no") == ("02:00", 8.0)
+    assert reporting.peak_hour_date(gap_data, "1970-01-03", "HRL", "no") == None
+
+def test_daily_statistic():
+    assert np.isclose(reporting.daily_statistic(test_data, "MY1", "no", "2021-03-14"), 11.747027, rtol=FLOAT_TOLERANCE)
+    assert np.isclose(reporting.daily_statistic(test_data, "KC1", "pm25", "2021-03-14", "median"), 3.632, rtol=FLOAT_TOLERANCE)
+    assert np.isclose(reporting.daily_statistic(test_data, "MY1", "pm25", "2021-01-01", "max"), 40.3, rtol=FLOAT_TOLERANCE)
+    assert reporting.daily_statistic(test_data, "MY1", "pm25", "2021-12-31", "count") == 0
+    assert np.isnan(reporting.daily_statistic(test_data, "MY1", "pm25", "2021-12-31"))
+    
+    # Test for exceptions
+    with pytest.raises(Exception):
+        reporting.daily_statistic(test_data, "MY1", "no", "2021-03-14", "Invalid Statistic")
+    # Statistics are checked even when there is no data for the date
+    with pytest.raises(Exception):
+        reporting.daily_statistic(test_data, "MY1", "pm25", "2021-12-31", "Invalid Statistic")
+    with pytest.raises(Exception):
+        reporting.daily_statistic(test_data, "MY1", "pm25", "2022-06-01", "Invalid Statistic")
+
+def test_station_registry(tmp_path):
+    # Split the test sheet into two yearly files, which overlap by one row
+    with open("test_sheet.csv", "r") as file:
+        lines = file.read().splitlines()
+    with open(tmp_path / "Station-2021a.csv", "w") as file:
+        file.write("\n".join(lines[:41]) + "\n")
+    with open(tmp_path / "Station-2021b.csv", "w") as file:
+        file.write("\n".join(lines[:1] + lines[40:]) + "\n")
+    with open(tmp_path / "stations.json", "w") as file:
+        json.dump({"ST1": {"name": "Test Station", "files": ["Station-*.csv"]},
+                   "ST2": {"files": ["Station-2021a.csv"]}}, file)
+    
+    registry = reporting.get_monitering_station_data(str(tmp_path / "stations.json"))
+    assert list(registry) == ["ST1", "ST2"]
+    assert registry.get_name("ST1") == "Test Station"
+    assert registry.get_name("ST2") == "ST2"
+    # Stations are only loaded when they are used
+    assert not registry.is_loaded("ST1")
+    
+    whole_data = reporting.get_station_data("test_sheet.csv", use_cache=False)
+    assert len(registry["ST1"].timestamps) == len(whole_data.timestamps)
+    assert np.array_equal(registry["ST1"].timestamps, whole_data.timestamps)
+    assert np.array_equal(registry["ST1"].values["no"], whole_data.values["no"], equal_nan=True)
+    assert registry.is_loaded("ST1") and not registry.is_loaded("ST2")
+    assert len(registry["ST2"].timestamps) == 40
+    
+    with pytest.raises(Exception):
+        reporting.daily_average(registry, "HRL", "no")
+    
+    # Stations can be loaded in parallel
+    registry = reporting.get_monitering_station_data(str(tmp_path / "stations.json"), workers=2)
+    registry.preload()
+    assert registry.is_loaded("ST1") and registry.is_loaded("ST2")
+    assert np.allclose(reporting.daily_average(registry, "ST1", "pm10"), reporting.daily_average({"ST1": whole_data}, "ST1", "pm10"), equal_nan=True)
+    # The workers build the cache files, so single file stations are memory-mapped rather than copied
+    assert os.path.exists(tmp_path / "Station-2021a.csv.cache.npy")
+    base = registry["ST2"].values["no"]
+    while base is not None and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    
+    # Registries with the same station code do not share cached aggregates
+    other_path = tmp_path / "other"
+    other_path.mkdir()
+    shutil.copy(tmp_path / "Station-2021b.csv", other_path / "Station.csv")
+    with open(other_path / "stations.json", "w") as file:
+        json.dump({"ST2": {"files": ["Station.csv"]}}, file)
+    other_registry = reporting.get_monitering_station_data(str(other_path / "stations.json"))
+    first = reporting.daily_average(registry, "ST2", "no")
+    second = reporting.daily_average(other_registry, "ST2", "no")
+    assert not np.array_equal(first, second, equal_nan=True)
+    assert np.array_equal(reporting.daily_average(registry, "ST2", "no"), first, equal_nan=True)
+    assert np.array_equal(reporting.daily_average(other_registry, "ST2", "no"), second, equal_nan=True)
+
+def test_stream_aggregate():
+    file_name = "data/Pollution-London Marylebone Road.csv"
+    for freq in ["D", "H", "M"]:
+        streamed = reporting.stream_aggregate(file_name, freq, ["no", "pm25"], chunk_size=1000)
+        loaded = reporting.aggregate(test_data, "MY1", ["no", "pm25"], freq)
+        assert np.array_equal(streamed["group"], loaded["group"])
+        for pollutant in ["no", "pm25"]:
+            for stat in ["mean", "max", "min", "count", "missing"]:
+                assert np.allclose(streamed[pollutant][stat], loaded[pollutant][stat], equal_nan=True)
+            # Streamed medians are approximate
+            assert np.allclose(streamed[pollutant]["median"], loaded[pollutant]["median"],
+                               rtol=utils.SKETCH_RELATIVE_ACCURACY, equal_nan=True)
+    
+    assert np.allclose(reporting.stream_aggregate(file_name, "H", ["no"], ["mean"])["no"]["mean"],
+                       reporting.hourly_average(test_data, "MY1", "no"))
+    
+    # Test for exceptions
+    with pytest.raises(Exception):
+        reporting.stream_aggregate(file_name, "Invalid Frequency")
+    with pytest.raises(Exception):
+        reporting.stream_aggregate(file_name, "D", stats=["Invalid Statistic"])
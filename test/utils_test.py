@@ -7,6 +7,7 @@ from math import pi
 import utils
 
 import numpy as np
+import pandas as pd
 
 # The test data
 A = np.array([-5, -4, -3, -2, -1, 0, 1, 2, 3, 4, 5])
@@ -17,8 +18,9 @@ def test_utils_sum():
     output = utils.sumvalues(A)
     assert output == sum(A)
 
+    # np.sum adds floats in pairs, so float arrays can differ from a loop in the last few bits
     output = utils.sumvalues(Af)
-    assert output == sum(Af)
+    assert output == pytest.approx(sum(Af))
 
     with pytest.raises(Exception):
         output = utils.sumvalues(A_err)
@@ -48,7 +50,7 @@ def test_utils_mean():
     assert output == sum(A) / len(A)
 
     output = utils.meannvalue(Af)
-    assert output == sum(Af) / len(Af)
+    assert output == pytest.approx(sum(Af) / len(Af))
 
     with pytest.raises(Exception):
         output = utils.meannvalue(A_err)
@@ -61,4 +63,151 @@ def test_utils_count():
     assert output == len([i for i in Af if i == -3])
 
     with pytest.raises(Exception):
-        output = utils.countvalue(A_err, -3)
\ No newline at end of file
+        output = utils.countvalue(A_err, -3)
+
+def test_utils_array_like():
+    series = pd.Series(Af)
+    assert utils.sumvalues(series) == pytest.approx(sum(Af))
+    assert utils.maxvalue(series) == max(Af)
+    assert utils.countvalue(pd.Series(A), -3) == 1
+
+    assert utils.sumvalues(list(Af)) == sum(Af)
+    assert utils.meannvalue(list(A)) == sum(A) / len(A)
+
+    with pytest.raises(Exception):
+        utils.sumvalues(np.array(A_err, dtype=object))
+    with pytest.raises(Exception):
+        utils.maxvalue(np.array([]))
+
+    # NaN values are skipped like in the loops over plain lists, unless the first value is NaN
+    for values in [[1, np.nan, 3], [np.nan, 1, 3], [3, 1, np.nan]]:
+        for function, expected in [(utils.maxvalue, max(values)), (utils.minvalue, min(values))]:
+            output = function(np.array(values))
+            assert output == expected or (np.isnan(output) and np.isnan(expected))
+            assert output == function(values) or (np.isnan(output) and np.isnan(function(values)))
+    assert utils.describe(np.array([1, np.nan, 3]))["max"] == 3
+
+def test_utils_describe():
+    for values in [A, Af, list(Af)]:
+        output = utils.describe(values)
+        assert output == {"sum": utils.sumvalues(values), "min": min(values), "max": max(values),
+                          "mean": utils.meannvalue(values), "count": len(values)}
+
+    with pytest.raises(Exception):
+        utils.describe(A_err)
+    with pytest.raises(Exception):
+        utils.describe([])
+
+def test_utils_accumulators():
+    rng = np.random.default_rng(0)
+    values = rng.normal(1000, 5, 10000)
+    values[::100] = np.nan
+    present = values[~np.isnan(values)]
+    
+    accumulators = [utils.SumAccumulator, utils.MinAccumulator, utils.MaxAccumulator, utils.MeanVarianceAccumulator,
+                    utils.MedianAccumulator, utils.ValueCountAccumulator, utils.QuantileSketch]
+    for accumulator_type in accumulators:
+        # Three chunks, the last two merged into the first
+        chunks = [accumulator_type() for _ in range(3)]
+        for chunk, batch in zip(chunks, np.array_split(values, 3)):
+            chunk.update(batch)
+        single = accumulator_type()
+        single.update(values)
+        merged = chunks[0].merge(chunks[1]).merge(chunks[2])
+        
+        if accumulator_type is utils.QuantileSketch:
+            assert merged.counts == single.counts
+        else:
+            assert merged.result() == pytest.approx(single.result())
+    
+    total = utils.SumAccumulator()
+    total.update(list(A))
+    total.update(A)
+    assert total.result() == 2 * sum(A) and total.count == 2 * len(A)
+    
+    minimum, maximum = utils.MinAccumulator(), utils.MaxAccumulator()
+    assert minimum.result() is None
+    for batch in np.array_split(Af, 4):
+        minimum.update(batch)
+        maximum.update(batch)
+    assert minimum.result() == min(Af) and maximum.result() == max(Af)
+    
+    mean_variance = utils.MeanVarianceAccumulator()
+    for batch in np.array_split(values, 7):
+        mean_variance.update(batch)
+    assert mean_variance.result() == pytest.approx(np.mean(present))
+    assert mean_variance.variance() == pytest.approx(np.var(present))
+    assert mean_variance.variance(1) == pytest.approx(np.var(present, ddof=1))
+    
+    # Medians are exact, whether values are added one batch at a time or in large batches
+    median = utils.MedianAccumulator()
+    assert median.result() is None
+    added = np.zeros(0)
+    for size in [1, 2, 3, 50, 7, 1000, 4]:
+        batch = rng.normal(0, 1, size)
+        median.update(batch)
+        median.update([np.nan])
+        added = np.concatenate([added, batch])
+        assert median.result() == np.median(added)
+    median.update(values)
+    assert median.result() == np.median(np.concatenate([added, present]))
+    
+    value_counts = utils.ValueCountAccumulator()
+    value_counts.update([1, 2, 2])
+    value_counts.update(np.array([2, 3]))
+    assert value_counts.result() == {1: 1, 2: 3, 3: 1}
+    
+    sketch = utils.QuantileSketch()
+    sketch.update(values)
+    estimates = sketch.quantile([0, 0.25, 0.5, 0.99, 1])
+    assert np.allclose(estimates, np.quantile(present, [0, 0.25, 0.5, 0.99, 1]), rtol=utils.SKETCH_RELATIVE_ACCURACY)
+    assert sketch.result() == pytest.approx(np.median(present), rel=utils.SKETCH_RELATIVE_ACCURACY)
+    
+    with pytest.raises(Exception):
+        sketch.merge(utils.QuantileSketch(0.05))
+    with pytest.raises(Exception):
+        sketch.merge(utils.SumAccumulator())
+    with pytest.raises(Exception):
+        utils.SumAccumulator().update(A_err)
+
+def test_utils_frame_renderer():
+    import io
+    import shutil
+    
+    # Piped output gets the plain frames
+    stream = io.StringIO()
+    renderer = utils.FrameRenderer(stream, tty=False)
+    renderer.clear()
+    renderer.render("a\nb\n")
+    renderer.render("a\nc\n")
+    assert stream.getvalue() == "a\nb\na\nc\n"
+    
+    # Terminals get the first frame in full, then only the changed lines
+    stream = io.StringIO()
+    renderer = utils.FrameRenderer(stream, tty=True)
+    renderer.render("a\nb\n")
+    assert stream.getvalue() == utils.ANSI_CLEAR_SCREEN + "a\nb\x1b[3;1H\x1b[J"
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render("a\nc\nd\n")
+    assert stream.getvalue() == "\x1b[2;1Hc\x1b[K\x1b[3;1Hd\x1b[K\x1b[4;1H\x1b[J"
+    
+    # Clearing the screen draws the next frame in full
+    renderer.clear()
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render("a\n")
+    assert stream.getvalue() == utils.ANSI_CLEAR_SCREEN + "a\x1b[2;1H\x1b[J"
+    
+    # A few lines below the frame keep the partial redraws, but once they scroll it the frame is drawn in full
+    renderer.add_lines(2)
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render("b\n")
+    assert stream.getvalue() == "\x1b[1;1Hb\x1b[K\x1b[2;1H\x1b[J"
+    renderer.add_lines(shutil.get_terminal_size().lines - 1)
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.render("a\n")
+    assert stream.getvalue() == utils.ANSI_CLEAR_SCREEN + "a\x1b[2;1H\x1b[J"
+    assert renderer.lines_below == 0
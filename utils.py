@@ -1,12 +1,179 @@
 
-from os import system
-
+import collections
+import heapq
 import numbers
+import os
+import shutil
+import sys
+
+import numpy as np
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+
+# ANSI escape codes, which terminals understand (Windows consoles once virtual terminal processing is turned on)
+ANSI_CLEAR_SCREEN = "\x1b[H\x1b[2J\x1b[3J"
+ANSI_CLEAR_LINE = "\x1b[K"
+ANSI_CLEAR_BELOW = "\x1b[J"
+# The Windows console mode flag which makes the console process ANSI escape codes
+ENABLE_VIRTUAL_TERMINAL_PROCESSING = 0x0004
+
+def enable_escape_codes(stream):
+    """Makes a terminal process ANSI escape codes. Other terminals always do, but Windows consoles only do once
+       virtual terminal processing is turned on, which older versions of Windows do not support
+
+    Args:
+        stream (file): The stream of the terminal
+
+    Returns:
+        bool: True if escape codes written to the stream are processed, otherwise False
+    """
+    if os.name != "nt":
+        return True
+    try:
+        import ctypes
+        import msvcrt
+        kernel32 = ctypes.windll.kernel32
+        handle = msvcrt.get_osfhandle(stream.fileno())
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        return mode.value & ENABLE_VIRTUAL_TERMINAL_PROCESSING != 0 or \
+            kernel32.SetConsoleMode(handle, mode.value | ENABLE_VIRTUAL_TERMINAL_PROCESSING) != 0
+    except Exception:
+        return False
+
+class FrameRenderer:
+    """Draws frames of text on the terminal. Each frame is written with a single write, the screen is cleared with
+    ANSI escape codes instead of a subprocess, and only the lines which changed since the last frame are redrawn.
+    When the output is not a terminal (e.g. it is piped to a file), or the terminal does not process escape codes,
+    each frame is written as plain text
+
+    Attributes:
+        stream (file): The stream frames are written to, or None for sys.stdout at the time of each write
+        tty (bool): True to use escape codes, False for plain text, or None to check whether the stream is a terminal
+        previous_lines ([str]): The lines of the last frame, or None if the screen has to be redrawn completely
+        lines_below (int): The lines printed or entered below the last frame, as recorded by 'add_lines'. When the frame
+                           and these lines do not fit in the terminal it has scrolled, so the next frame is redrawn completely
+    """
+    def __init__(self, stream=None, tty=None):
+        self.stream = stream
+        self.tty = tty
+        self.previous_lines = None
+        self.lines_below = 0
+    
+    def get_stream(self):
+        """Returns the stream frames are written to"""
+        return sys.stdout if self.stream is None else self.stream
+    
+    def is_tty(self):
+        """Returns True if escape codes are written to the stream"""
+        if self.tty is not None:
+            return self.tty
+        stream = self.get_stream()
+        return hasattr(stream, "isatty") and stream.isatty() and enable_escape_codes(stream)
+    
+    def add_lines(self, count):
+        """Records lines printed or entered below the last frame, such as a menu, the user's input and error messages"""
+        self.lines_below += count
+    
+    def write(self, text):
+        """Writes text to the stream with one write and flushes it"""
+        stream = self.get_stream()
+        stream.write(text)
+        stream.flush()
+    
+    def clear(self):
+        """Clears the screen, so the next frame is drawn completely"""
+        self.previous_lines = None
+        if self.is_tty():
+            self.write(ANSI_CLEAR_SCREEN)
+    
+    def render(self, text):
+        """Draws a frame. Anything printed below the last frame (such as a menu and the user's input) is cleared
+
+        Args:
+            text (str): The frame, where each line is separated by a newline
+        """
+        if not self.is_tty():
+            self.write(text)
+            return
+        
+        lines = text.rstrip("\n").split("\n")
+        # Rows are addressed from the top of the window, so frames which may have scrolled are always drawn completely.
+        # The cursor was left on the line after the last frame, and moves down a line for each line printed below it
+        height = shutil.get_terminal_size().lines
+        if self.previous_lines is None or len(self.previous_lines) + self.lines_below >= height or len(lines) >= height:
+            output = [ANSI_CLEAR_SCREEN, "\n".join(lines)]
+        else:
+            # Escape codes count rows and columns from 1
+            output = [f"\x1b[{row + 1};1H{line}{ANSI_CLEAR_LINE}" for row, line in enumerate(lines)
+                      if row >= len(self.previous_lines) or line != self.previous_lines[row]]
+        # Leave the cursor on the line after the frame, and clear everything below it
+        output.append(f"\x1b[{len(lines) + 1};1H{ANSI_CLEAR_BELOW}")
+        self.write("".join(output))
+        self.previous_lines = lines
+        self.lines_below = 0
+
+# The renderer used by clear_screen and the monitoring displays when no renderer is given
+DEFAULT_RENDERER = FrameRenderer()
+
+def get_renderer(renderer=None):
+    """Returns the given renderer, or DEFAULT_RENDERER if it is None"""
+    return DEFAULT_RENDERER if renderer is None else renderer
 
 def clear_screen():
-    """Clears the screen using the system
+    """Clears the screen with ANSI escape codes. Nothing is written when the output is not a terminal
+    """
+    DEFAULT_RENDERER.clear()
+
+def get_numeric_array(values):
+    """Returns the values as a numpy array if they are a numeric array or array-like (such as a pandas Series), so they
+       can be validated with one check of their type instead of checking every value
+
+    Args:
+        values (list / np.array): the list or array of input values
+
+    Returns:
+        np.ndarray: The values as an array of bools, integers or floats, or None if the values are a plain list
+                    (or an array of objects) which has to be checked value by value
+    """
+    if isinstance(values, np.ndarray) or hasattr(values, "__array__"):
+        array = np.asarray(values)
+        if array.dtype.kind in "biuf":
+            return array
+    return None
+
+def validate_values(values):
+    """Checks every value of a list one at a time
+
+    Args:
+        values (list): the list of input values
+
+    Exceptions:
+        Raises an exception if not all the values are numerical
     """
-    system('cls||clear')
+    for value in values:
+        float(value)
+
+def sum_array(array: np.ndarray):
+    """Computes the sum of a numeric array. np.sum adds floats in pairs, so the result can differ from adding them one
+       at a time in a loop in the last few bits (it is usually more accurate)
+    """
+    return np.sum(array, axis=0)
+
+def max_array(array: np.ndarray):
+    """Computes the maximum of a non-empty numeric array with the same NaN handling as comparing the values in a loop:
+       NaN values are skipped, unless the first value is NaN, which is then the result
+    """
+    if array.ndim == 1 and np.isnan(array[0]):
+        return array[0]
+    return np.nanmax(array, axis=0)
+
+def min_array(array: np.ndarray):
+    """Computes the minimum of a non-empty numeric array, handling NaN values like 'max_array'"""
+    if array.ndim == 1 and np.isnan(array[0]):
+        return array[0]
+    return np.nanmin(array, axis=0)
 
 def sumvalues(values):
     """Computes the sum of all the values in a list/array
@@ -20,9 +187,12 @@ def sumvalues(values):
     Returns:
         int: The total sum
     """
+    array = get_numeric_array(values)
+    if array is not None:
+        return sum_array(array)
+    
     # Raises exception if list/array contains non-numeric values
-    for value in values:
-        float(value)
+    validate_values(values)
 
     accumulator = 0
     for value in values:
@@ -37,14 +207,19 @@ def maxvalue(values):
         values (list / np.array): the list or array of input values
         
     Exceptions:
-        Raises an exception if not all the values are numerical
+        Raises an exception if not all the values are numerical, or if there are no values
 
     Returns:
         int: The maximum value in the list/array
     """
+    array = get_numeric_array(values)
+    if array is not None:
+        if len(array) == 0:
+            raise Exception("There are no values!")
+        return max_array(array)
+    
     # Raises exception if list/array contains non-numeric values
-    for value in values:
-        float(value)
+    validate_values(values)
     
     current_max = values[0]
     for value in values:
@@ -60,14 +235,19 @@ def minvalue(values):
         values (list / np.array): the list or array of input values
         
     Exceptions:
-        Raises an exception if not all the values are numerical
+        Raises an exception if not all the values are numerical, or if there are no values
 
     Returns:
         int: The mimumum
     """
+    array = get_numeric_array(values)
+    if array is not None:
+        if len(array) == 0:
+            raise Exception("There are no values!")
+        return min_array(array)
+    
     # Raises exception if list/array contains non-numeric values
-    for value in values:
-        float(value)
+    validate_values(values)
     
     current_min = values[0]
     for value in values:
@@ -83,15 +263,14 @@ def meannvalue(values):
         values (list / np.array): the list or array of input values
         
     Exceptions:
-        Raises an exception if not all the values are numerical
+        Raises an exception if not all the values are numerical, or if there are no values
 
     Returns:
         int: The mean of the list/array
     """
-    # Raises exception if list/array contains non-numeric values
-    for value in values:
-        float(value)
-    
+    if len(values) == 0:
+        raise Exception("There are no values!")
+    # sumvalues validates the values, so they are only checked once
     return sumvalues(values) / len(values)
 
 
@@ -107,12 +286,385 @@ def countvalue(values, target):
     Returns:
         int: The count of values matching the target value
     """
+    array = get_numeric_array(values)
+    if array is not None:
+        return int(np.count_nonzero(array == target))
+    
     # Raises exception if list/array contains non-numeric values
-    for value in values:
-        float(value)
+    validate_values(values)
 
     counter = 0
     for value in values:
         if value == target:
             counter += 1
     return counter
+
+
+def describe(values):
+    """Computes the sum, minimum, maximum, mean and count of all the values in a list/array at once, which only
+       validates the values once and (for plain lists) only loops over them once
+
+    Args:
+        values (list / np.array): the list or array of input values
+        
+    Exceptions:
+        Raises an exception if not all the values are numerical, or if there are no values
+
+    Returns:
+        dict: The "sum", "min", "max", "mean" and "count" of the values, which are the same as the results of
+              sumvalues, minvalue, maxvalue, meannvalue and len
+    """
+    if len(values) == 0:
+        raise Exception("There are no values!")
+    
+    array = get_numeric_array(values)
+    if array is not None:
+        total = sum_array(array)
+        current_min = min_array(array)
+        current_max = max_array(array)
+    else:
+        total = 0
+        current_min = values[0]
+        current_max = values[0]
+        for value in values:
+            # Raises exception if list/array contains non-numeric values
+            float(value)
+            total += value
+            if value < current_min:
+                current_min = value
+            if value > current_max:
+                current_max = value
+    
+    return {"sum": total, "min": current_min, "max": current_max, "mean": total / len(values), "count": len(values)}
+
+
+def get_batch(batch):
+    """Returns a batch of values for an accumulator as a numeric array without NaN values (missing measurements)
+
+    Args:
+        batch (list / np.array): the list or array of input values
+        
+    Exceptions:
+        Raises an exception if not all the values are numerical
+
+    Returns:
+        np.ndarray: The values which are not NaN
+    """
+    array = get_numeric_array(batch)
+    if array is None:
+        # Raises exception if list/array contains non-numeric values
+        validate_values(batch)
+        array = np.asarray(batch, dtype=np.float64)
+    array = array.ravel()
+    if array.dtype.kind == "f":
+        array = array[~np.isnan(array)]
+    return array
+
+def check_merge(accumulator, other):
+    """Raises an exception if two accumulators can not be merged because they are different types"""
+    if type(accumulator) is not type(other):
+        raise Exception(f"Can not merge a {type(other).__name__} into a {type(accumulator).__name__}!")
+
+
+class SumAccumulator:
+    """Accumulates the sum of batches of values. NaN values are skipped
+
+    Attributes:
+        total (int / float): The sum of the values so far
+        count (int): The number of values so far
+    """
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch)
+        if len(values) > 0:
+            self.total += sum_array(values)
+            self.count += len(values)
+    
+    def merge(self, other):
+        """Adds the values of another SumAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        self.total += other.total
+        self.count += other.count
+        return self
+    
+    def result(self):
+        """Returns the sum of the values"""
+        return self.total
+
+
+class MinAccumulator:
+    """Accumulates the minimum of batches of values. NaN values are skipped
+
+    Attributes:
+        value (int / float): The minimum value so far, or None if there are no values
+    """
+    def __init__(self):
+        self.value = None
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch)
+        if len(values) > 0:
+            batch_min = np.min(values)
+            self.value = batch_min if self.value is None else min(self.value, batch_min)
+    
+    def merge(self, other):
+        """Adds the values of another MinAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        if other.value is not None:
+            self.value = other.value if self.value is None else min(self.value, other.value)
+        return self
+    
+    def result(self):
+        """Returns the minimum value, or None if there are no values"""
+        return self.value
+
+
+class MaxAccumulator:
+    """Accumulates the maximum of batches of values. NaN values are skipped
+
+    Attributes:
+        value (int / float): The maximum value so far, or None if there are no values
+    """
+    def __init__(self):
+        self.value = None
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch)
+        if len(values) > 0:
+            batch_max = np.max(values)
+            self.value = batch_max if self.value is None else max(self.value, batch_max)
+    
+    def merge(self, other):
+        """Adds the values of another MaxAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        if other.value is not None:
+            self.value = other.value if self.value is None else max(self.value, other.value)
+        return self
+    
+    def result(self):
+        """Returns the maximum value, or None if there are no values"""
+        return self.value
+
+
+class MeanVarianceAccumulator:
+    """Accumulates the mean and variance of batches of values with Welford's method, which stays accurate when the
+    mean is large compared to the variance. Batches and other accumulators are combined with the parallel form of the
+    method (Chan et al.). NaN values are skipped
+
+    Attributes:
+        count (int): The number of values so far
+        mean (float): The mean of the values so far
+        m2 (float): The sum of the squared differences from the mean
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+    
+    def combine(self, count, mean, m2):
+        """Adds the count, mean and m2 of another set of values"""
+        if count == 0:
+            return
+        total_count = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total_count
+        self.m2 += m2 + delta * delta * self.count * count / total_count
+        self.count = total_count
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch).astype(np.float64)
+        if len(values) > 0:
+            batch_mean = float(np.mean(values))
+            self.combine(len(values), batch_mean, float(np.sum(np.square(values - batch_mean))))
+    
+    def merge(self, other):
+        """Adds the values of another MeanVarianceAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        self.combine(other.count, other.mean, other.m2)
+        return self
+    
+    def variance(self, ddof=0):
+        """Returns the variance of the values, or None if there are not more than ddof values
+
+        Args:
+            ddof (int, optional): The delta degrees of freedom, 0 for the population variance or 1 for the sample
+                                  variance. Defaults to 0.
+        """
+        if self.count <= ddof:
+            return None
+        return self.m2 / (self.count - ddof)
+    
+    def result(self):
+        """Returns the mean of the values, or None if there are no values"""
+        return self.mean if self.count > 0 else None
+
+
+class MedianAccumulator:
+    """Accumulates the exact median of batches of values with two heaps: the lower half of the values (negated, so the
+    largest is on top) and the upper half. Adding a value takes O(log n) time, and a batch larger than the values so
+    far is sorted together with them instead. NaN values are skipped
+
+    Attributes:
+        lower ([float]): The negated lower half of the values as a heap, which holds the middle value of an odd count
+        upper ([float]): The upper half of the values as a heap
+    """
+    def __init__(self):
+        self.lower = []
+        self.upper = []
+    
+    def rebuild(self, values):
+        """Replaces the heaps with the halves of an array of values"""
+        values = np.sort(values)
+        half = (len(values) + 1) // 2
+        # Sorted lists are already heaps
+        self.lower = (-values[:half][::-1]).tolist()
+        self.upper = values[half:].tolist()
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch).astype(np.float64)
+        if len(values) > len(self.lower) + len(self.upper):
+            self.rebuild(np.concatenate([values, -np.array(self.lower), np.array(self.upper)]))
+            return
+        for value in values.tolist():
+            if len(self.lower) == 0 or value <= -self.lower[0]:
+                heapq.heappush(self.lower, -value)
+            else:
+                heapq.heappush(self.upper, value)
+            # Keep the lower half the same size as the upper half, or one larger
+            if len(self.lower) > len(self.upper) + 1:
+                heapq.heappush(self.upper, -heapq.heappop(self.lower))
+            elif len(self.upper) > len(self.lower):
+                heapq.heappush(self.lower, -heapq.heappop(self.upper))
+    
+    def merge(self, other):
+        """Adds the values of another MedianAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        self.rebuild(np.concatenate([-np.array(self.lower), self.upper, -np.array(other.lower), other.upper]))
+        return self
+    
+    def result(self):
+        """Returns the median of the values (the mean of the two middle values for an even count), or None if there
+           are no values"""
+        if len(self.lower) == 0:
+            return None
+        if len(self.lower) > len(self.upper):
+            return -self.lower[0]
+        return (-self.lower[0] + self.upper[0]) / 2
+
+
+class ValueCountAccumulator:
+    """Accumulates the number of occurrences of each value in batches of values. NaN values are skipped
+
+    Attributes:
+        counts (collections.Counter): The number of occurrences of each value so far
+    """
+    def __init__(self):
+        self.counts = collections.Counter()
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values, counts = np.unique(get_batch(batch), return_counts=True)
+        self.counts.update(dict(zip(values.tolist(), counts.tolist())))
+    
+    def merge(self, other):
+        """Adds the values of another ValueCountAccumulator, and returns this accumulator"""
+        check_merge(self, other)
+        self.counts.update(other.counts)
+        return self
+    
+    def result(self):
+        """Returns a dictionary of the number of occurrences of each value"""
+        return dict(self.counts)
+
+
+def get_sketch_keys(values, gamma):
+    """Maps values to the integer buckets of a logarithmic quantile sketch. Bucket k > 0 holds positive values in
+    (gamma^(k - 2049), gamma^(k - 2048)], bucket -k holds the negative values of bucket k and bucket 0 holds zero.
+    Keys sort in the same order as the values they hold"""
+    magnitudes = np.abs(values)
+    is_zero = magnitudes < 1e-12
+    exponents = np.ceil(np.log(np.where(is_zero, 1.0, magnitudes)) / np.log(gamma))
+    keys = np.clip(exponents, -2047, 2047).astype(np.int64) + 2048
+    return np.where(is_zero, 0, np.where(values < 0, -keys, keys))
+
+def get_sketch_values(keys, gamma):
+    """Returns the value which represents each bucket of the quantile sketch (see 'get_sketch_keys')"""
+    exponents = np.abs(keys) - 2048
+    # The middle of the bucket in relative terms, so every value in the bucket is within the relative accuracy
+    values = 2 * np.power(gamma, exponents.astype(np.float64)) / (gamma + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+
+class QuantileSketch:
+    """Accumulates approximate quantiles of batches of values in logarithmic buckets. Every quantile is within the
+    relative accuracy of a value with the same rank, and the number of buckets only grows with the range of the values,
+    not with the number of values. NaN values are skipped
+
+    Attributes:
+        relative_accuracy (float): The relative accuracy of the quantiles
+        gamma (float): The ratio between the bounds of a bucket
+        counts (collections.Counter): The number of values in each bucket (see 'get_sketch_keys')
+        count (int): The number of values so far
+    """
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.counts = collections.Counter()
+        self.count = 0
+    
+    def update(self, batch):
+        """Adds a batch of values"""
+        values = get_batch(batch)
+        keys, counts = np.unique(get_sketch_keys(values, self.gamma), return_counts=True)
+        self.counts.update(dict(zip(keys.tolist(), counts.tolist())))
+        self.count += len(values)
+    
+    def merge(self, other):
+        """Adds the values of another QuantileSketch with the same relative accuracy, and returns this sketch"""
+        check_merge(self, other)
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception("Can not merge sketches with different relative accuracies!")
+        self.counts.update(other.counts)
+        self.count += other.count
+        return self
+    
+    def quantile(self, q):
+        """Returns the approximate quantile of the values, interpolating between the two values around the rank
+           q * (count - 1) like np.quantile
+
+        Args:
+            q (float / [float]): The quantile, or a list of quantiles, between 0 and 1
+
+        Exceptions:
+            Raises an exception if a quantile is not between 0 and 1
+
+        Returns:
+            float / np.ndarray: The quantile (or an array of the quantiles), or None if there are no values
+        """
+        quantiles = np.asarray(q, dtype=np.float64)
+        if np.any((quantiles < 0) | (quantiles > 1)):
+            raise Exception("Quantiles must be between 0 and 1!")
+        if self.count == 0:
+            return None
+        
+        keys = np.sort(np.fromiter(self.counts.keys(), dtype=np.int64, count=len(self.counts)))
+        cumulative_counts = np.cumsum([self.counts[key] for key in keys.tolist()])
+        bucket_values = get_sketch_values(keys, self.gamma)
+        
+        ranks = quantiles * (self.count - 1)
+        lower = bucket_values[np.searchsorted(cumulative_counts, np.floor(ranks), side="right")]
+        upper = bucket_values[np.searchsorted(cumulative_counts, np.ceil(ranks), side="right")]
+        result = lower + (upper - lower) * (ranks - np.floor(ranks))
+        return float(result) if result.ndim == 0 else result
+    
+    def result(self):
+        """Returns the approximate median of the values, or None if there are no values"""
+        return self.quantile(0.5)